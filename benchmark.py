@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""
+Times the binary codecs of the classicbox package on deterministic synthetic
+inputs and prints the results as JSON, so that runs from different commits
+can be compared.
+
+Syntax:
+    benchmark.py [--quick] [--repeat <N>] [<benchmark name> ...]
+
+Options:
+* --quick -- Skip the largest inputs (such as 100 MB forks).
+* --repeat <N> -- Number of times to time each benchmark. Defaults to 5.
+* <benchmark name> -- Only run benchmarks whose name starts with one of
+                      the specified prefixes. For example 'read_macbinary'.
+
+Output Format:
+* It's JSON.
+* Grammar:
+    * ROOT: {commit, python_version, platform, repeat, results: [Result, ...]}
+    * Result: {name, params, best_seconds, mean_seconds, bytes}
+        * bytes -- Size of the encoded input or output, or null.
+"""
+
+from __future__ import absolute_import
+
+from classicbox.alias.record import Extra
+from classicbox.alias.record import read_alias_record
+from classicbox.alias.record import write_alias_record
+from classicbox.io import BytesIO
+from classicbox.macbinary import _compute_macbinary_crc
+from classicbox.macbinary import read_macbinary
+from classicbox.macbinary import write_macbinary
+from classicbox.resource_fork import read_resource_fork
+from classicbox.resource_fork import write_resource_fork
+from classicbox.util import DEVNULL
+import json
+import platform
+import random
+import subprocess
+import sys
+import timeit
+
+
+_KB = 1024
+_MB = 1024 * 1024
+
+_FORK_LENGTHS = [0, 1 * _KB, 1 * _MB, 100 * _MB]
+_RESOURCE_COUNTS = [1, 100, 1000, 50000]
+_DIRECTORY_DEPTHS = [1, 10, 100, 1000]
+_CRC_LENGTHS = [128, 64 * _KB, 1 * _MB, 100 * _MB]
+
+# Inputs at least this large are skipped by --quick
+_QUICK_LIMIT = 10 * _MB
+
+# A resource map's offset to its name list is 16 bits wide, so only maps with
+# few enough resources can carry names. Larger synthetic maps use a single
+# type and unnamed resources, as large real-world forks tend to.
+_MAX_NAMED_RESOURCE_COUNT = 1000
+
+_SEED = 1984
+
+# ------------------------------------------------------------------------------
+
+def main(args):
+    quick = False
+    repeat = 5
+    prefixes = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == '--quick':
+            quick = True
+        elif arg == '--repeat':
+            repeat = int(args.pop(0))
+        elif arg.startswith('-'):
+            sys.exit('syntax: benchmark.py [--quick] [--repeat <N>] [<benchmark name> ...]')
+            return
+        else:
+            prefixes.append(arg)
+    
+    results = []
+    for (name, params, setup) in _list_benchmarks(quick):
+        if len(prefixes) > 0 and not any(name.startswith(p) for p in prefixes):
+            continue
+        (block, size) = setup()
+        times = timeit.repeat(block, number=1, repeat=repeat)
+        results.append({
+            'name': name,
+            'params': params,
+            'best_seconds': min(times),
+            'mean_seconds': sum(times) / len(times),
+            'bytes': size,
+        })
+    
+    print json.dumps({
+        'commit': _current_commit(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }, indent=2, sort_keys=True)
+
+
+def _list_benchmarks(quick):
+    """
+    Yields a (name, params, setup) tuple for each benchmark.
+    
+    Calling `setup()` generates the benchmark's input and returns a tuple
+    (block, size), where `block` is a zero-argument function that performs
+    one timed iteration and `size` is the size of the encoded input or output.
+    Inputs are only generated for benchmarks that are set up.
+    """
+    for fork_length in _FORK_LENGTHS:
+        if quick and fork_length >= _QUICK_LIMIT:
+            continue
+        params = {'fork_length': fork_length}
+        yield ('read_macbinary', params,
+            lambda fork_length=fork_length: _setup_read_macbinary(fork_length))
+        yield ('write_macbinary', params,
+            lambda fork_length=fork_length: _setup_write_macbinary(fork_length))
+    
+    for resource_count in _RESOURCE_COUNTS:
+        params = {'resource_count': resource_count}
+        yield ('read_resource_fork', params,
+            lambda resource_count=resource_count: _setup_read_resource_fork(resource_count))
+        yield ('write_resource_fork', params,
+            lambda resource_count=resource_count: _setup_write_resource_fork(resource_count))
+    
+    for depth in _DIRECTORY_DEPTHS:
+        params = {'directory_depth': depth}
+        yield ('read_alias_record', params,
+            lambda depth=depth: _setup_read_alias_record(depth))
+    
+    for length in _CRC_LENGTHS:
+        if quick and length >= _QUICK_LIMIT:
+            continue
+        yield ('compute_macbinary_crc', {'length': length},
+            lambda length=length: _setup_compute_macbinary_crc(length))
+
+# ------------------------------------------------------------------------------
+# Benchmarks
+
+def _setup_read_macbinary(fork_length):
+    macbinary_bytes = _macbinary_bytes(fork_length)
+    def block():
+        read_macbinary(BytesIO(macbinary_bytes))
+    return (block, len(macbinary_bytes))
+
+
+def _setup_write_macbinary(fork_length):
+    def block():
+        write_macbinary(BytesIO(), _macbinary(fork_length))
+    return (block, _macbinary_length(fork_length))
+
+
+def _setup_read_resource_fork(resource_count):
+    resource_fork_bytes = _resource_fork_bytes(resource_count)
+    def block():
+        read_resource_fork(BytesIO(resource_fork_bytes))
+    return (block, len(resource_fork_bytes))
+
+
+def _setup_write_resource_fork(resource_count):
+    resource_map = _resource_map(resource_count)
+    def block():
+        write_resource_fork(BytesIO(), resource_map)
+    
+    # (Measure the output with an untimed write)
+    output = BytesIO()
+    write_resource_fork(output, resource_map)
+    return (block, len(output.getvalue()))
+
+
+def _setup_read_alias_record(depth):
+    alias_record_bytes = _alias_record_bytes(depth)
+    def block():
+        read_alias_record(BytesIO(alias_record_bytes))
+    return (block, len(alias_record_bytes))
+
+
+def _setup_compute_macbinary_crc(length):
+    data = _synthetic_bytes(length)
+    def block():
+        _compute_macbinary_crc(data)
+    return (block, length)
+
+# ------------------------------------------------------------------------------
+# Synthetic Inputs
+
+def _synthetic_bytes(length, _cache={}):
+    """
+    Returns `length` deterministic pseudo-random bytes.
+    """
+    block = _cache.get('block')
+    if block is None:
+        rng = random.Random(_SEED)
+        block = _cache['block'] = bytes(bytearray(
+            [rng.randrange(256) for i in xrange(64 * _KB)]))
+    (full_blocks, remainder) = divmod(length, len(block))
+    return block * full_blocks + block[:remainder]
+
+
+def _macbinary(fork_length):
+    return {
+        'filename': u'Synthetic File',
+        'file_type': u'APPL',
+        'file_creator': u'SYNT',
+        'created': 3000000000,
+        'modified': 3000000000,
+        'data_fork': _synthetic_bytes(fork_length),
+        'resource_fork': _synthetic_bytes(fork_length // 2),
+    }
+
+
+def _macbinary_bytes(fork_length):
+    output = BytesIO()
+    write_macbinary(output, _macbinary(fork_length))
+    return output.getvalue()
+
+
+def _macbinary_length(fork_length):
+    # Header, then each fork padded to a multiple of 128 bytes
+    padded_length = lambda length: (length + 127) // 128 * 128
+    return 128 + padded_length(fork_length) + padded_length(fork_length // 2)
+
+
+_TYPE_CODES = [u'STR#', u'ICN#', u'PICT', u'snd ', u'DLOG', u'DITL', u'MENU', u'vers']
+
+def _resource_map(resource_count):
+    named = resource_count <= _MAX_NAMED_RESOURCE_COUNT
+    type_count = min(resource_count, len(_TYPE_CODES)) if named else 1
+    
+    rng = random.Random(_SEED)
+    resource_types = [{'code': code, 'resources': []} for code in _TYPE_CODES[:type_count]]
+    for i in xrange(resource_count):
+        data_length = rng.randrange(0, 256)
+        resource_types[i % type_count]['resources'].append({
+            'id': 128 + (i // type_count),
+            'name': (u'Resource %d' % i) if named else u'',
+            'attributes': 0,
+            'data': _synthetic_bytes(data_length),
+        })
+    return {'resource_types': resource_types}
+
+
+def _resource_fork_bytes(resource_count):
+    output = BytesIO()
+    write_resource_fork(output, _resource_map(resource_count))
+    return output.getvalue()
+
+
+def _alias_record_bytes(depth):
+    directory_ids = list(xrange(1000, 1000 + depth))
+    absolute_path = u'Synthetic:' + u':'.join([u'D%d' % i for i in directory_ids]) + u':app'
+    output = BytesIO()
+    write_alias_record(output, {
+        'alias_kind': 0,
+        'volume_name': u'Synthetic',
+        'file_name': u'app',
+        'nlvl_from': 1,
+        'nlvl_to': 1,
+        'extras': [
+            Extra(0, 'parent_directory_name', u'D%d' % directory_ids[-1]),
+            Extra(1, 'directory_ids', list(reversed(directory_ids))),
+            Extra(2, 'absolute_path', absolute_path),
+            Extra(0xFFFF, 'end', None),
+        ]
+    })
+    return output.getvalue()
+
+# ------------------------------------------------------------------------------
+# Utility
+
+def _current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=DEVNULL).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -14,6 +14,7 @@ from classicbox.io import BytesIO
 from classicbox.macbinary import FF_HAS_BEEN_INITED
 from classicbox.macbinary import FF_IS_ALIAS
 from classicbox.macbinary import write_macbinary_to_buffer
+from classicbox.resource_fork import ResourceFork
 from classicbox.resource_fork import write_resource_fork
 
 
@@ -42,23 +43,16 @@ def create_alias_file(
     alis_resource_contents = alis_resource_contents_output.getvalue()
     
     # Serialize alias file resource fork
-    resource_fork = BytesIO()
-    write_resource_fork(resource_fork, {
-        'resource_types': [
-            {
-                'code': alias_resource_info['type'],
-                'resources': [
-                    {
-                        'id': alias_resource_info['id'],
-                        'name': alias_resource_info['name'],
-                        'attributes': alias_resource_info['attributes'],
-                        'data': alis_resource_contents
-                    }
-                ]
-            }
-        ]
+    resource_fork = ResourceFork()
+    resource_fork.add(alias_resource_info['type'], {
+        'id': alias_resource_info['id'],
+        'name': alias_resource_info['name'],
+        'attributes': alias_resource_info['attributes'],
+        'data': alis_resource_contents
     })
-    resource_fork_contents = resource_fork.getvalue()
+    resource_fork_output = BytesIO()
+    write_resource_fork(resource_fork_output, resource_fork)
+    resource_fork_contents = resource_fork_output.getvalue()
     
     # Serialize MacBinary-encoded alias file
     macbinary_buffer = write_macbinary_to_buffer({
@@ -4,13 +4,15 @@ Manipulates MacOS alias records.
 
 from classicbox.io import at_eof
 from classicbox.io import BytesIO
+from classicbox.io import make_record_type
 from classicbox.io import NULL_BYTE
 from classicbox.io import read_fixed_bytes
-from classicbox.io import read_structure
-from classicbox.io import read_unsigned
+from classicbox.io import read_uint16
+from classicbox.io import read_uint32_array
+from classicbox.io import StructCodec
 from classicbox.io import StructMember
-from classicbox.io import write_structure
-from classicbox.io import write_unsigned
+from classicbox.io import write_uint16
+from classicbox.io import write_uint32_array
 
 from collections import namedtuple
 
@@ -66,12 +68,19 @@ Extra = namedtuple(
     'Extra',
     ('type', 'name', 'value'))
 
+# Compact alternative to the alias record dictionary.
+# See the `compact` parameter of read_alias_record().
+AliasRecord = make_record_type('AliasRecord', _ALIAS_RECORD_MEMBERS)
+
 # ------------------------------------------------------------------------------
 
-def read_alias_record(input):
-    return read_structure(input, _ALIAS_RECORD_MEMBERS, external_readers={
-        'read_extras': _read_extras
-    })
+def read_alias_record(input, compact=False):
+    """
+    Reads an alias record from the specified input stream.
+    
+    Returns a dictionary, or a compact AliasRecord record if `compact` is True.
+    """
+    return _ALIAS_RECORD_CODEC.read(input, AliasRecord if compact else None)
 
 
 def _read_extras(input, ignored):
@@ -82,8 +91,8 @@ def _read_extras(input, ignored):
     extras = []
     this_module = globals()
     while True:
-        extra_type = read_unsigned(input, 2)
-        extra_length = read_unsigned(input, 2)
+        extra_type = read_uint16(input)
+        extra_length = read_uint16(input)
         extra_content = read_fixed_bytes(input, extra_length)
         if extra_length & 0x1 == 1:
             input.read(1)   # padding byte
@@ -109,11 +118,7 @@ def _read_parent_directory_name_extra_content(extra_content):
 
 
 def _read_directory_ids_extra_content(extra_content):
-    extra_value = []
-    extra_content_input = BytesIO(extra_content)
-    for i in xrange(len(extra_content) // 4):
-        extra_value.append(read_unsigned(extra_content_input, 4))
-    return extra_value
+    return read_uint32_array(BytesIO(extra_content), len(extra_content) // 4)
 
 
 def _read_absolute_path_extra_content(extra_content):
@@ -143,14 +148,12 @@ def write_alias_record(output, alias_record):
         # Write the 'record_size' field
         output.seek(start_offset + 4)
         record_size = end_offset - start_offset
-        write_unsigned(output, 2, record_size)
+        write_uint16(output, record_size)
         output.seek(end_offset)
 
 
 def _write_alias_record_structure(output, alias_record):
-    write_structure(output, _ALIAS_RECORD_MEMBERS, alias_record, external_writers={
-        'write_extras': _write_extras
-    })
+    _ALIAS_RECORD_CODEC.write(output, alias_record)
 
 
 def _write_extras(output, ignored, value):
@@ -163,8 +166,8 @@ def _write_extras(output, ignored, value):
         extra_content = extra_content_output.getvalue()
         extra_length = len(extra_content)
         
-        write_unsigned(output, 2, extra.type)
-        write_unsigned(output, 2, extra_length)
+        write_uint16(output, extra.type)
+        write_uint16(output, extra_length)
         output.write(extra_content)
         if extra_length & 0x1 == 1:
             output.write(NULL_BYTE)    # padding byte
@@ -175,8 +178,7 @@ def _write_parent_directory_name_extra_content(output, extra_value):
 
 
 def _write_directory_ids_extra_content(output, extra_value):
-    for path_id in extra_value:
-        write_unsigned(output, 4, path_id)
+    write_uint32_array(output, extra_value)
 
 
 def _write_absolute_path_extra_content(output, extra_value):
@@ -192,6 +194,13 @@ def _write_unknown_extra_content(output, extra_value):
 
 # ------------------------------------------------------------------------------
 
+# (Defined after the extras readers and writers, which it refers to)
+_ALIAS_RECORD_CODEC = StructCodec(_ALIAS_RECORD_MEMBERS,
+    external_readers={'read_extras': _read_extras},
+    external_writers={'write_extras': _write_extras})
+
+# ------------------------------------------------------------------------------
+
 def print_alias_record(alias_record):
     print 'Alias Information'
     print '================='
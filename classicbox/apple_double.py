@@ -0,0 +1,103 @@
+"""
+Reads AppleSingle and AppleDouble files.
+
+An AppleDouble file (such as the "._" file that accompanies a file copied to
+a non-HFS volume) holds the resource fork and Finder info of a file whose data
+fork is stored separately. An AppleSingle file holds all of a file's forks.
+Both formats share the same header and entry table.
+"""
+
+from __future__ import absolute_import
+
+from classicbox.io import read_fixed_bytes
+from classicbox.io import StreamWindow
+from classicbox.io import StructCodec
+from classicbox.io import StructMember
+
+
+_APPLE_DOUBLE_HEADER_MEMBERS = [
+    StructMember('magic_number', 'unsigned', 4, None),
+    StructMember('version_number', 'unsigned', 4, None),
+    StructMember('filler', 'fixed_bytes', 16, 0),
+    StructMember('entry_count', 'unsigned', 2, None),
+]
+
+_APPLE_DOUBLE_ENTRY_MEMBERS = [
+    StructMember('id', 'unsigned', 4, None),
+    StructMember('offset', 'unsigned', 4, None),
+    StructMember('length', 'unsigned', 4, None),
+]
+
+_APPLE_DOUBLE_HEADER_CODEC = StructCodec(_APPLE_DOUBLE_HEADER_MEMBERS)
+_APPLE_DOUBLE_ENTRY_CODEC = StructCodec(_APPLE_DOUBLE_ENTRY_MEMBERS)
+
+# Magic Numbers
+APPLE_SINGLE_MAGIC_NUMBER = 0x00051600
+APPLE_DOUBLE_MAGIC_NUMBER = 0x00051607
+
+_VERSION_NUMBERS = (0x00010000, 0x00020000)
+
+# Entry IDs
+ENTRY_DATA_FORK = 1
+ENTRY_RESOURCE_FORK = 2
+ENTRY_REAL_NAME = 3
+ENTRY_COMMENT = 4
+ENTRY_FINDER_INFO = 9
+
+# ------------------------------------------------------------------------------
+
+def sniff_apple_double(header):
+    """
+    Determines whether the specified bytes begin an AppleSingle or
+    AppleDouble file, by checking the magic number and version number.
+    
+    Returns APPLE_SINGLE_MAGIC_NUMBER, APPLE_DOUBLE_MAGIC_NUMBER, or None.
+    """
+    if len(header) < _APPLE_DOUBLE_HEADER_CODEC.size:
+        return None
+    header = _APPLE_DOUBLE_HEADER_CODEC.unpack_from(header)
+    if header['magic_number'] not in (APPLE_SINGLE_MAGIC_NUMBER, APPLE_DOUBLE_MAGIC_NUMBER):
+        return None
+    if header['version_number'] not in _VERSION_NUMBERS:
+        return None
+    return header['magic_number']
+
+
+def read_apple_double_entries(input):
+    """
+    Reads the header and entry table of the AppleSingle or AppleDouble file
+    in the specified input stream.
+    
+    Returns a list of entries. Each entry is a dictionary of the format:
+    * id : unsigned(4) -- What the entry contains. See ENTRY_* constants.
+    * offset : unsigned(4) -- Offset of the entry's contents within the file.
+    * length : unsigned(4) -- Length of the entry's contents.
+    
+    Raises ValueError if the input is not an AppleSingle or AppleDouble file.
+    """
+    header_bytes = read_fixed_bytes(input, _APPLE_DOUBLE_HEADER_CODEC.size)
+    if sniff_apple_double(header_bytes) is None:
+        raise ValueError('Not an AppleSingle or AppleDouble file.')
+    header = _APPLE_DOUBLE_HEADER_CODEC.unpack_from(header_bytes)
+    
+    entry_table_bytes = read_fixed_bytes(
+        input, header['entry_count'] * _APPLE_DOUBLE_ENTRY_CODEC.size)
+    return [
+        _APPLE_DOUBLE_ENTRY_CODEC.unpack_from(
+            entry_table_bytes, i * _APPLE_DOUBLE_ENTRY_CODEC.size)
+        for i in xrange(header['entry_count'])]
+
+
+def open_apple_double_entry(input, entry_id):
+    """
+    Returns a StreamWindow over the contents of the entry with the specified ID
+    in the AppleSingle or AppleDouble file in the specified seekable input
+    stream, or None if the file has no such entry.
+    
+    The input stream must remain open for as long as the window is in use.
+    """
+    input.seek(0)
+    for entry in read_apple_double_entries(input):
+        if entry['id'] == entry_id:
+            return StreamWindow(input, entry['offset'], entry['length'])
+    return None
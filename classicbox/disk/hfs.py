@@ -7,10 +7,16 @@ Support for MFS disk images may be added in the future.
 
 from __future__ import absolute_import
 
-from classicbox.io import write_nulls
+from classicbox.io import touch_temp
+from classicbox.io import write_uint32_array
 from classicbox.time import convert_ctime_string_to_mac_timestamp
+from classicbox.time import convert_local_to_mac_timestamp
+from classicbox.util import allocate_file
+from classicbox.util import clone_file
 from classicbox.util import DEVNULL
 from collections import namedtuple
+import errno
+import hashlib
 import os
 import re
 import shutil
@@ -246,23 +252,69 @@ def hfs_format(disk_image_filepath, name):
     * name : unicode -- Name of the new volume.
     """
     subprocess.check_call(
-        ['hformat', '-l', name.encode('macroman'), disk_image_filepath],
+        ['hformat'] + _hformat_arguments(name) + [disk_image_filepath],
         stdout=DEVNULL, stderr=DEVNULL)
 
 
-def hfs_format_new(disk_image_filepath, name, size):
+def _hformat_arguments(name):
+    return ['-l', name.encode('macroman')]
+
+
+def hfs_format_new(disk_image_filepath, name, size, preallocate=False, template_cache=None):
     """
     Creates a new disk image file, formats it, and mounts it.
     
+    The disk image file is created as a sparse file, so that creating it
+    takes the same time regardless of its size.
+    
+    If a template cache is specified (or configured with the
+    CLASSICBOX_HFS_TEMPLATE_CACHE_DIRPATH environment variable), the new disk
+    image is cloned from a cached blank disk image with the same name and
+    size instead of being formatted from scratch.
+    
     Arguments:
     * disk_image_filepath : unicode|str-native -- Path to the disk image file.
     * name : unicode -- Name of the new volume.
     * size : int -- Size of the volume to create, in bytes.
+    * preallocate : bool -- Whether to allocate all blocks of the disk image
+                            file up front rather than creating a sparse file.
+                            Avoids fragmentation of the file as the volume
+                            fills up. Defaults to False.
+                            Templates are not used if True.
+    * template_cache : HFSTemplateCache (optional) -- Cache of blank disk images
+                                                      to clone from.
     """
-    with open(disk_image_filepath, 'wb') as output:
-        write_nulls(output, size)
+    if template_cache is None:
+        template_cache = _default_template_cache()
+    
+    if template_cache is not None and not preallocate:
+        template_filepath = template_cache.template_for(name, size)
+        clone_file(template_filepath, disk_image_filepath)
+        
+        # Make the volume look like it was just formatted
+        _hfs_set_volume_dates(
+            disk_image_filepath, convert_local_to_mac_timestamp(time.time()))
         
-    hfs_format(disk_image_filepath, name)
+        hfs_mount(disk_image_filepath)
+    else:
+        allocate_file(disk_image_filepath, size, preallocate)
+        hfs_format(disk_image_filepath, name)
+
+
+def hfs_clone_new(template_disk_image_filepath, disk_image_filepath):
+    """
+    Creates a new disk image file that is a copy of the specified
+    (already formatted) template disk image, and mounts it.
+    
+    Where the filesystem supports it, the copy is a reflink that shares
+    blocks with the template, and so takes constant time.
+    
+    Arguments:
+    * template_disk_image_filepath : unicode|str-native -- Path to the template.
+    * disk_image_filepath : unicode|str-native -- Path to the disk image file.
+    """
+    clone_file(template_disk_image_filepath, disk_image_filepath)
+    return hfs_mount(disk_image_filepath)
 
 
 def hfs_mkdir(macdirpath):
@@ -276,6 +328,174 @@ def hfs_mkdir(macdirpath):
         ['hmkdir', macdirpath.encode('macroman')],
         stdout=DEVNULL, stderr=DEVNULL)
 
+# ------------------------------------------------------------------------------
+# Blank Volume Templates
+
+_TEMPLATE_CACHE_DIRPATH_ENVIRON_KEY = 'CLASSICBOX_HFS_TEMPLATE_CACHE_DIRPATH'
+_DEFAULT_TEMPLATE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Templates are formatted into temporary files with this prefix and suffix.
+# A temporary file older than the maximum age was left behind by a formatting
+# run that crashed, rather than belonging to a run still in progress.
+_TEMP_TEMPLATE_PREFIX = 'Template'
+_TEMP_TEMPLATE_SUFFIX = '.tmp'
+_MAX_TEMP_TEMPLATE_AGE = 60 * 60   # seconds
+
+class HFSTemplateCache(object):
+    """
+    A directory of blank HFS disk images ("templates") that have already been
+    formatted, keyed by volume size, volume name, and formatting options.
+    
+    Cloning a template is much cheaper than formatting a new disk image.
+    See `hfs_format_new()`.
+    
+    Templates are evicted in least recently used order whenever the total
+    space used by the cache exceeds `max_bytes`. Temporary files left behind
+    by formatting runs that crashed are deleted at the same time.
+    """
+    
+    def __init__(self, cache_dirpath, max_bytes=_DEFAULT_TEMPLATE_CACHE_MAX_BYTES):
+        self.cache_dirpath = cache_dirpath
+        self.max_bytes = max_bytes
+        
+        if not os.path.exists(cache_dirpath):
+            os.makedirs(cache_dirpath)
+    
+    def template_for(self, name, size):
+        """
+        Returns the path to a blank disk image with the specified volume name
+        and size, formatting a new template if none is cached.
+        
+        The returned template must not be modified.
+        """
+        template_filepath = os.path.join(
+            self.cache_dirpath, self._template_filename(name, size))
+        if os.path.exists(template_filepath):
+            # Mark as recently used
+            os.utime(template_filepath, None)
+            return template_filepath
+        
+        # Format a new template.
+        # Move it into place only once complete, so that a concurrent user of
+        # the cache never sees a partially formatted template.
+        temp_filepath = touch_temp(
+            prefix=_TEMP_TEMPLATE_PREFIX, suffix=_TEMP_TEMPLATE_SUFFIX,
+            dir=self.cache_dirpath)
+        try:
+            allocate_file(temp_filepath, size)
+            hfs_format(temp_filepath, name)
+            os.rename(temp_filepath, template_filepath)
+        except:
+            os.remove(temp_filepath)
+            raise
+        
+        self.evict(_keep_filepath=template_filepath)
+        return template_filepath
+    
+    def evict(self, _keep_filepath=None):
+        """
+        Deletes least recently used templates until the cache uses no more
+        than `max_bytes`.
+        
+        Also deletes orphaned temporary files from formatting runs that
+        crashed. Temporary files of runs that may still be in progress are
+        kept, but count toward `max_bytes`.
+        """
+        now = time.time()
+        templates = []
+        total_bytes = 0
+        for filename in os.listdir(self.cache_dirpath):
+            filepath = os.path.join(self.cache_dirpath, filename)
+            is_temp_template = (
+                filename.startswith(_TEMP_TEMPLATE_PREFIX) and
+                filename.endswith(_TEMP_TEMPLATE_SUFFIX))
+            if not filename.endswith('.dsk') and not is_temp_template:
+                continue
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                # Deleted concurrently
+                continue
+            used_bytes = _used_bytes(stat)
+            
+            if is_temp_template:
+                if now - stat.st_mtime > _MAX_TEMP_TEMPLATE_AGE:
+                    _remove_if_exists(filepath)
+                else:
+                    total_bytes += used_bytes
+                continue
+            
+            templates.append((stat.st_mtime, filepath, used_bytes))
+            total_bytes += used_bytes
+        
+        templates.sort()    # least recently used first
+        for (_, filepath, used_bytes) in templates:
+            if total_bytes <= self.max_bytes:
+                break
+            if filepath == _keep_filepath:
+                continue
+            _remove_if_exists(filepath)
+            total_bytes -= used_bytes
+    
+    def clear(self):
+        """
+        Deletes all templates.
+        """
+        for filename in os.listdir(self.cache_dirpath):
+            if filename.endswith('.dsk'):
+                os.remove(os.path.join(self.cache_dirpath, filename))
+    
+    @staticmethod
+    def _template_filename(name, size):
+        # (Includes the arguments to hformat, which determine the formatting options)
+        key = repr((size, _hformat_arguments(name)))
+        return '%d-%s.dsk' % (size, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def _default_template_cache():
+    cache_dirpath = os.environ.get(_TEMPLATE_CACHE_DIRPATH_ENVIRON_KEY)
+    if not cache_dirpath:
+        return None
+    return HFSTemplateCache(cache_dirpath)
+
+
+def _remove_if_exists(filepath):
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        # Deleted concurrently?
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _used_bytes(stat):
+    # Templates are sparse, so count allocated blocks rather than apparent size
+    st_blocks = getattr(stat, 'st_blocks', None)
+    return st_blocks * 512 if st_blocks is not None else stat.st_size
+
+
+# Offset of the Master Directory Block (MDB) of an HFS volume.
+# A copy (the Alternate MDB) resides 1024 bytes before the end of the volume.
+_MDB_OFFSET = 1024
+_MDB_SIGNATURE = b'BD'
+
+def _hfs_set_volume_dates(disk_image_filepath, mac_timestamp):
+    """
+    Sets the creation and modification dates of the unmounted HFS volume in
+    the specified disk image, in both the MDB and the Alternate MDB.
+    
+    NOTE: The creation date of the root directory in the catalog file is not
+          altered. Neither hfsutils nor the Finder displays it.
+    """
+    disk_image_size = os.path.getsize(disk_image_filepath)
+    with open(disk_image_filepath, 'r+b') as file:
+        for mdb_offset in (_MDB_OFFSET, disk_image_size - _MDB_OFFSET):
+            file.seek(mdb_offset)
+            if file.read(2) != _MDB_SIGNATURE:
+                continue
+            # drCrDate, drLsMod
+            write_uint32_array(file, [mac_timestamp, mac_timestamp])
+
 # ------------------------------------------------------------------------------
 # HFS Path Manipulation
 
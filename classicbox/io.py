@@ -4,9 +4,17 @@ Reads and writes binary data from structures and streams.
 
 from __future__ import absolute_import
 
+import codecs
 from collections import namedtuple
 from contextlib import contextmanager
+try:
+    from collections.abc import MutableMapping  # Python 3.3+
+except ImportError:
+    from collections import MutableMapping
+import mmap
 import os
+import struct
+import sys
 import tempfile
 
 
@@ -14,6 +22,15 @@ StructMember = namedtuple(
     'StructMember',
     ('name', 'type', 'subtype', 'default_value'))
 
+# Big-endian integer formats
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+
 # ------------------------------------------------------------------------------
 # Read
 
@@ -36,18 +53,30 @@ def read_fixed_string(input, num_bytes):
 
 
 def read_fixed_bytes(input, num_bytes):
-    return input.read(num_bytes)
+    return _as_bytes(input.read(num_bytes))
 
 
 def read_unsigned(input, num_bytes):
+    reader = _UNSIGNED_READERS.get(num_bytes, None)
+    if reader is not None:
+        return reader(input)
+    
+    value_bytes = read_fixed_bytes(input, num_bytes)
+    if len(value_bytes) != num_bytes:
+        # (Like the fixed-width readers)
+        raise struct.error('unpack requires a string argument of length %d' % num_bytes)
+    
     value = 0
-    for i in xrange(num_bytes):
-        value = value << 8
-        value = value | ord(input.read(1))
+    for b in iterord(value_bytes):
+        value = (value << 8) | b
     return value
 
 
 def read_signed(input, num_bytes):
+    reader = _SIGNED_READERS.get(num_bytes, None)
+    if reader is not None:
+        return reader(input)
+    
     overflow_value = (1 << (8*num_bytes - 1))
     
     value = read_unsigned(input, num_bytes)
@@ -55,20 +84,64 @@ def read_signed(input, num_bytes):
     return signed_value
 
 
+def read_uint8(input):
+    return _UINT8.unpack(input.read(1))[0]
+
+
+def read_uint16(input):
+    return _UINT16.unpack(input.read(2))[0]
+
+
+def read_uint32(input):
+    return _UINT32.unpack(input.read(4))[0]
+
+
+def read_int8(input):
+    return _INT8.unpack(input.read(1))[0]
+
+
+def read_int16(input):
+    return _INT16.unpack(input.read(2))[0]
+
+
+def read_int32(input):
+    return _INT32.unpack(input.read(4))[0]
+
+
+def read_uint16_array(input, count):
+    """
+    Reads the specified number of consecutive unsigned 16-bit integers,
+    returning a list.
+    """
+    return list(struct.unpack('>%dH' % count, input.read(2 * count)))
+
+
+def read_uint32_array(input, count):
+    """
+    Reads the specified number of consecutive unsigned 32-bit integers,
+    returning a list.
+    """
+    return list(struct.unpack('>%dI' % count, input.read(4 * count)))
+
+
+_UNSIGNED_READERS = {1: read_uint8, 2: read_uint16, 4: read_uint32}
+_SIGNED_READERS = {1: read_int8, 2: read_int16, 4: read_int32}
+
+
 def read_pascal_string(input, max_string_length):
     return read_pascal_bytes(input, max_string_length).decode('macroman')
 
 
 def read_pascal_bytes(input, max_string_length):
-    str_length = ord(input.read(1))
-    str = input.read(str_length)
+    str_length = read_uint8(input)
+    str = _as_bytes(input.read(str_length))
     if max_string_length is not None:
         zero = input.read(max_string_length - str_length)
     return str
 
 
 def read_until_eof(input, ignored):
-    return input.read()
+    return _as_bytes(input.read())
 
 # ------------------------------------------------------------------------------
 # Write
@@ -102,13 +175,20 @@ def write_fixed_bytes(output, num_bytes, value):
 
 
 def write_unsigned(output, num_bytes, value):
+    writer = _UNSIGNED_WRITERS.get(num_bytes, None)
+    if writer is not None:
+        writer(output, value)
+        return
+    
     shift = (num_bytes - 1) * 8
     mask = 0xFF << shift
     
+    value_bytes = bytearray(num_bytes)
     for i in xrange(num_bytes):
-        output.write(bchr((value & mask) >> shift))
+        value_bytes[i] = (value & mask) >> shift
         shift -= 8
         mask = mask >> 8
+    output.write(value_bytes)
 
 
 def write_signed(output, num_bytes, value):
@@ -118,6 +198,47 @@ def write_signed(output, num_bytes, value):
     write_unsigned(output, num_bytes, unsigned_value)
 
 
+def write_uint16_array(output, values):
+    """
+    Writes the specified unsigned 16-bit integers consecutively.
+    
+    Raises struct.error if any value is out of range.
+    """
+    output.write(struct.pack('>%dH' % len(values), *values))
+
+
+def write_uint32_array(output, values):
+    """
+    Writes the specified unsigned 32-bit integers consecutively.
+    
+    Raises struct.error if any value is out of range.
+    """
+    output.write(struct.pack('>%dI' % len(values), *values))
+
+
+# NOTE: Like write_unsigned(), the following writers silently truncate values
+#       that are out of range. Negative values are written in two's complement.
+
+def write_uint8(output, value):
+    output.write(_UINT8.pack(value & 0xFF))
+
+
+def write_uint16(output, value):
+    output.write(_UINT16.pack(value & 0xFFFF))
+
+
+def write_uint32(output, value):
+    output.write(_UINT32.pack(value & 0xFFFFFFFF))
+
+
+write_int8 = write_uint8
+write_int16 = write_uint16
+write_int32 = write_uint32
+
+
+_UNSIGNED_WRITERS = {1: write_uint8, 2: write_uint16, 4: write_uint32}
+
+
 def write_pascal_string(output, max_string_length, value):
     write_pascal_bytes(output, max_string_length, value.encode('macroman'))
 
@@ -127,15 +248,820 @@ def write_pascal_bytes(output, max_string_length, value):
         if len(value) > max_string_length:
             raise ValueError('Value exceeds the maximum byte count.')
     str_length = len(value)
-    output.write(bchr(str_length))
-    output.write(value)
-    if max_string_length is not None:
-        write_nulls(output, max_string_length - str_length)
+    padding_length = 0 if max_string_length is None else max_string_length - str_length
+    output.write(bchr(str_length) + value + NULL_BYTE * padding_length)
 
 
 def write_until_eof(output, ignored, value):
     output.write(value)
 
+# ------------------------------------------------------------------------------
+# Codec
+
+_UNSIGNED_FORMAT_CHARS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+_SIGNED_FORMAT_CHARS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+class StructCodec(object):
+    """
+    Reads and writes a structure described by a list of StructMembers.
+    
+    A codec is compiled once from its member list. Runs of consecutive
+    fixed-size members are merged into a single `struct.Struct`, so that an
+    entire run is decoded (or encoded) with a single call instead of
+    dispatching on the type of each member.
+    
+    Members without a fixed size (such as pascal strings without a maximum
+    length, 'until_eof' members, and members with external types) are read
+    and written with the same `read_<type>` and `write_<type>` functions
+    that `read_structure()` and `write_structure()` use.
+    
+    Attributes:
+    * members : list<StructMember>
+    * size : int -- Size of the encoded structure in bytes,
+                    or None if the structure contains a member without a
+                    fixed size.
+    """
+    
+    def __init__(self, structure_members, external_readers=None, external_writers=None):
+        self.members = list(structure_members)
+        self._segments = []
+        self._view_type = None
+        
+        this_module = globals()
+        run = []
+        for member in self.members:
+            if _is_fixed_size_member(member):
+                run.append(member)
+                continue
+            
+            if len(run) > 0:
+                self._segments.append(_FixedRun(run))
+                run = []
+            
+            member_reader_name = 'read_' + member.type
+            member_writer_name = 'write_' + member.type
+            member_reader = (
+                this_module.get(member_reader_name, None) or
+                (external_readers or {}).get(member_reader_name, None))
+            member_writer = (
+                this_module.get(member_writer_name, None) or
+                (external_writers or {}).get(member_writer_name, None))
+            self._segments.append(
+                _DynamicMember(member, member_reader, member_writer))
+        if len(run) > 0:
+            self._segments.append(_FixedRun(run))
+        
+        if all(isinstance(segment, _FixedRun) for segment in self._segments):
+            self.size = sum(segment.size for segment in self._segments)
+        else:
+            self.size = None
+    
+    def read(self, input, record_type=None):
+        """
+        Reads a structure from the specified input stream.
+        
+        Returns a dict, or an instance of `record_type` if specified.
+        See `make_record_type()`.
+        """
+        v = {} if record_type is None else record_type()
+        for segment in self._segments:
+            segment.read(input, v)
+        return v
+    
+    def write(self, output, structure):
+        """
+        Writes the specified structure to the specified output stream
+        with a single write.
+        
+        Members missing from the structure are filled with their default value.
+        """
+        if self.size is not None:
+            buffer = bytearray(self.size)
+            self.pack_into(buffer, 0, structure)
+            output.write(buffer)
+        else:
+            buffer = BytesIO()
+            for segment in self._segments:
+                segment.write(buffer, structure)
+            output.write(buffer.getvalue())
+    
+    def unpack_from(self, buffer, offset=0, record_type=None):
+        """
+        Decodes a fixed-size structure from the specified buffer,
+        starting at the specified offset.
+        
+        Returns a dict, or an instance of `record_type` if specified.
+        """
+        if self.size is None:
+            raise ValueError("Can't unpack a structure that lacks a fixed size.")
+        v = {} if record_type is None else record_type()
+        for segment in self._segments:
+            segment.unpack_from(buffer, offset, v)
+            offset += segment.size
+        return v
+    
+    def pack(self, structure):
+        """
+        Encodes a fixed-size structure, returning a bytestring.
+        """
+        buffer = bytearray(self.size or 0)
+        self.pack_into(buffer, 0, structure)
+        return bytes(buffer)
+    
+    def pack_into(self, buffer, offset, structure):
+        """
+        Encodes a fixed-size structure into the specified writable buffer
+        (such as a bytearray), starting at the specified offset.
+        """
+        if self.size is None:
+            raise ValueError("Can't pack a structure that lacks a fixed size.")
+        for segment in self._segments:
+            segment.pack_into(buffer, offset, structure)
+            offset += segment.size
+    
+    @property
+    def view_type(self):
+        """
+        The StructView subclass for this codec's (fixed-size) structure.
+        """
+        if self._view_type is None:
+            self._view_type = make_struct_view_type('StructView', self.members)
+        return self._view_type
+    
+    def view(self, buffer, offset=0):
+        """
+        Returns a StructView over the fixed-size structure at the specified
+        offset of the specified buffer. Members are decoded on first access.
+        """
+        return self.view_type(buffer, offset)
+    
+    def read_view(self, input):
+        """
+        Reads a fixed-size structure from the specified input stream,
+        returning a StructView whose members are decoded on first access.
+        
+        The structure is copied out of the stream, so that the view does not
+        keep the underlying buffer of a BufferReader (such as an mmap) alive.
+        """
+        if self.size is None:
+            raise ValueError("Can't view a structure that lacks a fixed size.")
+        return self.view(read_fixed_bytes(input, self.size))
+
+
+def _is_fixed_size_member(member):
+    if member.type in ('unsigned', 'signed'):
+        return member.subtype <= 8
+    elif member.type in ('fixed_string', 'fixed_bytes'):
+        return True
+    elif member.type in ('pascal_string', 'pascal_bytes'):
+        return member.subtype is not None
+    else:
+        return False
+
+
+class _FixedRun(object):
+    """
+    A run of consecutive fixed-size members, encoded by a single struct.Struct.
+    """
+    
+    def __init__(self, members):
+        unpack_format = '>'
+        pack_format = '>'
+        # (name, first_slot, decoder, encoder, default_value)
+        fields = []
+        slot = 0
+        for member in members:
+            (member_unpack_format, member_pack_format, slot_count, decoder, encoder) = \
+                _compile_fixed_size_member(member)
+            unpack_format += member_unpack_format
+            pack_format += member_pack_format
+            fields.append((member.name, slot, decoder, encoder, member.default_value))
+            slot += slot_count
+        
+        self._unpacker = struct.Struct(unpack_format)
+        self._packer = struct.Struct(pack_format)
+        self._fields = fields
+        self.size = self._unpacker.size
+    
+    def read(self, input, v):
+        self._decode(self._unpacker.unpack(input.read(self.size)), v)
+    
+    def unpack_from(self, buffer, offset, v):
+        self._decode(self._unpacker.unpack_from(buffer, offset), v)
+    
+    def _decode(self, values, v):
+        for (name, slot, decoder, _, _) in self._fields:
+            if decoder is None:
+                v[name] = values[slot]
+            else:
+                v[name] = decoder(values, slot)
+    
+    def write(self, output, structure):
+        output.write(self._packer.pack(*self._encode(structure)))
+    
+    def pack_into(self, buffer, offset, structure):
+        self._packer.pack_into(buffer, offset, *self._encode(structure))
+    
+    def _encode(self, structure):
+        slots = []
+        for (name, _, _, encoder, default_value) in self._fields:
+            value = structure.get(name, default_value)
+            if value is None:
+                raise ValueError('No value specified for member "%s", which lacks a default value.' % name)
+            encoder(value, slots)
+        return slots
+
+
+class _DynamicMember(object):
+    """
+    A single member without a fixed size, read and written by its
+    `read_<type>` and `write_<type>` functions.
+    """
+    size = None
+    
+    def __init__(self, member, reader, writer):
+        self._member = member
+        self._reader = reader
+        self._writer = writer
+    
+    def read(self, input, v):
+        member = self._member
+        if self._reader is None:
+            raise ValueError('No reader for member "%s" of type "%s".' % (member.name, member.type))
+        v[member.name] = self._reader(input, member.subtype)
+    
+    def write(self, output, structure):
+        member = self._member
+        if self._writer is None:
+            raise ValueError('No writer for member "%s" of type "%s".' % (member.name, member.type))
+        value = structure.get(member.name, member.default_value)
+        if value is None:
+            raise ValueError('No value specified for member "%s", which lacks a default value.' % member.name)
+        self._writer(output, member.subtype, value)
+
+
+def _compile_fixed_size_member(member):
+    """
+    Returns a tuple of
+    (unpack_format, pack_format, slot_count, decoder, encoder)
+    for the specified fixed-size member.
+    
+    A decoder is either None (if the unpacked slot is the member's value) or
+    a function (values, first_slot) -> value. An encoder is a function
+    (value, slots) that appends the member's packed slot values to `slots`.
+    """
+    num_bytes = member.subtype
+    
+    if member.type in ('unsigned', 'signed'):
+        mask = (1 << (8*num_bytes)) - 1
+        if num_bytes in _UNSIGNED_FORMAT_CHARS:
+            # NOTE: Values are masked and packed as unsigned so that
+            #       out-of-range and negative values wrap around in the
+            #       same way that write_unsigned() and write_signed() do.
+            def encoder(value, slots):
+                slots.append(value & mask)
+            if member.type == 'unsigned':
+                return (_UNSIGNED_FORMAT_CHARS[num_bytes], _UNSIGNED_FORMAT_CHARS[num_bytes],
+                        1, None, encoder)
+            else:
+                return (_SIGNED_FORMAT_CHARS[num_bytes], _UNSIGNED_FORMAT_CHARS[num_bytes],
+                        1, None, encoder)
+        else:
+            # Odd widths (such as the 3-byte data offset of a resource
+            # reference) have no struct format character
+            padding = NULL_BYTE * (8 - num_bytes)
+            if member.type == 'unsigned':
+                def decoder(values, slot):
+                    return _UINT64.unpack(padding + values[slot])[0]
+            else:
+                overflow_value = (1 << (8*num_bytes - 1))
+                def decoder(values, slot):
+                    value = _UINT64.unpack(padding + values[slot])[0]
+                    return value if value < overflow_value else value - overflow_value*2
+            def encoder(value, slots):
+                slots.append(_UINT64.pack(value & mask)[8 - num_bytes:])
+            format = '%ds' % num_bytes
+            return (format, format, 1, decoder, encoder)
+    
+    elif member.type in ('fixed_string', 'fixed_bytes'):
+        is_string = (member.type == 'fixed_string')
+        if is_string:
+            def decoder(values, slot):
+                return values[slot].decode('macroman')
+        else:
+            decoder = None
+        def encoder(value, slots):
+            if value == 0:
+                value = NULL_BYTE * num_bytes
+            elif is_string:
+                value = value.encode('macroman')
+            if len(value) != num_bytes:
+                raise ValueError('Value does not have the expected byte count.')
+            slots.append(value)
+        format = '%ds' % num_bytes
+        return (format, format, 1, decoder, encoder)
+    
+    elif member.type in ('pascal_string', 'pascal_bytes'):
+        max_string_length = member.subtype
+        is_string = (member.type == 'pascal_string')
+        def decoder(values, slot):
+            value = values[slot + 1][:values[slot]]
+            return value.decode('macroman') if is_string else value
+        def encoder(value, slots):
+            if is_string:
+                value = value.encode('macroman')
+            if len(value) > max_string_length:
+                raise ValueError('Value exceeds the maximum byte count.')
+            slots.append(len(value))
+            slots.append(value)     # (struct pads the remainder with NULLs)
+        format = 'B%ds' % max_string_length
+        return (format, format, 2, decoder, encoder)
+    
+    else:
+        raise ValueError("Member of type %s doesn't have a fixed size." % member.type)
+
+# ------------------------------------------------------------------------------
+# Views
+
+class StructView(MutableMapping):
+    """
+    A mapping over an encoded fixed-size structure that decodes each member
+    only when it is first accessed.
+    
+    A view holds a slice of the encoded structure. Decoded members are cached.
+    Assigned keys (including keys that are not members) override the encoded
+    values, so that a view can be used in place of a structure returned by
+    `read_structure()`.
+    
+    Subclasses are created by `make_struct_view_type()`.
+    Subclasses may override `_decode()` to customize how members are decoded.
+    """
+    __slots__ = ('_buffer', '_values')
+    
+    # Maps each member name to (offset, unpacker, decoder). Set by subclasses.
+    _member_decoders = {}
+    _member_names = ()
+    size = 0
+    
+    def __init__(self, buffer, offset=0):
+        if len(buffer) - offset < self.size:
+            raise ValueError('Buffer is too small to contain the structure.')
+        try:
+            buffer = memoryview(buffer)
+        except TypeError:
+            pass    # Python 2 mmap
+        self._buffer = buffer[offset:offset + self.size]
+        self._values = {}
+    
+    def _decode(self, name):
+        (offset, unpacker, decoder) = self._member_decoders[name]
+        values = unpacker.unpack_from(self._buffer, offset)
+        return values[0] if decoder is None else decoder(values, 0)
+    
+    @property
+    def buffer(self):
+        """
+        The encoded structure.
+        """
+        return self._buffer
+    
+    def __getitem__(self, name):
+        values = self._values
+        value = values.get(name, _MISSING)
+        if value is _MISSING:
+            if name not in self._member_decoders:
+                raise KeyError(name)
+            value = values[name] = self._decode(name)
+        elif value is _DELETED:
+            raise KeyError(name)
+        return value
+    
+    def __setitem__(self, name, value):
+        self._values[name] = value
+    
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        if name in self._member_decoders:
+            self._values[name] = _DELETED
+        else:
+            del self._values[name]
+    
+    def __contains__(self, name):
+        value = self._values.get(name, _MISSING)
+        if value is _MISSING:
+            return name in self._member_decoders
+        return value is not _DELETED
+    
+    def __iter__(self):
+        values = self._values
+        for name in self._member_names:
+            if values.get(name, _MISSING) is not _DELETED:
+                yield name
+        for (name, value) in values.items():
+            if name not in self._member_decoders:
+                yield name
+    
+    def __len__(self):
+        return sum(1 for name in self)
+    
+    def __repr__(self):
+        return repr(dict(self))
+    
+    def copy(self):
+        return dict(self)
+    
+    def __reduce__(self):
+        # Pickle as a plain dictionary, which does not depend on the buffer
+        return (dict, (dict(self),))
+
+
+def make_struct_view_type(typename, structure_members):
+    """
+    Creates a StructView subclass for the specified fixed-size structure.
+    
+    The offset of each member is computed once, when the type is created.
+    """
+    member_decoders = {}
+    for member in structure_members:
+        (unpack_format, _, _, decoder, _) = _compile_fixed_size_member(member)
+        member_decoders[member.name] = (
+            offset_to_structure_member(structure_members, member.name),
+            struct.Struct('>' + unpack_format),
+            decoder)
+    
+    return type(typename, (StructView,), {
+        '__slots__': (),
+        '_member_decoders': member_decoders,
+        '_member_names': tuple([member.name for member in structure_members]),
+        'size': sizeof_structure(structure_members),
+    })
+
+
+_MISSING = object()
+_DELETED = object()
+
+# ------------------------------------------------------------------------------
+# Records
+
+class StructRecord(object):
+    """
+    A compact structure with a fixed set of fields, stored in __slots__
+    instead of a per-instance dict.
+    
+    A record can be used in place of a structure returned by
+    `read_structure()`: it supports the same mapping operations as a dict,
+    except that only its own fields may be assigned. A field that has never
+    been assigned is absent from the mapping.
+    
+    Records can be pickled if their type is bound to a module-level name
+    that matches its typename.
+    
+    Subclasses are created by `make_record_type()`.
+    """
+    __slots__ = ()
+    
+    _fields = ()
+    _field_set = frozenset()
+    
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self._fields):
+            raise TypeError('%s takes at most %d arguments (%d given)' % (
+                type(self).__name__, len(self._fields), len(args)))
+        for (name, value) in zip(self._fields, args):
+            setattr(self, name, value)
+        for (name, value) in kwargs.items():
+            self[name] = value
+    
+    @classmethod
+    def from_dict(cls, structure):
+        record = cls()
+        for (name, value) in structure.items():
+            record[name] = value
+        return record
+    
+    def to_dict(self):
+        return dict(self.items())
+    
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # Mapping
+    
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except (AttributeError, TypeError):
+            raise KeyError(name)
+    
+    def __setitem__(self, name, value):
+        if name not in self._field_set:
+            raise KeyError('%s has no field named %r.' % (type(self).__name__, name))
+        setattr(self, name, value)
+    
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        delattr(self, name)
+    
+    def __contains__(self, name):
+        return name in self._field_set and hasattr(self, name)
+    
+    def __iter__(self):
+        for name in self._fields:
+            if hasattr(self, name):
+                yield name
+    
+    def __len__(self):
+        return sum(1 for name in self)
+    
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self._field_set else default
+    
+    def keys(self):
+        return list(self)
+    
+    def values(self):
+        return [getattr(self, name) for name in self]
+    
+    def items(self):
+        return [(name, getattr(self, name)) for name in self]
+    
+    def update(self, other=(), **kwargs):
+        if hasattr(other, 'keys'):
+            other = [(name, other[name]) for name in other.keys()]
+        for (name, value) in other:
+            self[name] = value
+        for (name, value) in kwargs.items():
+            self[name] = value
+    
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+    
+    def pop(self, name, *default):
+        if name in self:
+            value = self[name]
+            del self[name]
+            return value
+        if len(default) > 0:
+            return default[0]
+        raise KeyError(name)
+    
+    def copy(self):
+        return type(self).from_dict(self)
+    
+    def __eq__(self, other):
+        if not isinstance(other, (StructRecord, dict, MutableMapping)):
+            return NotImplemented
+        return self.to_dict() == dict(other.items())
+    
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            ['%s=%r' % (name, value) for (name, value) in self.items()]))
+    
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # Pickle
+    
+    def __getstate__(self):
+        return self.to_dict()
+    
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+
+MutableMapping.register(StructRecord)
+
+
+def make_record_type(typename, structure_members, extra_fields=()):
+    """
+    Creates a StructRecord subclass whose fields are the members of the
+    specified structure, followed by the specified extra fields.
+    
+    Extra fields hold values that are not part of the encoded structure
+    but that are attached to it after it is read (such as the name and data
+    of a resource reference).
+    
+    Positional arguments to the created type are assigned to fields in order.
+    """
+    fields = tuple([member.name for member in structure_members]) + tuple(extra_fields)
+    record_type = type(typename, (StructRecord,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '_field_set': frozenset(fields),
+    })
+    
+    # Allow the record type to be pickled, like collections.namedtuple does
+    try:
+        record_type.__module__ = sys._getframe(1).f_globals.get('__name__', '__main__')
+    except (AttributeError, ValueError):
+        pass
+    
+    return record_type
+
+# ------------------------------------------------------------------------------
+# Buffers
+
+try:
+    _buffer_object = buffer             # Python 2
+except NameError:
+    _buffer_object = None               # Python 3
+
+
+class BufferReader(object):
+    """
+    Presents a read-only seekable stream over an in-memory buffer,
+    such as a bytestring, a bytearray, or an mmap.
+    
+    Unlike BytesIO, reads do not copy the underlying buffer. Instead each
+    read returns a memoryview slice of the buffer. The `read_*` functions in
+    this module accept a BufferReader in place of a stream and convert such
+    slices to bytestrings only for members that are decoded (such as
+    strings), so that large members like fork contents are never copied.
+    """
+    
+    def __init__(self, buffer):
+        try:
+            self._view = memoryview(buffer)
+        except TypeError:
+            # Python 2 cannot create a memoryview of an mmap directly,
+            # but can of a (zero-copy) buffer object over it
+            self._view = memoryview(_buffer_object(buffer))
+        self._length = len(buffer)
+        self._position = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def close(self):
+        """
+        Releases the underlying buffer. In particular an mmap cannot be closed
+        while a BufferReader over it remains open, nor while any slice
+        returned by read() remains alive.
+        """
+        release = getattr(self._view, 'release', None)     # Python 3.2+
+        if release is not None:
+            release()
+    
+    @property
+    def view(self):
+        """
+        The entire underlying buffer.
+        """
+        return self._view
+    
+    def __len__(self):
+        return self._length
+    
+    def read(self, num_bytes=-1):
+        start = self._position
+        if num_bytes is None or num_bytes < 0:
+            end = self._length
+        else:
+            end = min(start + num_bytes, self._length)
+        self._position = max(start, end)
+        return self._view[start:end]
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._length + offset
+        else:
+            raise ValueError('Invalid whence: %s' % whence)
+        if position < 0:
+            raise ValueError('Negative seek position: %s' % position)
+        self._position = position
+        return position
+    
+    def tell(self):
+        return self._position
+    
+    def at_eof(self):
+        return self._position >= self._length
+    
+    def seekable(self):
+        return True
+    
+    def readable(self):
+        return True
+
+
+class StreamWindow(object):
+    """
+    Presents a read-only seekable stream over a range of bytes within an
+    underlying seekable stream, such as one fork of a MacBinary file.
+    
+    Positions are relative to the start of the window and reads never extend
+    past its end. Only the bytes actually requested are read from the
+    underlying stream, so memory use does not depend on the window's length.
+    
+    Several windows may share the same underlying stream, since each read first
+    seeks the underlying stream to the window's own position. Closing a window
+    does not close the underlying stream.
+    """
+    
+    def __init__(self, stream, offset, length):
+        self._stream = stream
+        self._offset = offset
+        self._length = length
+        self._position = 0
+        self.closed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def close(self):
+        self.closed = True
+        self._stream = None
+    
+    @property
+    def offset(self):
+        """
+        Offset of the start of the window within the underlying stream.
+        """
+        return self._offset
+    
+    def __len__(self):
+        return self._length
+    
+    def read(self, num_bytes=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed window.')
+        remaining = self._length - self._position
+        if num_bytes is None or num_bytes < 0 or num_bytes > remaining:
+            num_bytes = max(remaining, 0)
+        if num_bytes == 0:
+            return b''
+        self._stream.seek(self._offset + self._position)
+        data = self._stream.read(num_bytes)
+        self._position += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._length + offset
+        else:
+            raise ValueError('Invalid whence: %s' % whence)
+        if position < 0:
+            raise ValueError('Negative seek position: %s' % position)
+        self._position = position
+        return position
+    
+    def tell(self):
+        return self._position
+    
+    def at_eof(self):
+        return self._position >= self._length
+    
+    def seekable(self):
+        return True
+    
+    def readable(self):
+        return True
+
+
+def as_input_stream(input):
+    """
+    Returns the specified input if it is a stream. Otherwise the input must be
+    a buffer (such as a bytestring, a memoryview, or an mmap), and a
+    BufferReader over that buffer is returned.
+    
+    An mmap is treated as a buffer even though it also has a stream interface,
+    so that reads from it are zero-copy.
+    """
+    if hasattr(input, 'read') and not isinstance(input, mmap.mmap):
+        return input
+    return BufferReader(input)
+
+
+def _as_bytes(value):
+    """
+    Converts a slice returned by BufferReader.read() to a bytestring.
+    Values that are already bytestrings are returned as-is.
+    """
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
 # ------------------------------------------------------------------------------
 # Misc
 
@@ -196,6 +1122,8 @@ def at_eof(input):
     """
     Returns whether the specified input stream is at EOF.
     """
+    if isinstance(input, (BufferReader, StreamWindow)):
+        return input.at_eof()
     with save_stream_position(input):
         at_eof = input.read(1) == b''
     return at_eof
@@ -214,17 +1142,50 @@ def write_nulls(output, num_bytes):
     
     This implementation is optimized to write a large number of bytes quickly.
     """
-    zero_byte = NULL_BYTE   # save to local to improve performance
-    
-    # Write blocks of 1024 bytes first
-    zero_kilobyte = zero_byte * 1024
-    while num_bytes >= 1024:
-        output.write(zero_kilobyte)
-        num_bytes -= 1024
+    # Write large blocks first
+    zero_block = _ZERO_BLOCK   # save to local to improve performance
+    zero_block_length = len(zero_block)
+    while num_bytes >= zero_block_length:
+        output.write(zero_block)
+        num_bytes -= zero_block_length
     
     # Write remaining bytes
-    for i in xrange(num_bytes):
-        output.write(zero_byte)
+    if num_bytes > 0:
+        output.write(zero_block[:num_bytes])
+
+def copy_stream(input, output, num_bytes):
+    """
+    Copies exactly the specified number of bytes from the specified input
+    stream to the specified output stream, in large chunks.
+    
+    Raises ValueError if the input stream ends before that many bytes are read.
+    """
+    remaining_length = num_bytes
+    while remaining_length > 0:
+        chunk = read_fixed_bytes(input, min(remaining_length, _COPY_CHUNK_SIZE))
+        if len(chunk) == 0:
+            raise ValueError(
+                'Stream ended %d bytes before its expected length.' %
+                remaining_length)
+        output.write(chunk)
+        remaining_length -= len(chunk)
+
+
+def remaining_stream_length(stream):
+    """
+    Returns the number of bytes between the current position of the specified
+    stream and its end. The stream must either support len() (like a
+    BufferReader or a StreamWindow) or be seekable.
+    """
+    try:
+        return len(stream) - stream.tell()
+    except TypeError:
+        pass
+    with save_stream_position(stream):
+        start_offset = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        return stream.tell() - start_offset
+
 
 def touch_temp(*args, **kwargs):
     """
@@ -276,6 +1237,11 @@ else:
 
 NULL_BYTE = bchr(0)
 
+_ZERO_BLOCK = NULL_BYTE * (64 * 1024)
+
+# Size of the chunks in which copy_stream() copies
+_COPY_CHUNK_SIZE = 1024 * 1024
+
 # iterord() iterates over the integer values of the bytes in the specified
 # bytestring.
 if bytes == str:
@@ -285,3 +1251,29 @@ if bytes == str:
 else:
     def iterord(bytes_value):           # Python 3
         return bytes_value
+
+# decode_filepath() decodes the specified native filepath to unicode, so that
+# it can be stored in a text format such as JSON or SQLite.
+# 
+# Bytes that are not valid in the filesystem encoding are decoded to lone
+# surrogates (U+DC80..U+DCFF), as Python 3 does for filenames, so that
+# distinct filepaths always decode to distinct strings.
+try:
+    codecs.lookup_error('surrogateescape')
+    _FILEPATH_DECODE_ERRORS = 'surrogateescape'     # Python 3
+except LookupError:
+    def _decode_to_surrogates(error):
+        if not isinstance(error, UnicodeDecodeError):
+            raise error
+        undecodable_bytes = error.object[error.start:error.end]
+        return (
+            u''.join([unichr(0xDC00 + ord(b)) for b in undecodable_bytes]),
+            error.end)
+    codecs.register_error('classicbox.surrogateescape', _decode_to_surrogates)
+    _FILEPATH_DECODE_ERRORS = 'classicbox.surrogateescape'
+
+def decode_filepath(filepath):
+    if isinstance(filepath, bytes):
+        filepath = filepath.decode(
+            sys.getfilesystemencoding() or 'utf-8', _FILEPATH_DECODE_ERRORS)
+    return filepath
@@ -4,18 +4,23 @@ Manipulates MacBinary files.
 
 from __future__ import absolute_import
 
+from classicbox.crc import crc16
 from classicbox.io import BytesIO
-from classicbox.io import iterord
+from classicbox.io import copy_stream
+from classicbox.io import make_record_type
 from classicbox.io import NULL_BYTE
 from classicbox.io import offset_to_structure_member
 from classicbox.io import print_structure
-from classicbox.io import read_structure
-from classicbox.io import save_stream_position
+from classicbox.io import remaining_stream_length
 from classicbox.io import sizeof_structure_member
+from classicbox.io import StructCodec
+from classicbox.io import StreamWindow
 from classicbox.io import StructMember
-from classicbox.io import write_structure
-from classicbox.io import write_unsigned
+from classicbox.io import write_nulls
 from classicbox.time import convert_local_to_mac_timestamp
+import mmap
+import os
+import struct
 import time
 
 
@@ -184,16 +189,36 @@ _MACBINARY_HEADER_MEMBERS = [
     StructMember('reserved_for_computer_type_and_os_id', 'unsigned', 2, 0),
 ]
 
+_MACBINARY_HEADER_CODEC = StructCodec(_MACBINARY_HEADER_MEMBERS)
+
+# Length of a MacBinary header, which is also enough of a file to sniff it
+MACBINARY_HEADER_LENGTH = _MACBINARY_HEADER_CODEC.size
+
+_OFFSET_TO_HEADER_CRC = offset_to_structure_member(
+    _MACBINARY_HEADER_MEMBERS, 'header_crc')
+_OFFSET_TO_COMMENT_LENGTH = offset_to_structure_member(
+    _MACBINARY_HEADER_MEMBERS, 'comment_length')
+
+_MACBINARY_I_ZERO_FILL = NULL_BYTE * (_OFFSET_TO_HEADER_CRC + 2 - _OFFSET_TO_COMMENT_LENGTH)
+
+# Compact alternative to the MacBinary object dictionary.
+# See the `compact` parameter of read_macbinary().
+MacBinary = make_record_type('MacBinary',
+    _MACBINARY_HEADER_MEMBERS, ('data_fork', 'resource_fork', 'comment'))
+
 # ------------------------------------------------------------------------------
 
-def read_macbinary(input):
+def read_macbinary(input, compact=False):
     """
     Reads a MacBinary I, II, or III file from the specified input stream.
     
     Returns a MacBinary object. This object is in the format described by
     `write_macbinary()` and has all its optional fields filled out.
+    
+    If `compact` is True, the MacBinary object is returned as a compact
+    MacBinary record instead of a dictionary.
     """
-    macbinary_header = _read_macbinary_header(input)
+    macbinary_header = _read_macbinary_header(input, compact)
     data_fork = _read_macbinary_section(input, 'data_fork', macbinary_header)
     resource_fork = _read_macbinary_section(input, 'resource_fork', macbinary_header)
     comment = _read_macbinary_section(input, 'comment', macbinary_header)
@@ -211,18 +236,280 @@ def read_macbinary(input):
     return macbinary
 
 
-def _read_macbinary_header(input):
-    macbinary_header = read_structure(input, _MACBINARY_HEADER_MEMBERS)
+def read_macbinary_header(input):
+    """
+    Reads only the header of a MacBinary I, II, or III file from the
+    specified input stream. The forks and comment are not read.
+    
+    Returns a mapping with the same keys as the header fields of a MacBinary
+    object (see `write_macbinary()`). Fields are decoded only when they are
+    first accessed, so scanning many headers for a few fields (such as
+    'file_type' and 'file_creator') is cheap.
+    """
+    return _MacBinaryHeaderView(input.read(_MACBINARY_HEADER_CODEC.size))
+
+
+class MacBinaryReader(object):
+    """
+    Reads a MacBinary I, II, or III file from a seekable input stream without
+    loading its forks into memory.
+    
+    Only the 128-byte header is read up front. The data fork, resource fork,
+    and comment are exposed as bounded, seekable, read-only streams over the
+    corresponding sections of the input stream, so memory use does not depend
+    on the size of the encoded file. The input stream must remain open for as
+    long as these streams are in use.
+    
+    Attributes:
+    * header -- The MacBinary header, as returned by read_macbinary_header().
+    * data_fork : StreamWindow -- The contents of the data fork.
+    * resource_fork : StreamWindow -- The contents of the resource fork.
+    * comment : StreamWindow -- The Finder comment of the file.
+    """
+    
+    def __init__(self, input):
+        header_offset = input.tell()
+        self.header = read_macbinary_header(input)
+        
+        section_offset = header_offset + _MACBINARY_HEADER_CODEC.size
+        for section_type in ('data_fork', 'resource_fork', 'comment'):
+            section_length = self.header[section_type + '_length']
+            setattr(self, section_type,
+                StreamWindow(input, section_offset, section_length))
+            section_offset += _round_up_to_128_byte_boundary(section_length)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def close(self):
+        """
+        Closes the fork streams. The input stream is not closed.
+        """
+        self.data_fork.close()
+        self.resource_fork.close()
+        self.comment.close()
+
+
+def open_macbinary_mmap(filepath):
+    """
+    Memory-maps the specified MacBinary I, II, or III file, returning a
+    MappedMacBinary whose forks are zero-copy slices of the mapping.
+    
+    Only the pages of the file that are actually accessed are read from disk.
+    In particular a fork can be passed directly to `read_resource_fork()`,
+    which then touches only the parts of the resource fork it needs.
+    
+    The caller is responsible for closing the returned MappedMacBinary.
+    """
+    with open(filepath, 'rb') as file:
+        file_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return MappedMacBinary(file_mmap)
+    except:
+        file_mmap.close()
+        raise
+
+
+class MappedMacBinary(object):
+    """
+    A memory-mapped MacBinary file. See `open_macbinary_mmap()`.
+    
+    Attributes:
+    * header -- The MacBinary header, as returned by read_macbinary_header().
+    * data_fork : memoryview -- The contents of the data fork.
+    * resource_fork : memoryview -- The contents of the resource fork.
+    * comment : memoryview -- The Finder comment of the file.
+    
+    NOTE: Python 2 cannot create a memoryview of an mmap.
+          In that case the forks are (equally zero-copy) buffer objects.
+    
+    In Python 3 the mapping cannot be closed while any slice of a fork
+    (such as resource data returned by read_resource_fork()) remains alive.
+    """
+    
+    def __init__(self, file_mmap):
+        self._mmap = file_mmap
+        # (Copy the header so that it does not keep the mapping alive)
+        self.header = read_macbinary_header(
+            BytesIO(file_mmap[:_MACBINARY_HEADER_CODEC.size]))
+        
+        section_offset = _MACBINARY_HEADER_CODEC.size
+        for section_type in ('data_fork', 'resource_fork', 'comment'):
+            section_length = self.header[section_type + '_length']
+            if section_offset + section_length > len(file_mmap):
+                raise ValueError(
+                    'MacBinary file is truncated within its %s.' % section_type)
+            setattr(self, section_type,
+                _slice_mmap(file_mmap, section_offset, section_length))
+            section_offset += _round_up_to_128_byte_boundary(section_length)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def close(self):
+        for section in (self.data_fork, self.resource_fork, self.comment):
+            release = getattr(section, 'release', None)     # Python 3.2+
+            if release is not None:
+                release()
+        self._mmap.close()
+
+
+def _slice_mmap(file_mmap, offset, length):
+    try:
+        return memoryview(file_mmap)[offset:offset + length]
+    except TypeError:
+        return buffer(file_mmap, offset, length)    # Python 2
+
+
+# 
+# MacBinary Versions -- returned by sniff_macbinary()
+# 
+MACBINARY_I = 1
+MACBINARY_II = 2
+MACBINARY_III = 3
+
+# Fields of a MacBinary header that are inspected by sniff_macbinary()
+_SNIFF_FIELDS = struct.Struct(
+    '>' +
+    'BB' +      # old_version, filename length
+    '72x' +
+    'B' +       # zero_1
+    '7x' +
+    'B' +       # zero_2
+    'II' +      # data_fork_length, resource_fork_length
+    '8x' +
+    'H' +       # comment_length
+    'x' +
+    '4s' +      # signature
+    '14x' +
+    'H' +       # reserved_for_second_header_length
+    'BB' +      # version, min_version_to_read
+    'H' +       # header_crc
+    '2x')
+
+# MacBinary I readers reject forks larger than this
+_MAX_MACBINARY_I_FORK_LENGTH = 0x7FFFFF
+
+# MacBinary II and III writers record a version of at least 129 (II),
+# and readers of MacBinary III (130) can read nothing newer
+_MIN_MACBINARY_II_VERSION = 129
+_MAX_READABLE_MACBINARY_VERSION = 130
+
+
+def sniff_macbinary(header, file_length=None):
+    """
+    Determines whether the specified bytes are the header of a MacBinary file
+    and if so which version of MacBinary it is, without decoding the header.
+    
+    MacBinary II and III headers are identified by their CRC, and must also
+    have a valid version and a minimum version to read of at most 130.
+    MacBinary I headers have no CRC, so they are identified by the fields that
+    MacBinary I requires to be zero. In either case the filename length must
+    be valid.
+    
+    Arguments:
+    * header : str-binary|bytearray|memoryview|mmap --
+            At least the first 128 bytes of the file.
+    * file_length : int (optional) --
+            Length of the entire file. If specified, headers whose forks
+            (and secondary header, if any) do not fit in the file are rejected.
     
+    Returns MACBINARY_I, MACBINARY_II, MACBINARY_III, or None if the header is
+    not a MacBinary header.
+    """
+    header = header[:128]
+    if isinstance(header, memoryview):
+        header = header.tobytes()
+    if len(header) < 128:
+        return None
+    
+    (old_version, filename_length, zero_1, zero_2,
+        data_fork_length, resource_fork_length, comment_length,
+        signature, second_header_length, version, min_version_to_read,
+        header_crc) = _SNIFF_FIELDS.unpack(header)
+    
+    if old_version != 0 or zero_1 != 0 or zero_2 != 0:
+        return None
+    if not (1 <= filename_length <= 63):
+        return None
+    if file_length is not None:
+        data_length = (
+            _MACBINARY_HEADER_CODEC.size +
+            _round_up_to_128_byte_boundary(second_header_length) +
+            _round_up_to_128_byte_boundary(data_fork_length) +
+            _round_up_to_128_byte_boundary(resource_fork_length))
+        if data_length > file_length:
+            return None
+    
+    if header_crc == _compute_macbinary_crc(header[:_OFFSET_TO_HEADER_CRC]):
+        if (version < _MIN_MACBINARY_II_VERSION or
+                min_version_to_read > _MAX_READABLE_MACBINARY_VERSION):
+            return None
+        if signature == b'mBIN':
+            return MACBINARY_III
+        else:
+            return MACBINARY_II
+    
+    # MacBinary I: Everything after the creation and modification dates
+    # is reserved and must be zero
+    if header[_OFFSET_TO_COMMENT_LENGTH:_OFFSET_TO_HEADER_CRC + 2] != _MACBINARY_I_ZERO_FILL:
+        return None
+    if (data_fork_length > _MAX_MACBINARY_I_FORK_LENGTH or
+            resource_fork_length > _MAX_MACBINARY_I_FORK_LENGTH):
+        return None
+    return MACBINARY_I
+
+
+def sniff_macbinary_batch(headers, file_lengths=None):
+    """
+    Same as `sniff_macbinary()` but classifies many headers at once.
+    
+    Arguments:
+    * headers : [str-binary|bytearray|memoryview|mmap] --
+            At least the first 128 bytes of each file.
+    * file_lengths : [int] (optional) -- Length of each file.
+    
+    Returns a list with a MACBINARY_* constant or None for each header.
+    """
+    if file_lengths is None:
+        return [sniff_macbinary(header) for header in headers]
+    else:
+        return [
+            sniff_macbinary(header, file_length)
+            for (header, file_length) in zip(headers, file_lengths)]
+
+
+def _read_macbinary_header(input, compact=False):
+    macbinary_header = _MACBINARY_HEADER_CODEC.read(input, MacBinary if compact else None)
+    macbinary_header['filename'] = _decode_macbinary_filename(
+        macbinary_header['filename'], macbinary_header['filename_script'])
+    return macbinary_header
+
+
+def _decode_macbinary_filename(filename, filename_script):
     # Decode the filename to unicode, which might not be MacRoman encoded
-    if macbinary_header['filename_script'] == SM_ROMAN:
-        macbinary_header['filename'] = macbinary_header['filename'].decode('macroman')
+    if filename_script == SM_ROMAN:
+        return filename.decode('macroman')
     else:
         raise NotImplementedError(
             "Filename is encoded in a script other than MacRoman. " +
             "Don't know how to decode non-MacRoman scripts.")
+
+
+class _MacBinaryHeaderView(_MACBINARY_HEADER_CODEC.view_type):
+    __slots__ = ()
     
-    return macbinary_header
+    def _decode(self, name):
+        value = super(_MacBinaryHeaderView, self)._decode(name)
+        if name == 'filename':
+            value = _decode_macbinary_filename(value, self['filename_script'])
+        return value
 
 
 def _read_macbinary_section(input, section_type, macbinary_header):
@@ -241,6 +528,9 @@ def _seek_to_next_128_byte_boundary(input):
     if offset_to_next_boundary < 128:
         input.seek(current_offset + offset_to_next_boundary)
 
+def _round_up_to_128_byte_boundary(length):
+    return (length + 127) // 128 * 128
+
 # ------------------------------------------------------------------------------
 
 def write_macbinary_to_buffer(macbinary):
@@ -269,8 +559,8 @@ def write_macbinary(output, macbinary):
     *                                             See SM_* constants for other options.
     * file_type : unicode(4) -- Code for the file type.
     * file_creator : unicode(4) -- Code for the file creator.
-    * data_fork : str-binary (optional) -- The contents of the data fork.
-    * resource_fork : str-binary (optional) -- The contents of the resource fork.
+    * data_fork : str-binary|stream (optional) -- The contents of the data fork.
+    * resource_fork : str-binary|stream (optional) -- The contents of the resource fork.
     
     * created : mac_timestamp (optional) -- Creation date of the encoded file.
                                             Defaults to the current datetime.
@@ -287,6 +577,17 @@ def write_macbinary(output, macbinary):
     * x_position : unsigned(2) (optional) - X position of the encoded file within its parent directory.
     * y_position : unsigned(2) (optional) - Y position of the encoded file within its parent directory.
     
+    Forks may be specified as readable streams instead of as bytestrings,
+    in which case they are copied to the output in large chunks rather than
+    being loaded into memory. The length of a fork stream is taken from len()
+    if the stream supports it (like a StreamWindow), or else from the remainder
+    of the stream if it is seekable. Only a stream that is neither sized nor
+    seekable (like a pipe) takes its length from the corresponding `*_length`
+    field of the MacBinary object, which is then required.
+    
+    The output stream is written to sequentially and never seeked,
+    so it may be a pipe or a socket.
+    
     Arguments:
     * output : stream -- An output stream.
     * macbinary -- A MacBinary object. See documentation above.
@@ -302,16 +603,65 @@ def write_macbinary(output, macbinary):
     
     # Fill in header
     macbinary_header.update({
-        'data_fork_length': len(data_fork),
-        'resource_fork_length': len(resource_fork),
+        'data_fork_length': _macbinary_section_length(
+            data_fork, macbinary.get('data_fork_length')),
+        'resource_fork_length': _macbinary_section_length(
+            resource_fork, macbinary.get('resource_fork_length')),
         'comment_length': len(comment),
     })
     
     # Write everything
     _write_macbinary_header(output, macbinary)
-    _write_macbinary_section(output, data_fork)
-    _write_macbinary_section(output, resource_fork)
-    _write_macbinary_section(output, comment)
+    _write_macbinary_section(output, data_fork, macbinary_header['data_fork_length'])
+    _write_macbinary_section(output, resource_fork, macbinary_header['resource_fork_length'])
+    _write_macbinary_section(output, comment, macbinary_header['comment_length'])
+
+
+def write_macbinary_from_files(output, macbinary, data_fork_filepath=None, resource_fork_filepath=None):
+    """
+    Writes a MacBinary III file to the specified output stream, copying its
+    forks from the specified files in the local filesystem.
+    
+    The forks are streamed to the output and are never loaded into memory
+    in their entirety. See `write_macbinary()` for details.
+    
+    Arguments:
+    * output : stream -- An output stream.
+    * macbinary -- A MacBinary object without forks. See `write_macbinary()`.
+    * data_fork_filepath : str-native (optional) -- File containing the data fork.
+    * resource_fork_filepath : str-native (optional) -- File containing the resource fork.
+    """
+    macbinary = dict(macbinary)
+    forks = []
+    try:
+        for (section_type, filepath) in [
+                ('data_fork', data_fork_filepath),
+                ('resource_fork', resource_fork_filepath)]:
+            if filepath is not None:
+                fork = open(filepath, 'rb')
+                forks.append(fork)
+                macbinary[section_type] = fork
+                macbinary[section_type + '_length'] = os.fstat(fork.fileno()).st_size
+        
+        write_macbinary(output, macbinary)
+    finally:
+        for fork in forks:
+            fork.close()
+
+
+def _macbinary_section_length(section, section_length):
+    if not hasattr(section, 'read'):
+        return len(section)
+    
+    # Prefer the actual length of the stream over the `*_length` field,
+    # which may be stale (such as when rewriting the output of read_macbinary())
+    try:
+        return remaining_stream_length(section)
+    except (AttributeError, IOError, OSError, ValueError):
+        # Stream is unsized and not seekable, like a pipe
+        if section_length is None:
+            raise
+        return section_length
 
 
 def _write_macbinary_header(output, macbinary_header):
@@ -330,92 +680,34 @@ def _write_macbinary_header(output, macbinary_header):
         if 'modified' not in macbinary_header:
             macbinary_header['modified'] = now_mac_timestamp
     
-    # Write the header
+    # Compute CRC of header.
+    # Save CRC to MacBinary object in case the caller is interested.
     macbinary_header['header_crc'] = 0
-    write_structure(output, _MACBINARY_HEADER_MEMBERS, macbinary_header)
+    header_section_to_crc = _MACBINARY_HEADER_CODEC.pack(
+        macbinary_header)[:_OFFSET_TO_HEADER_CRC]
+    macbinary_header['header_crc'] = _compute_macbinary_crc(header_section_to_crc)
     
-    # Amend the header with the actual CRC
-    with save_stream_position(output):
-        offset_to_crc_member = offset_to_structure_member(
-            _MACBINARY_HEADER_MEMBERS, 'header_crc')
-        
-        # Compute CRC of header
-        output.seek(0)
-        header_section_to_crc = output.read(offset_to_crc_member)
-        header_crc = _compute_macbinary_crc(header_section_to_crc)
-        
-        # Write CRC to header
-        write_unsigned(output, 2, header_crc)
-        
-        # Save CRC to MacBinary object in case the caller is interested
-        macbinary_header['header_crc'] = header_crc
+    # Write the header
+    _MACBINARY_HEADER_CODEC.write(output, macbinary_header)
 
 
-def _write_macbinary_section(output, section_content):
-    if len(section_content) > 0:
+def _write_macbinary_section(output, section_content, section_length):
+    if hasattr(section_content, 'read'):
+        copy_stream(section_content, output, section_length)
+    elif section_length > 0:
         output.write(section_content)
-        _pad_until_next_128_byte_boundary(output)
-
-
-def _pad_until_next_128_byte_boundary(output):
-    current_offset = output.tell()
-    offset_to_next_boundary = 128 - (current_offset % 128)
-    if offset_to_next_boundary < 128:
-        for i in xrange(offset_to_next_boundary):
-            output.write(NULL_BYTE)
+    
+    # Pad until next 128 byte boundary
+    write_nulls(output,
+        _round_up_to_128_byte_boundary(section_length) - section_length)
 
 # ------------------------------------------------------------------------------
 
-_CRC_MAGIC = (
-    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
-    0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
-    0x1231, 0x0210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6,
-    0x9339, 0x8318, 0xb37b, 0xa35a, 0xd3bd, 0xc39c, 0xf3ff, 0xe3de,
-
-    0x2462, 0x3443, 0x0420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485,
-    0xa56a, 0xb54b, 0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d,
-    0x3653, 0x2672, 0x1611, 0x0630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
-    0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc,
-
-    0x48c4, 0x58e5, 0x6886, 0x78a7, 0x0840, 0x1861, 0x2802, 0x3823,
-    0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b,
-    0x5af5, 0x4ad4, 0x7ab7, 0x6a96, 0x1a71, 0x0a50, 0x3a33, 0x2a12,
-    0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a,
-
-    0x6ca6, 0x7c87, 0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0x0c60, 0x1c41,
-    0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
-    0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0x0e70,
-    0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a, 0x9f59, 0x8f78,
-
-    0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f,
-    0x1080, 0x00a1, 0x30c2, 0x20e3, 0x5004, 0x4025, 0x7046, 0x6067,
-    0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e,
-    0x02b1, 0x1290, 0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256,
-
-    0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
-    0x34e2, 0x24c3, 0x14a0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-    0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e, 0xc71d, 0xd73c,
-    0x26d3, 0x36f2, 0x0691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634,
-
-    0xd94c, 0xc96d, 0xf90e, 0xe92f, 0x99c8, 0x89e9, 0xb98a, 0xa9ab,
-    0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x08e1, 0x3882, 0x28a3,
-    0xcb7d, 0xdb5c, 0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a,
-    0x4a75, 0x5a54, 0x6a37, 0x7a16, 0x0af1, 0x1ad0, 0x2ab3, 0x3a92,
-
-    0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdaa, 0xad8b, 0x9de8, 0x8dc9,
-    0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83, 0x1ce0, 0x0cc1,
-    0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8,
-    0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0x0ed1, 0x1ef0
-)
-
 def _compute_macbinary_crc(data, crc=0):
     """
     Computes a MacBinary II style CRC checksum of the specified data.
     """
-    for b in iterord(data):
-        crc ^= b << 8
-        crc = ((crc << 8) ^ _CRC_MAGIC[crc >> 8]) & 0xFFFF
-    return crc
+    return crc16(data, crc)
 
 # ------------------------------------------------------------------------------
 
@@ -2,16 +2,26 @@
 Manipulates MacOS resource forks.
 """
 
+from classicbox.io import as_input_stream
+from classicbox.io import BufferReader
+from classicbox.io import copy_stream
+from classicbox.io import make_record_type
 from classicbox.io import print_structure
+from classicbox.io import read_fixed_bytes
 from classicbox.io import read_pascal_string
-from classicbox.io import read_structure
-from classicbox.io import read_unsigned
-from classicbox.io import sizeof_structure
+from classicbox.io import read_uint32
+from classicbox.io import remaining_stream_length
+from classicbox.io import sizeof_structure_member
+from classicbox.io import StreamWindow
+from classicbox.io import StructCodec
 from classicbox.io import StructMember
-from classicbox.io import write_pascal_string
-from classicbox.io import write_structure
-from classicbox.io import write_unsigned
+from classicbox.io import write_uint32
 
+from array import array
+from collections import namedtuple
+from collections import OrderedDict
+import hashlib
+import struct
 import sys
 
 
@@ -53,6 +63,35 @@ _RESOURCE_REFERENCE_MEMBERS = [
     StructMember('reserved_for_handle', 'unsigned', 4, 0),
 ]
 
+_RESOURCE_FORK_HEADER_CODEC = StructCodec(_RESOURCE_FORK_HEADER_MEMBERS)
+_RESOURCE_MAP_HEADER_CODEC = StructCodec(_RESOURCE_MAP_HEADER_MEMBERS)
+_RESOURCE_TYPE_CODEC = StructCodec(_RESOURCE_TYPE_MEMBERS)
+_RESOURCE_REFERENCE_CODEC = StructCodec(_RESOURCE_REFERENCE_MEMBERS)
+
+_UINT8 = struct.Struct('>B')
+
+# Resource data offsets are 3 bytes wide
+_MAX_OFFSET_FROM_RESOURCE_DATA_AREA_TO_DATA = 0xFFFFFF
+
+# Size of the chunks in which streamed resource data is hashed
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Compact alternatives to the ResourceType and Resource dictionaries
+# returned by read_resource_fork(). See the `compact` parameter.
+ResourceType = make_record_type('ResourceType',
+    _RESOURCE_TYPE_MEMBERS, ('resources',))
+ResourceReference = make_record_type('ResourceReference',
+    _RESOURCE_REFERENCE_MEMBERS, ('name', 'data'))
+
+# Result of diff_resource_forks()
+ResourceForkDiff = namedtuple(
+    'ResourceForkDiff',
+    ('added', 'removed', 'changed'))
+
+ResourceChange = namedtuple(
+    'ResourceChange',
+    ('code', 'id', 'changes'))
+
 # Resource Attributes
 RES_SYS_HEAP = 64       # set if read into system heap
 RES_PURGEABLE = 32      # set if purgeable
@@ -68,17 +107,48 @@ MAP_CHANGED = 32        # set to write map on update
 
 # ------------------------------------------------------------------------------
 
+def sniff_resource_fork(header, file_length):
+    """
+    Determines whether the specified bytes plausibly begin a resource fork of
+    the specified length, by checking that the resource data area and
+    resource map described by the fork header lie within the fork
+    without overlapping.
+    
+    Arguments:
+    * header : str-binary -- At least the first 16 bytes of the fork.
+    * file_length : int -- Length of the fork.
+    """
+    if len(header) < 16:
+        return False
+    (data_area_offset, resource_map_offset, data_area_length, resource_map_length) = \
+        struct.unpack_from('>IIII', header)
+    if data_area_offset < 16 or resource_map_length < _RESOURCE_MAP_HEADER_CODEC.size:
+        return False
+    data_area_end_offset = data_area_offset + data_area_length
+    resource_map_end_offset = resource_map_offset + resource_map_length
+    if data_area_end_offset > file_length or resource_map_end_offset > file_length:
+        return False
+    return (
+        data_area_end_offset <= resource_map_offset or
+        resource_map_end_offset <= data_area_offset)
+
+
 def read_resource_fork(
         input,
         read_all_resource_names=True,
         read_all_resource_data=False,
         read_everything=False,
+        compact=False,
+        lazy_resource_data=False,
+        resource_data_cache=None,
         _verbose=False):
     """
     Reads a resource fork from the specified input stream, returning a
     resource map object. Resource data is not read into memory by default.
     
-    All resource names can be skipped by passing `False` for the
+    The resource map, including the resource names, is read from the input with
+    a single read and decoded from memory. So reading names costs no additional
+    seeks, although they can still be skipped by passing `False` for the
     `read_all_resource_names` parameter. Skipping the names uses less memory.
     
     All resource data can be read by passing `True` for the `read_all_resource_data`
@@ -108,8 +178,27 @@ def read_resource_fork(
     Other undocumented keys may be present in the above dictionary types.
     Callers should not rely upon such keys.
     
+    If `lazy_resource_data` is True, the `data` of every Resource object is a
+    ResourceData handle instead, which reads the data only when it is first
+    accessed. If the input is a buffer (such as an mmap) the data resolves to
+    a zero-copy slice of it. Resolved data is kept in `resource_data_cache`,
+    which can be a ResourceDataCache with a byte budget so that walking every
+    resource of a large fork does not keep all of the data in memory.
+    The input must remain open for as long as the handles are in use.
+    
+    If `compact` is True, ResourceType and Resource objects are returned as
+    compact ResourceType and ResourceReference records instead of
+    dictionaries. Records support the same mapping operations as
+    dictionaries but use much less memory, which matters for forks with
+    thousands of resources. For forks with tens of thousands of resources,
+    see `read_columnar_resource_map()`, which creates no per-resource objects.
+    
+    The input may also be an in-memory buffer containing the resource fork,
+    such as a bytestring or a fork of a MappedMacBinary. Reading from such a
+    buffer does not copy it, and resource data is returned as slices of it.
+    
     Arguments:
-    * input -- Input stream to read the resource fork from.
+    * input -- Input stream or buffer to read the resource fork from.
     * read_all_resource_names : bool -- Whether to read all resource names.
                                         Defaults to True.
     * read_all_resource_data : bool - Whether to read all resource data.
@@ -118,6 +207,12 @@ def read_resource_fork(
                                 `read_all_resource_names` and
                                 `read_all_resource_data` if True.
                                 Defaults to False.
+    * compact : bool -- Whether to return compact records instead of
+                        dictionaries. Defaults to False.
+    * lazy_resource_data : bool -- Whether to attach a lazy ResourceData handle
+                                   to every resource. Defaults to False.
+    * resource_data_cache : ResourceDataCache -- Cache for lazily read data.
+                                                 Defaults to an unbounded cache.
     
     Returns a resource map object.
     """
@@ -126,18 +221,26 @@ def read_resource_fork(
         read_all_resource_names = True
         read_all_resource_data = True
     
+    input = as_input_stream(input)
+    
     # Read resource fork header
-    resource_fork_header = read_structure(input, _RESOURCE_FORK_HEADER_MEMBERS)
+    # (Use a view to avoid decoding the large reserved area)
+    resource_fork_header = _RESOURCE_FORK_HEADER_CODEC.read_view(input)
     
     if _verbose:
         print_structure(
             resource_fork_header,
             _RESOURCE_FORK_HEADER_MEMBERS, 'Resource Fork Header')
     
-    # Read resource map header
+    # Read the entire resource map with a single read,
+    # and decode it from memory
     resource_map_absolute_offset = resource_fork_header['offset_to_resource_map']
     input.seek(resource_map_absolute_offset)
-    resource_map_header = read_structure(input, _RESOURCE_MAP_HEADER_MEMBERS)
+    resource_map_bytes = read_fixed_bytes(
+        input, resource_fork_header['resource_map_length'])
+    
+    # Read resource map header
+    resource_map_header = _RESOURCE_MAP_HEADER_CODEC.unpack_from(resource_map_bytes)
     
     if _verbose:
         print_structure(
@@ -145,8 +248,17 @@ def read_resource_fork(
             _RESOURCE_MAP_HEADER_MEMBERS, 'Resource Map')
     
     # Read all resource types
+    # (The type list starts with the 'resource_type_count_minus_one' field
+    #  at the end of the resource map header)
+    resource_type_list_offset = resource_map_header['offset_to_resource_type_list']
     resource_type_count = resource_map_header['resource_type_count_minus_one'] + 1
-    resource_types = [_read_resource_type(input) for i in xrange(resource_type_count)]
+    resource_type_record_type = ResourceType if compact else None
+    resource_types = [
+        _RESOURCE_TYPE_CODEC.unpack_from(
+            resource_map_bytes,
+            resource_type_list_offset + 2 + (i * _RESOURCE_TYPE_CODEC.size),
+            resource_type_record_type)
+        for i in xrange(resource_type_count)]
     
     if _verbose:
         print '######################'
@@ -159,11 +271,19 @@ def read_resource_fork(
                 _RESOURCE_TYPE_MEMBERS, 'Resource Type')
     
     # Read all resource references
+    resource_reference_record_type = ResourceReference if compact else None
     for type in resource_types:
         # Read resource reference list for this resource type
+        reference_list_offset = (
+            resource_type_list_offset +
+            type['offset_from_resource_type_list_to_reference_list'])
         resource_reference_count = type['resource_count_minus_one'] + 1
-        resource_references = [_read_resource_reference(input) for i in 
-            xrange(resource_reference_count)]
+        resource_references = [
+            _RESOURCE_REFERENCE_CODEC.unpack_from(
+                resource_map_bytes,
+                reference_list_offset + (i * _RESOURCE_REFERENCE_CODEC.size),
+                resource_reference_record_type)
+            for i in xrange(resource_reference_count)]
         
         if _verbose:
             print '########################'
@@ -193,9 +313,11 @@ def read_resource_fork(
             print '######################'
             print
         
+        resource_name_list_offset = resource_map['offset_to_resource_name_list']
         for type in resource_map['resource_types']:
             for resource in type['resources']:
-                resource_name = read_resource_name(input, resource_map, resource)
+                resource_name = _decode_resource_name(
+                    resource_map_bytes, resource_name_list_offset, resource)
                 
                 # Save the resource name in the resource reference structure
                 resource['name'] = resource_name
@@ -214,22 +336,42 @@ def read_resource_fork(
                 
                 # Save the resource name in the resource reference structure
                 resource['data'] = resource_data
+    elif lazy_resource_data:
+        if resource_data_cache is None:
+            resource_data_cache = ResourceDataCache()
+        offset_to_resource_data_area = resource_fork_header['offset_to_resource_data_area']
+        for type in resource_map['resource_types']:
+            for resource in type['resources']:
+                resource['data'] = ResourceData(
+                    input,
+                    offset_to_resource_data_area +
+                        resource['offset_from_resource_data_area_to_data'],
+                    resource_data_cache)
     
     return resource_map
 
 
-def _read_resource_type(input):
-    return read_structure(input, _RESOURCE_TYPE_MEMBERS)
-
-
-def _read_resource_reference(input):
-    return read_structure(input, _RESOURCE_REFERENCE_MEMBERS)
+def _decode_resource_name(resource_map_bytes, resource_name_list_offset, resource):
+    offset_to_name = resource['offset_from_resource_name_list_to_name']
+    if offset_to_name == 0xFFFF:
+        # Resource has no name
+        return u''
+    
+    offset_to_name += resource_name_list_offset
+    name_length = _UINT8.unpack_from(resource_map_bytes, offset_to_name)[0]
+    name_start = offset_to_name + 1
+    return resource_map_bytes[name_start:name_start + name_length].decode('macroman')
 
 
 def read_resource_name(input, resource_map, resource):
     """
     Reads the name of the specified resource.
     """
+    input = as_input_stream(input)
+    if resource['offset_from_resource_name_list_to_name'] == 0xFFFF:
+        # Resource has no name
+        return u''
+    
     absolute_offset_to_resource_name = (
         resource_map['resource_fork_header']['offset_to_resource_map'] +
         resource_map['offset_to_resource_name_list'] +
@@ -244,26 +386,378 @@ def read_resource_data(input, resource_map, resource):
     """
     Reads the data of the specified resource.
     """
+    input = as_input_stream(input)
     absolute_offset_to_resource_data = (
         resource_map['resource_fork_header']['offset_to_resource_data_area'] +
         resource['offset_from_resource_data_area_to_data'])
     
     input.seek(absolute_offset_to_resource_data)
-    resource_data_length = read_unsigned(input, 4)
+    resource_data_length = read_uint32(input)
     resource_data = input.read(resource_data_length)
     return resource_data
 
+# ------------------------------------------------------------------------------
+# Lazy Resource Data
+
+class ResourceData(object):
+    """
+    Handle to the data of a resource within a resource fork,
+    which is read only when first accessed.
+    
+    See the `lazy_resource_data` parameter of `read_resource_fork()`.
+    """
+    __slots__ = ('_input', '_offset', '_length', '_cache')
+    
+    def __init__(self, input, offset, cache):
+        """
+        Arguments:
+        * input -- Input stream of the resource fork, typically a BufferReader.
+        * offset : int -- Absolute offset of the resource's data,
+                          including its length prefix.
+        * cache : ResourceDataCache -- Where resolved data is kept.
+        """
+        self._input = input
+        self._offset = offset
+        self._length = None
+        self._cache = cache
+    
+    def __len__(self):
+        if self._length is None:
+            self._input.seek(self._offset)
+            self._length = read_uint32(self._input)
+        return self._length
+    
+    def get(self):
+        """
+        Returns the data, reading it if it is not cached. Data read from a
+        buffer is a zero-copy slice of that buffer.
+        """
+        data = self._cache.get(self)
+        if data is None:
+            length = len(self)
+            self._input.seek(self._offset + 4)
+            data = self._input.read(length)
+            self._cache.put(self, data)
+        return data
+    
+    def open(self):
+        """
+        Returns a stream over the data, which reads from the resource fork
+        only as the stream is read. The data is not cached.
+        """
+        return StreamWindow(self._input, self._offset + 4, len(self))
+    
+    def tobytes(self):
+        """
+        Returns a copy of the data as a bytestring.
+        """
+        data = self.get()
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return bytes(data)
+    
+    def __repr__(self):
+        return 'ResourceData(offset=%d)' % self._offset
+
+
+class ResourceDataCache(object):
+    """
+    Least-recently-used cache of resolved ResourceData, holding at most
+    `max_bytes` bytes of data. The most recently resolved data is always kept,
+    even if it alone exceeds the budget.
+    
+    If `max_bytes` is None the cache is unbounded.
+    """
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.cached_bytes = 0
+        self._data_for_handle = OrderedDict()
+    
+    def __len__(self):
+        return len(self._data_for_handle)
+    
+    def get(self, handle):
+        data = self._data_for_handle.pop(handle, None)
+        if data is not None:
+            # Mark as most recently used
+            self._data_for_handle[handle] = data
+        return data
+    
+    def put(self, handle, data):
+        self._data_for_handle[handle] = data
+        self.cached_bytes += len(data)
+        
+        if self.max_bytes is not None:
+            while self.cached_bytes > self.max_bytes and len(self._data_for_handle) > 1:
+                (_, evicted_data) = self._data_for_handle.popitem(last=False)
+                self.cached_bytes -= len(evicted_data)
+    
+    def clear(self):
+        self._data_for_handle.clear()
+        self.cached_bytes = 0
+
+# ------------------------------------------------------------------------------
+# Columnar Resource Maps
+
+def read_columnar_resource_map(input, resource_data_cache=None):
+    """
+    Reads the resource map of a resource fork from the specified input stream
+    (or buffer), returning a ColumnarResourceMap.
+    
+    Unlike `read_resource_fork()`, no per-resource objects are created.
+    The reference list of each resource type is decoded in bulk into
+    parallel arrays, which take 9 bytes per resource instead of the
+    several hundred bytes that a Resource dictionary takes. This makes it
+    practical to hold the maps of many forks with tens of thousands of
+    resources in memory at once.
+    
+    The input must remain open for as long as resource data is read through
+    the returned map.
+    
+    Arguments:
+    * input -- Input stream or buffer to read the resource fork from.
+    * resource_data_cache : ResourceDataCache -- Cache for lazily read data.
+                                                 Defaults to an unbounded cache.
+    """
+    input = as_input_stream(input)
+    
+    resource_fork_header = _RESOURCE_FORK_HEADER_CODEC.read_view(input)
+    input.seek(resource_fork_header['offset_to_resource_map'])
+    resource_map_bytes = read_fixed_bytes(
+        input, resource_fork_header['resource_map_length'])
+    resource_map_header = _RESOURCE_MAP_HEADER_CODEC.unpack_from(resource_map_bytes)
+    
+    resource_type_list_offset = resource_map_header['offset_to_resource_type_list']
+    resource_types = []
+    for i in xrange(resource_map_header['resource_type_count_minus_one'] + 1):
+        type = _RESOURCE_TYPE_CODEC.unpack_from(
+            resource_map_bytes,
+            resource_type_list_offset + 2 + (i * _RESOURCE_TYPE_CODEC.size))
+        resource_types.append(_read_resource_type_columns(
+            resource_map_bytes,
+            resource_type_list_offset +
+                type['offset_from_resource_type_list_to_reference_list'],
+            type['code'],
+            type['resource_count_minus_one'] + 1))
+    
+    return ColumnarResourceMap(
+        input,
+        resource_fork_header['offset_to_resource_data_area'],
+        resource_map_header['attributes'],
+        resource_types,
+        bytes(resource_map_bytes[resource_map_header['offset_to_resource_name_list']:]),
+        resource_data_cache)
+
+
+def _read_resource_type_columns(resource_map_bytes, reference_list_offset, code, count):
+    # Each reference is an id, a name offset, and the attributes packed
+    # together with the data offset, followed by a reserved handle
+    fields = struct.unpack_from(
+        '>' + ('hHII' * count), resource_map_bytes, reference_list_offset)
+    attributes_and_data_offsets = fields[2::4]
+    return ResourceTypeColumns(
+        code,
+        array('h', fields[0::4]),
+        array('B', [value >> 24 for value in attributes_and_data_offsets]),
+        array('H', fields[1::4]),
+        # (Data offsets are 3 bytes wide, so they fit in a signed int,
+        #  whose elements are returned as ints rather than longs)
+        array('i', [value & 0xFFFFFF for value in attributes_and_data_offsets]))
+
+
+class ResourceTypeColumns(object):
+    """
+    The resources of a single type in a ColumnarResourceMap,
+    stored as parallel arrays. The i-th resource of the type has ID `ids[i]`,
+    attributes `attributes[i]`, and so on.
+    
+    Attributes:
+    * code : unicode(4) -- Code for the resource type.
+    * ids : array<signed(2)>
+    * attributes : array<unsigned(1)> -- See RES_* constants.
+    * name_offsets : array<unsigned(2)> -- Offsets from the resource name list
+                                           to each name, or 0xFFFF if unnamed.
+    * data_offsets : array<unsigned(3)> -- Offsets from the resource data area
+                                           to each resource's data.
+    """
+    __slots__ = ('code', 'ids', 'attributes', 'name_offsets', 'data_offsets')
+    
+    def __init__(self, code, ids, attributes, name_offsets, data_offsets):
+        self.code = code
+        self.ids = ids
+        self.attributes = attributes
+        self.name_offsets = name_offsets
+        self.data_offsets = data_offsets
+    
+    def __len__(self):
+        return len(self.ids)
+
+
+class ColumnarResourceMap(object):
+    """
+    A read-only resource map whose resources are stored in ResourceTypeColumns.
+    See `read_columnar_resource_map()`.
+    
+    Lookups return Resource dictionaries in the format documented by
+    `read_resource_fork()`, created on demand, whose `data` is a lazy
+    ResourceData handle. Such a Resource can be passed to `write_resource_fork()`.
+    
+    Resource types are identified by their code, such as u'vers'.
+    
+    Attributes:
+    * attributes : unsigned(2) -- Resource map attributes. See MAP_* constants.
+    * resource_types : list<ResourceTypeColumns>
+    """
+    
+    def __init__(self,
+            input, offset_to_resource_data_area, attributes, resource_types,
+            resource_name_list_bytes, resource_data_cache=None):
+        if resource_data_cache is None:
+            resource_data_cache = ResourceDataCache()
+        self.attributes = attributes
+        self.resource_types = resource_types
+        self._input = input
+        self._offset_to_resource_data_area = offset_to_resource_data_area
+        self._resource_name_list_bytes = resource_name_list_bytes
+        self._resource_data_cache = resource_data_cache
+        self._types_by_code = dict([(type.code, type) for type in resource_types])
+        self._indexes_by_code = {}
+    
+    def __len__(self):
+        return sum([len(type) for type in self.resource_types])
+    
+    def __contains__(self, type_and_id):
+        (type_code, id) = type_and_id
+        (type, i) = self._locate(type_code, id)
+        return type is not None
+    
+    def __iter__(self):
+        """
+        Iterates over (type code, resource) pairs, in resource map order.
+        Each resource is created as it is reached.
+        """
+        for type in self.resource_types:
+            for i in xrange(len(type)):
+                yield (type.code, self._resource_at(type, i))
+    
+    def type_codes(self):
+        """
+        Returns the codes of all resource types, in resource map order.
+        """
+        return [type.code for type in self.resource_types]
+    
+    def resources_of_type(self, type_code):
+        """
+        Returns the resources of the specified type, in resource map order.
+        """
+        type = self._types_by_code.get(type_code)
+        if type is None:
+            return []
+        return [self._resource_at(type, i) for i in xrange(len(type))]
+    
+    def get(self, type_code, id, default=None):
+        """
+        Returns the resource with the specified type and ID,
+        or `default` if there is no such resource.
+        """
+        (type, i) = self._locate(type_code, id)
+        if type is None:
+            return default
+        return self._resource_at(type, i)
+    
+    def get_name(self, type_code, id):
+        """
+        Returns the name of the resource with the specified type and ID,
+        without creating a Resource dictionary.
+        
+        Raises KeyError if there is no such resource.
+        """
+        (type, i) = self._locate(type_code, id)
+        if type is None:
+            raise KeyError((type_code, id))
+        return self._decode_name(type.name_offsets[i])
+    
+    def _locate(self, type_code, id):
+        """
+        Returns a tuple (type, i) where `i` is the position of the specified
+        resource within its ResourceTypeColumns `type`,
+        or (None, None) if there is no such resource.
+        
+        The position of each ID is indexed the first time its type is searched.
+        """
+        type = self._types_by_code.get(type_code)
+        if type is None:
+            return (None, None)
+        index_by_id = self._indexes_by_code.get(type_code)
+        if index_by_id is None:
+            # If an ID is duplicated, the first resource with that ID wins
+            index_by_id = {}
+            for (i, type_id) in enumerate(type.ids):
+                index_by_id.setdefault(type_id, i)
+            self._indexes_by_code[type_code] = index_by_id
+        i = index_by_id.get(id)
+        if i is None:
+            return (None, None)
+        return (type, i)
+    
+    def _resource_at(self, type, i):
+        return {
+            'id': type.ids[i],
+            'name': self._decode_name(type.name_offsets[i]),
+            'attributes': type.attributes[i],
+            'offset_from_resource_name_list_to_name': type.name_offsets[i],
+            'offset_from_resource_data_area_to_data': type.data_offsets[i],
+            'data': ResourceData(
+                self._input,
+                self._offset_to_resource_data_area + type.data_offsets[i],
+                self._resource_data_cache),
+        }
+    
+    def _decode_name(self, name_offset):
+        if name_offset == 0xFFFF:
+            # Resource has no name
+            return u''
+        name_length = _UINT8.unpack_from(self._resource_name_list_bytes, name_offset)[0]
+        return self._resource_name_list_bytes[
+            name_offset + 1:name_offset + 1 + name_length].decode('macroman')
+
 # ------------------------------------------------------------------------------
 
-def write_resource_fork(output, resource_map, _preserve_order=True):
+def write_resource_fork(output, resource_map, deduplicate=False, _preserve_order=True):
     """
     Writes a resource fork to the specified output stream using the specified
-    resource map. All resource names and data must be read into memory.
+    resource map. All resource names must be read into memory.
     
     The specified resource map must be in the format documented by
     `read_resource_fork()`. (It is not necessary for undocumented keys to be
-    present.)
+    present.) Alternatively it may be a ResourceFork.
+    
+    The `data` of each resource need not be in memory. Besides a bytestring,
+    it may be any of:
+    * ResourceData -- A lazy handle from `read_resource_fork()`.
+    * stream -- A readable stream, whose remaining contents are the data.
+    * (stream, offset, length) -- A range of bytes within a seekable stream.
+    * callable -- A function that returns any of the above. If the resource
+                  also has a `data_length` key, the function is called only
+                  when the data is written. Otherwise it is called up front
+                  to determine the length of the data.
+    
+    The layout of the resource fork is computed from the data lengths alone,
+    and data that is not in memory is copied to the output in large chunks.
+    So resource forks larger than memory can be written.
+    
+    If `deduplicate` is True, resources with identical data share a single
+    copy of it in the resource data area. Only data whose length matches that
+    of some other resource's data is hashed. Stream data is read twice
+    (once to hash it and once to write it), so such streams must be seekable.
+    
+    Returns the number of bytes that deduplication saved, which is always 0
+    if `deduplicate` is False.
     """
+    if isinstance(resource_map, ResourceFork):
+        resource_map = resource_map.resource_map
+    
     resource_types = resource_map['resource_types']
     
     # Verify that resource names and data are present
@@ -313,13 +807,33 @@ def write_resource_fork(output, resource_map, _preserve_order=True):
             [resource for (_, resource) in resources_in_resource_name_list]
         )
     
+    # Locate resource data, in the order of the resource data area
+    resource_data_sources = [
+        _locate_resource_data(resource)
+        for resource in resources_in_resource_data_area]
+    
+    # Locate resources whose data duplicates that of an earlier resource
+    if deduplicate:
+        original_indexes = _find_duplicate_resource_data(resource_data_sources)
+    else:
+        original_indexes = [None] * len(resource_data_sources)
+    
     # Compute offsets within the resource data area
     next_data_offset = 0
-    for resource in resources_in_resource_data_area:
-        data_size = 4 + len(resource['data'])
+    deduplicated_data_sources = []
+    bytes_saved = 0
+    for (resource, resource_data_source, original_index) in zip(
+            resources_in_resource_data_area, resource_data_sources, original_indexes):
+        data_size = 4 + resource_data_source[1]
+        if original_index is not None:
+            resource['offset_from_resource_data_area_to_data'] = (
+                resources_in_resource_data_area[original_index]['offset_from_resource_data_area_to_data'])
+            bytes_saved += data_size
+            continue
         
         resource['offset_from_resource_data_area_to_data'] = next_data_offset
         next_data_offset += data_size
+        deduplicated_data_sources.append(resource_data_source)
     resource_data_area_length = next_data_offset
     
     # Compute offsets within the resource name list
@@ -335,7 +849,7 @@ def write_resource_fork(output, resource_map, _preserve_order=True):
     resource_name_list_length = next_name_offset
     
     resource_map_header_length = (
-        sizeof_structure(_RESOURCE_MAP_HEADER_MEMBERS) +
+        _RESOURCE_MAP_HEADER_CODEC.size +
         # (Apparently the 'resource_type_count_minus_one' field at the end of
         #  the resource map header is considered part of the resource type list)
         -2
@@ -344,14 +858,14 @@ def write_resource_fork(output, resource_map, _preserve_order=True):
         # (Apparently the 'resource_type_count_minus_one' field at the end of
         #  the resource map header is considered part of the resource type list)
         2 +
-        len(resource_types) * sizeof_structure(_RESOURCE_TYPE_MEMBERS))
+        len(resource_types) * _RESOURCE_TYPE_CODEC.size)
     
     # Compute offsets within the reference list area,
     # that resource types refer to
     next_reference_list_area_offset = 0
     for type in resource_types:
         resource_count = len(type['resources'])
-        reference_list_length = resource_count * sizeof_structure(_RESOURCE_REFERENCE_MEMBERS)
+        reference_list_length = resource_count * _RESOURCE_REFERENCE_CODEC.size
         
         if resource_count == 0:
             raise ValueError(
@@ -392,7 +906,7 @@ def write_resource_fork(output, resource_map, _preserve_order=True):
     # Fill in resource fork header
     # (Allow undocumented key to be missing)
     resource_fork_header = resource_map.get('resource_fork_header', {})
-    resource_fork_header_length = sizeof_structure(_RESOURCE_FORK_HEADER_MEMBERS)
+    resource_fork_header_length = _RESOURCE_FORK_HEADER_CODEC.size
     resource_fork_header.update({
         'offset_to_resource_data_area': resource_fork_header_length,
         'offset_to_resource_map': resource_fork_header_length + resource_data_area_length,
@@ -402,48 +916,515 @@ def write_resource_fork(output, resource_map, _preserve_order=True):
     
     # Write everything
     _write_resource_fork_header(output, resource_fork_header)
-    _write_resource_data_area_using_map(output, resource_map, resources_in_resource_data_area)
+    _write_resource_data_area(output, deduplicated_data_sources)
     _write_resource_map(output, resource_map, resources_in_resource_name_list)
+    
+    return bytes_saved
 
 
 def _write_resource_fork_header(output, resource_fork_header):
-    write_structure(output, _RESOURCE_FORK_HEADER_MEMBERS, resource_fork_header)
+    _RESOURCE_FORK_HEADER_CODEC.write(output, resource_fork_header)
 
 
-def _write_resource_data_area_using_map(output, resource_map, resources_in_resource_data_area):
-    for resource in resources_in_resource_data_area:
-        resource_data = resource['data']
-        resource_data_length = len(resource_data)
+def _locate_resource_data(resource):
+    """
+    Returns a tuple (data, data_length) for the data of the specified resource,
+    where `data` is a bytestring, a readable stream positioned at the start of
+    the data, or a callable that returns either.
+    """
+    data = resource['data']
+    if callable(data):
+        if 'data_length' in resource:
+            # Defer call until the data is written
+            return (data, resource['data_length'])
+        data = data()
+    
+    if isinstance(data, ResourceData):
+        return (data.open(), len(data))
+    elif isinstance(data, tuple):
+        (stream, offset, length) = data
+        return (StreamWindow(stream, offset, length), length)
+    elif hasattr(data, 'read'):
+        return (data, remaining_stream_length(data))
+    else:
+        return (data, len(data))
+
+
+def _find_duplicate_resource_data(resource_data_sources):
+    """
+    Returns a list that contains, for each of the specified resource data
+    sources, the index of the first source with identical data,
+    or None if there is no such earlier source.
+    
+    Sources that must be hashed are resolved in place, so that callables
+    are called only once and streams are rewound after hashing.
+    """
+    lengths = {}
+    for (_, data_length) in resource_data_sources:
+        lengths[data_length] = lengths.get(data_length, 0) + 1
+    
+    original_indexes = []
+    index_for_digest = {}
+    for (i, (resource_data, data_length)) in enumerate(resource_data_sources):
+        if lengths[data_length] == 1:
+            # No other data has the same length, so none can be identical
+            original_indexes.append(None)
+            continue
+        
+        if callable(resource_data):
+            (resource_data, _) = _locate_resource_data({'data': resource_data()})
+            resource_data_sources[i] = (resource_data, data_length)
+        digest = (data_length, _hash_resource_data(resource_data, data_length))
         
-        write_unsigned(output, 4, resource_data_length)
-        output.write(resource_data)
+        original_indexes.append(index_for_digest.get(digest))
+        index_for_digest.setdefault(digest, i)
+    return original_indexes
+
+
+def _hash_resource_data(resource_data, resource_data_length):
+    hash = hashlib.sha1()
+    if hasattr(resource_data, 'read'):
+        start_offset = resource_data.tell()
+        remaining_length = resource_data_length
+        while remaining_length > 0:
+            chunk = read_fixed_bytes(
+                resource_data, min(remaining_length, _HASH_CHUNK_SIZE))
+            hash.update(chunk)
+            remaining_length -= len(chunk)
+        resource_data.seek(start_offset)
+    else:
+        hash.update(resource_data)
+    return hash.digest()
+
+
+def _write_resource_data_area(output, resource_data_sources):
+    for (resource_data, resource_data_length) in resource_data_sources:
+        write_uint32(output, resource_data_length)
+        
+        if callable(resource_data):
+            (resource_data, actual_length) = _locate_resource_data(
+                {'data': resource_data()})
+            if actual_length != resource_data_length:
+                raise ValueError(
+                    'Resource data has length %d but expected %d.' % (
+                        actual_length, resource_data_length))
+        
+        if isinstance(resource_data, memoryview):
+            resource_data = BufferReader(resource_data)
+        if hasattr(resource_data, 'read'):
+            copy_stream(resource_data, output, resource_data_length)
+        else:
+            output.write(resource_data)
 
 
 def _write_resource_map(output, resource_map, resources_in_resource_name_list):
-    _write_resource_map_header(output, resource_map)
+    resource_types = resource_map['resource_types']
+    resource_count = sum([len(type['resources']) for type in resource_types])
     
-    # Write resource type list
-    for type in resource_map['resource_types']:
-        _write_resource_type(output, type)
+    # Assemble the resource map in a single buffer,
+    # so that it can be written with a single call
+    buffer = bytearray(
+        _RESOURCE_MAP_HEADER_CODEC.size +
+        len(resource_types) * _RESOURCE_TYPE_CODEC.size +
+        resource_count * _RESOURCE_REFERENCE_CODEC.size)
     
-    # Write reference list area
-    for type in resource_map['resource_types']:
+    # Resource map header
+    _RESOURCE_MAP_HEADER_CODEC.pack_into(buffer, 0, resource_map)
+    offset = _RESOURCE_MAP_HEADER_CODEC.size
+    
+    # Resource type list
+    for type in resource_types:
+        _RESOURCE_TYPE_CODEC.pack_into(buffer, offset, type)
+        offset += _RESOURCE_TYPE_CODEC.size
+    
+    # Reference list area
+    for type in resource_types:
         for resource in type['resources']:
-            _write_resource_reference(output, resource)
+            _RESOURCE_REFERENCE_CODEC.pack_into(buffer, offset, resource)
+            offset += _RESOURCE_REFERENCE_CODEC.size
     
-    # Write resource name list
+    # Resource name list
     for resource in resources_in_resource_name_list:
-        write_pascal_string(output, None, resource['name'])
+        if len(resource['name']) == 0:
+            continue
+        name = resource['name'].encode('macroman')
+        buffer.append(len(name))
+        buffer.extend(name)
         # (Consider writing a padding byte if not word-aligned.)
+    
+    output.write(buffer)
 
+# ------------------------------------------------------------------------------
+# Compaction
 
-def _write_resource_map_header(output, resource_map_header):
-    write_structure(output, _RESOURCE_MAP_HEADER_MEMBERS, resource_map_header)
+def compact_resource_fork(input, output):
+    """
+    Copies the resource fork in the specified input stream to the specified
+    output stream, sharing a single copy of identical resource data and
+    dropping any unused space (such as the space left behind by
+    `update_resource_in_place()`).
+    
+    Resource data is streamed from the input, so forks larger than memory
+    can be compacted.
+    
+    Returns the number of bytes by which the output is smaller than the input.
+    """
+    input_length = remaining_stream_length(as_input_stream(input))
+    resource_map = read_resource_fork(input, lazy_resource_data=True)
+    
+    output_start_offset = output.tell()
+    write_resource_fork(output, resource_map, deduplicate=True)
+    output_length = output.tell() - output_start_offset
+    
+    return input_length - output_length
+
+# ------------------------------------------------------------------------------
+# Diffing
+
+def diff_resource_forks(input1, input2):
+    """
+    Compares the resource forks in the specified input streams (or buffers),
+    matching resources by type code and ID.
+    
+    Resource data is compared by length first. Only data of equal length is
+    read, in chunks, to compute a SHA-1 hash of it. So neither fork's data is
+    ever fully loaded into memory.
+    
+    Returns a ResourceForkDiff with:
+    * added : list<(code, id)> -- Resources only in the second fork.
+    * removed : list<(code, id)> -- Resources only in the first fork.
+    * changed : list<ResourceChange> -- Resources in both forks that differ.
+        Each ResourceChange has a `code`, an `id`, and a list of `changes`
+        naming what differs: some of 'name', 'attributes', and 'data'.
+    
+    All lists are sorted by (code, id).
+    """
+    resources1 = _resources_by_code_and_id(read_resource_fork(input1, lazy_resource_data=True))
+    resources2 = _resources_by_code_and_id(read_resource_fork(input2, lazy_resource_data=True))
+    
+    added = sorted(set(resources2) - set(resources1))
+    removed = sorted(set(resources1) - set(resources2))
+    
+    changed = []
+    for key in sorted(set(resources1) & set(resources2)):
+        (resource1, resource2) = (resources1[key], resources2[key])
+        changes = [
+            field for field in ('name', 'attributes')
+            if resource1[field] != resource2[field]]
+        if not _resource_data_equal(resource1['data'], resource2['data']):
+            changes.append('data')
+        if len(changes) > 0:
+            changed.append(ResourceChange(key[0], key[1], changes))
+    
+    return ResourceForkDiff(added, removed, changed)
 
 
-def _write_resource_type(output, resource_type):
-    write_structure(output, _RESOURCE_TYPE_MEMBERS, resource_type)
+def _resources_by_code_and_id(resource_map):
+    return dict([
+        ((type['code'], resource['id']), resource)
+        for type in resource_map['resource_types']
+        for resource in type['resources']])
 
 
-def _write_resource_reference(output, resource_reference):
-    write_structure(output, _RESOURCE_REFERENCE_MEMBERS, resource_reference)
+def _resource_data_equal(data1, data2):
+    """
+    Returns whether the specified ResourceData handles refer to identical data.
+    """
+    data_length = len(data1)
+    if data_length != len(data2):
+        return False
+    return (
+        _hash_resource_data(data1.open(), data_length) ==
+        _hash_resource_data(data2.open(), data_length))
+
+# ------------------------------------------------------------------------------
+# In-Place Updates
+
+def update_resource_in_place(stream, type_code, id, new_data):
+    """
+    Replaces the data of the specified resource within the resource fork in
+    the specified stream, rewriting as little of the fork as possible.
+    
+    If the new data fits in the resource's existing data slot (including any
+    unused space that follows it), it is written over the old data and nothing
+    else changes. Otherwise the new data is appended after the end of both the
+    resource data area and the resource map, followed by an updated copy of
+    the resource map. In either case the cost does not depend on the size of
+    the fork.
+    
+    When appending, nothing that the old fork header refers to is overwritten
+    until the final write of the first 16 bytes of the fork header, which
+    switches to the new data and map. So an interrupted append leaves the
+    original fork intact. (An interrupted overwrite of an existing data slot
+    can leave that resource's data partially updated.)
+    
+    The old data of an appended resource and the old resource map are left
+    behind as unused space. Rewriting the fork with `write_resource_fork()`
+    or `compact_resource_fork()` reclaims it.
+    
+    Arguments:
+    * stream -- A readable, writable, and seekable stream containing
+                the resource fork. For example a file opened with mode 'r+b'.
+    * type_code : unicode(4) -- Type of the resource.
+    * id : signed(2) -- ID of the resource.
+    * new_data : str-binary -- The new data of the resource.
+    
+    Returns True if the data was written over the old data,
+    or False if it was appended.
+    
+    Raises KeyError if there is no such resource.
+    """
+    new_data_length = len(new_data)
+    
+    # Read the fork header and the resource map
+    stream.seek(0)
+    resource_fork_header_bytes = read_fixed_bytes(stream, _RESOURCE_FORK_HEADER_CODEC.size)
+    resource_fork_header = _RESOURCE_FORK_HEADER_CODEC.unpack_from(resource_fork_header_bytes)
+    resource_map_offset = resource_fork_header['offset_to_resource_map']
+    stream.seek(resource_map_offset)
+    resource_map_bytes = bytearray(read_fixed_bytes(
+        stream, resource_fork_header['resource_map_length']))
+    
+    (reference_offset, reference, data_offsets) = _locate_resource_reference(
+        resource_map_bytes, type_code, id)
+    
+    # Reuse the existing data slot if the new data fits
+    # and no other resource shares the slot
+    data_area_offset = resource_fork_header['offset_to_resource_data_area']
+    data_area_length = resource_fork_header['resource_data_area_length']
+    data_offset = reference['offset_from_resource_data_area_to_data']
+    following_data_offsets = [offset for offset in data_offsets if offset > data_offset]
+    end_of_slot = min(following_data_offsets) if following_data_offsets else data_area_length
+    slot_shared = data_offsets.count(data_offset) > 1
+    if not slot_shared and 4 + new_data_length <= end_of_slot - data_offset:
+        stream.seek(data_area_offset + data_offset)
+        write_uint32(stream, new_data_length)
+        stream.write(new_data)
+        return True
+    
+    # Otherwise append the new data past both the resource data area and
+    # the resource map, so that the old fork stays intact until the end
+    free_offset = max(
+        data_area_offset + data_area_length,
+        resource_map_offset + len(resource_map_bytes))
+    new_data_offset = free_offset - data_area_offset
+    if new_data_offset > _MAX_OFFSET_FROM_RESOURCE_DATA_AREA_TO_DATA:
+        raise ValueError('No room for more data in the resource data area.')
+    new_data_area_length = new_data_offset + 4 + new_data_length
+    
+    # Point the resource at its new data,
+    # and place the resource map after the new data
+    reference['offset_from_resource_data_area_to_data'] = new_data_offset
+    _RESOURCE_REFERENCE_CODEC.pack_into(resource_map_bytes, reference_offset, reference)
+    resource_map_offset = data_area_offset + new_data_area_length
+    
+    resource_fork_header.update({
+        'offset_to_resource_map': resource_map_offset,
+        'resource_data_area_length': new_data_area_length,
+    })
+    new_resource_fork_header_bytes = _RESOURCE_FORK_HEADER_CODEC.pack(resource_fork_header)
+    
+    # Keep the copy of the fork header at the start of the resource map current,
+    # if it is a copy. Only the first 16 bytes of the fork header are copied.
+    header_copy_length = sizeof_structure_member(_RESOURCE_MAP_HEADER_MEMBERS[0])
+    if resource_map_bytes[:header_copy_length] == resource_fork_header_bytes[:header_copy_length]:
+        resource_map_bytes[:header_copy_length] = new_resource_fork_header_bytes[:header_copy_length]
+    
+    # Write data, then resource map, then fork header
+    stream.seek(free_offset)
+    write_uint32(stream, new_data_length)
+    stream.write(new_data)
+    stream.write(resource_map_bytes)
+    stream.seek(0)
+    stream.write(new_resource_fork_header_bytes[:header_copy_length])
+    return False
+
+
+def _locate_resource_reference(resource_map_bytes, type_code, id):
+    """
+    Locates the reference to the specified resource within the specified
+    resource map.
+    
+    Returns a tuple (reference_offset, reference, data_offsets), where
+    `data_offsets` lists the data offset of every resource in the map.
+    
+    Raises KeyError if there is no such resource.
+    """
+    resource_map_header = _RESOURCE_MAP_HEADER_CODEC.unpack_from(resource_map_bytes)
+    resource_type_list_offset = resource_map_header['offset_to_resource_type_list']
+    
+    located = None
+    data_offsets = []
+    for i in xrange(resource_map_header['resource_type_count_minus_one'] + 1):
+        type = _RESOURCE_TYPE_CODEC.unpack_from(
+            resource_map_bytes,
+            resource_type_list_offset + 2 + (i * _RESOURCE_TYPE_CODEC.size))
+        reference_list_offset = (
+            resource_type_list_offset +
+            type['offset_from_resource_type_list_to_reference_list'])
+        for j in xrange(type['resource_count_minus_one'] + 1):
+            reference_offset = reference_list_offset + (j * _RESOURCE_REFERENCE_CODEC.size)
+            reference = _RESOURCE_REFERENCE_CODEC.unpack_from(
+                resource_map_bytes, reference_offset)
+            data_offsets.append(reference['offset_from_resource_data_area_to_data'])
+            if type['code'] == type_code and reference['id'] == id:
+                located = (reference_offset, reference)
+    
+    if located is None:
+        raise KeyError((type_code, id))
+    return located + (data_offsets,)
+
+
+# ------------------------------------------------------------------------------
+
+class ResourceFork(object):
+    """
+    A resource map object (see `read_resource_fork()`) together with indexes
+    that find resources by type and ID, or by type and name, in constant time.
+    
+    Resources should be added, removed, and replaced through the methods of
+    this class, which keep the indexes up to date. A ResourceFork can be
+    passed to `write_resource_fork()` in place of a resource map object.
+    
+    Resource types are identified by their code, such as u'vers'.
+    """
+    
+    def __init__(self, resource_map=None):
+        """
+        Arguments:
+        * resource_map -- A resource map object, as returned by
+                          `read_resource_fork()`. Defaults to an empty map.
+        """
+        if resource_map is None:
+            resource_map = {'resource_types': []}
+        self.resource_map = resource_map
+        
+        self._types_by_code = {}
+        self._resources_by_id = {}
+        self._resources_by_name = {}
+        for type in resource_map['resource_types']:
+            self._types_by_code[type['code']] = type
+            for resource in type['resources']:
+                self._index(type['code'], resource)
+    
+    def __len__(self):
+        return len(self._resources_by_id)
+    
+    def __contains__(self, type_and_id):
+        return type_and_id in self._resources_by_id
+    
+    def __iter__(self):
+        """
+        Iterates over (type code, resource) pairs, in resource map order.
+        """
+        for type in self.resource_map['resource_types']:
+            for resource in type['resources']:
+                yield (type['code'], resource)
+    
+    def type_codes(self):
+        """
+        Returns the codes of all resource types, in resource map order.
+        """
+        return [type['code'] for type in self.resource_map['resource_types']]
+    
+    def resources_of_type(self, type_code):
+        """
+        Returns the resources of the specified type, in resource map order.
+        """
+        type = self._types_by_code.get(type_code)
+        if type is None:
+            return []
+        return list(type['resources'])
+    
+    def get(self, type_code, id, default=None):
+        """
+        Returns the resource with the specified type and ID,
+        or `default` if there is no such resource.
+        """
+        return self._resources_by_id.get((type_code, id), default)
+    
+    def get_named(self, type_code, name, default=None):
+        """
+        Returns the first resource with the specified type and name,
+        or `default` if there is no such resource.
+        
+        Resource names are only indexed if they were read with the resource map.
+        """
+        return self._resources_by_name.get((type_code, name), default)
+    
+    def add(self, type_code, resource):
+        """
+        Adds the specified resource with the specified type.
+        The resource type is created if it does not already exist.
+        
+        Raises ValueError if a resource with the same type and ID exists.
+        """
+        if (type_code, resource['id']) in self._resources_by_id:
+            raise ValueError('Resource "%s" %d already exists.' % (
+                type_code, resource['id']))
+        
+        type = self._types_by_code.get(type_code)
+        if type is None:
+            type = {'code': type_code, 'resources': []}
+            self.resource_map['resource_types'].append(type)
+            self._types_by_code[type_code] = type
+        type['resources'].append(resource)
+        self._index(type_code, resource)
+    
+    def remove(self, type_code, id):
+        """
+        Removes the resource with the specified type and ID, returning it.
+        A resource type is removed along with its last resource.
+        
+        Raises KeyError if there is no such resource.
+        """
+        resource = self._resources_by_id[(type_code, id)]
+        type = self._types_by_code[type_code]
+        del type['resources'][self._position_of(type, resource)]
+        self._unindex(type_code, resource)
+        
+        if len(type['resources']) == 0:
+            self.resource_map['resource_types'].remove(type)
+            del self._types_by_code[type_code]
+        return resource
+    
+    def replace(self, type_code, resource):
+        """
+        Replaces the resource that has the same type and ID as the specified
+        resource, keeping its position in the resource map. Returns the
+        replaced resource.
+        
+        Raises KeyError if there is no such resource.
+        """
+        old_resource = self._resources_by_id[(type_code, resource['id'])]
+        type = self._types_by_code[type_code]
+        type['resources'][self._position_of(type, old_resource)] = resource
+        self._unindex(type_code, old_resource)
+        self._index(type_code, resource)
+        return old_resource
+    
+    def _index(self, type_code, resource):
+        self._resources_by_id[(type_code, resource['id'])] = resource
+        name = resource.get('name')
+        if name:
+            self._resources_by_name.setdefault((type_code, name), resource)
+    
+    def _unindex(self, type_code, resource):
+        del self._resources_by_id[(type_code, resource['id'])]
+        name = resource.get('name')
+        if name and self._resources_by_name.get((type_code, name)) is resource:
+            del self._resources_by_name[(type_code, name)]
+            
+            # Fall back to the next resource with the same name, if any
+            type = self._types_by_code[type_code]
+            for other_resource in type['resources']:
+                if other_resource is not resource and other_resource.get('name') == name:
+                    self._resources_by_name[(type_code, name)] = other_resource
+                    break
+    
+    @staticmethod
+    def _position_of(type, resource):
+        for (i, other_resource) in enumerate(type['resources']):
+            if other_resource is resource:
+                return i
+        raise KeyError(resource['id'])
@@ -2,6 +2,10 @@
 Miscellaneous internal utilities.
 """
 
+from __future__ import absolute_import
+
+from classicbox.io import write_nulls
+import errno
 import os
 
 
@@ -15,3 +19,137 @@ try:
     from subprocess import DEVNULL  # Python 3.3+
 except:
     DEVNULL = open(os.devnull, 'wb')
+
+# ------------------------------------------------------------------------------
+# Files
+
+# ioctl request that clones (reflinks) one file into another on Linux
+# filesystems that support it, such as Btrfs and XFS.
+_FICLONE = 0x40049409
+
+_COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def allocate_file(filepath, size, preallocate=False):
+    """
+    Creates a new file of the specified size filled with zeros,
+    replacing any existing file.
+    
+    By default the file is sparse: no blocks are written, so creation takes
+    constant time regardless of size. If `preallocate` is True, all blocks
+    are allocated up front with posix_fallocate() (where available), which
+    avoids fragmenting the file when it is later written to.
+    """
+    with open(filepath, 'wb') as output:
+        if preallocate:
+            posix_fallocate = getattr(os, 'posix_fallocate', None)   # Python 3.3+
+            if posix_fallocate is not None:
+                try:
+                    posix_fallocate(output.fileno(), 0, size)
+                    return
+                except OSError as e:
+                    # Filesystem doesn't support fallocate
+                    if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                        raise
+            write_nulls(output, size)
+        else:
+            output.truncate(size)
+
+
+def clone_file(source_filepath, target_filepath):
+    """
+    Copies the specified file to the specified target path,
+    replacing any existing file.
+    
+    Uses the cheapest mechanism that is available:
+    1. a reflink, which shares blocks with the source until either is modified;
+    2. copy_file_range(), which copies within the kernel; or
+    3. a block-by-block copy that skips blocks of zeros,
+       so that sparse files remain sparse.
+    """
+    with open(source_filepath, 'rb') as source:
+        with open(target_filepath, 'wb') as target:
+            if _try_reflink(source, target):
+                return
+            if _try_copy_file_range(source, target):
+                return
+            # (Enumerating data extents moves the source's file offset)
+            source.seek(0)
+            target.seek(0)
+            _copy_sparse(source, target)
+
+
+def _try_reflink(source, target):
+    try:
+        import fcntl
+        fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+        return True
+    except (ImportError, IOError, OSError):
+        return False
+
+
+def _try_copy_file_range(source, target):
+    copy_file_range = getattr(os, 'copy_file_range', None)  # Python 3.8+, Linux
+    if copy_file_range is None:
+        return False
+    
+    source_fd = source.fileno()
+    target_fd = target.fileno()
+    size = os.fstat(source_fd).st_size
+    try:
+        # Copy only the regions of the source that contain data,
+        # so that a sparse source yields a sparse target
+        for (start, end) in _data_extents(source_fd, size):
+            offset = start
+            while offset < end:
+                copied = copy_file_range(source_fd, target_fd, end - offset, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        os.ftruncate(target_fd, size)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+        # Let the caller fall back to another mechanism
+        os.ftruncate(target_fd, 0)
+        return False
+    return True
+
+
+def _data_extents(fd, size):
+    """
+    Yields (start, end) offsets of the regions of the specified file
+    that contain data. Holes in sparse files are skipped where the
+    platform supports SEEK_DATA and SEEK_HOLE.
+    """
+    seek_data = getattr(os, 'SEEK_DATA', None)  # Python 3.3+
+    seek_hole = getattr(os, 'SEEK_HOLE', None)
+    if seek_data is None or seek_hole is None:
+        yield (0, size)
+        return
+    
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, seek_data)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break   # no more data
+            raise
+        end = min(os.lseek(fd, start, seek_hole), size)
+        yield (start, end)
+        offset = end
+
+
+def _copy_sparse(source, target):
+    zero_block = b'\0' * _COPY_BLOCK_SIZE
+    while True:
+        block = source.read(_COPY_BLOCK_SIZE)
+        if len(block) == 0:
+            break
+        if block == zero_block[:len(block)]:
+            target.seek(len(block), os.SEEK_CUR)
+        else:
+            target.write(block)
+    # Extend the file over any trailing skipped blocks
+    target.truncate(source.tell())
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+"""
+Indexes the headers of MacBinary files in a directory tree, so that files
+can be found by type, creator, and other header fields without reading them.
+
+Only the 128-byte header of each file is read. Files that do not have a
+MacBinary header (according to sniff_macbinary()) are recorded in the index
+as non-MacBinary files, so that later runs can skip them.
+
+Re-running the `update` command only re-reads files whose size or
+modification time changed since the previous run.
+
+Syntax:
+    macbinary_index.py update [--processes <N>] <index file> <directory> [...]
+    macbinary_index.py find <index file> [--type <code>] [--creator <code>]
+
+Index Format:
+* It's an SQLite database.
+* Table `macbinary_files` contains one row per indexed file, with columns:
+    * filepath, mtime, size -- Location and stat information of the file.
+                               Bytes of the filepath that are not valid in
+                               the filesystem encoding are stored as lone
+                               surrogates (U+DC80..U+DCFF).
+    * is_macbinary -- 1 if the file has a MacBinary header, otherwise 0.
+                      Remaining columns are NULL if 0.
+    * filename, file_type, file_creator, finder_flags, extra_finder_flags,
+      data_fork_length, resource_fork_length, created, modified --
+            Fields of the MacBinary header.
+"""
+
+from __future__ import absolute_import
+
+from classicbox.io import BytesIO
+from classicbox.io import decode_filepath
+from classicbox.macbinary import MACBINARY_HEADER_LENGTH
+from classicbox.macbinary import read_macbinary_header
+from classicbox.macbinary import sniff_macbinary
+from contextlib import closing
+import multiprocessing
+import os
+import os.path
+import sqlite3
+import stat
+import sys
+
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS macbinary_files (
+        filepath TEXT PRIMARY KEY,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        is_macbinary INTEGER NOT NULL,
+        filename TEXT,
+        file_type TEXT,
+        file_creator TEXT,
+        finder_flags INTEGER,
+        extra_finder_flags INTEGER,
+        data_fork_length INTEGER,
+        resource_fork_length INTEGER,
+        created INTEGER,
+        modified INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS macbinary_files_by_type_and_creator
+        ON macbinary_files (file_type, file_creator);
+    CREATE INDEX IF NOT EXISTS macbinary_files_by_creator
+        ON macbinary_files (file_creator);
+'''
+
+_COLUMNS = [
+    'filepath', 'mtime', 'size', 'is_macbinary',
+    'filename', 'file_type', 'file_creator',
+    'finder_flags', 'extra_finder_flags',
+    'data_fork_length', 'resource_fork_length',
+    'created', 'modified',
+]
+
+# Header fields that are stored in the index
+_HEADER_COLUMNS = _COLUMNS[4:]
+
+# Number of files sent to each worker process at a time
+_CHUNK_SIZE = 64
+
+# ------------------------------------------------------------------------------
+
+def main(args):
+    if len(args) == 0:
+        _exit_with_syntax()
+        return
+    command = args.pop(0)
+    
+    if command == 'update':
+        processes = None
+        if len(args) >= 2 and args[0] == '--processes':
+            processes = int(args[1])
+            args = args[2:]
+        if len(args) < 2:
+            _exit_with_syntax()
+            return
+        (index_filepath, dirpaths) = (args[0], args[1:])
+        
+        for dirpath in dirpaths:
+            if not os.path.isdir(dirpath):
+                sys.exit('directory not found: %s' % dirpath)
+                return
+        
+        (scanned_count, read_count) = update_macbinary_index(
+            index_filepath, dirpaths, processes)
+        print 'Scanned %d files. Read %d new or changed files.' % (
+            scanned_count, read_count)
+    
+    elif command == 'find':
+        if len(args) == 0:
+            _exit_with_syntax()
+            return
+        index_filepath = args.pop(0)
+        criteria = {}
+        while len(args) >= 2 and args[0] in ('--type', '--creator'):
+            criteria[args[0][2:]] = args[1].decode('macroman')
+            args = args[2:]
+        if len(args) != 0:
+            _exit_with_syntax()
+            return
+        
+        for entry in find_macbinary_files(
+                index_filepath, criteria.get('type'), criteria.get('creator')):
+            print entry['filepath'].encode('utf-8')
+    
+    else:
+        sys.exit('Unrecognized command: %s' % command)
+        return
+
+
+def _exit_with_syntax():
+    sys.exit(
+        'syntax: macbinary_index.py update [--processes <N>] <index file> <directory> [...]\n' +
+        '        macbinary_index.py find <index file> [--type <code>] [--creator <code>]')
+
+# ------------------------------------------------------------------------------
+
+def update_macbinary_index(index_filepath, dirpaths, processes=None):
+    """
+    Updates the specified index with the MacBinary headers of all files
+    within the specified directories. The index is created if it does not exist.
+    
+    Only files that are new, or whose size or modification time changed since
+    they were last indexed, are read. Entries for files within the specified
+    directories that no longer exist are removed.
+    
+    Arguments:
+    * index_filepath : str-native -- Path to the SQLite index file.
+    * dirpaths : [str-native] -- Directories to scan recursively.
+    * processes : int (optional) -- Number of worker processes that read headers.
+                                    Defaults to the number of CPUs.
+                                    If 1, headers are read in this process.
+    
+    Returns a tuple (scanned_count, read_count) with the number of files found
+    and the number of files whose header was (re)read.
+    """
+    with closing(_open_index(index_filepath)) as index:
+        indexed_stats = dict(
+            (filepath, (mtime, size))
+            for (filepath, mtime, size) in
+            index.execute('SELECT filepath, mtime, size FROM macbinary_files'))
+        
+        # Locate new and changed files
+        scanned_filepaths = set()
+        stale_files = []
+        for dirpath in dirpaths:
+            for (native_filepath, mtime, size) in _list_files(dirpath):
+                filepath = decode_filepath(native_filepath)
+                scanned_filepaths.add(filepath)
+                if indexed_stats.get(filepath) != (mtime, size):
+                    stale_files.append((native_filepath, mtime, size))
+        
+        # Read headers of new and changed files
+        if processes == 1 or len(stale_files) <= _CHUNK_SIZE:
+            entries = map(_read_index_entry, stale_files)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                entries = pool.imap_unordered(
+                    _read_index_entry, stale_files, _CHUNK_SIZE)
+                entries = list(entries)
+            finally:
+                pool.close()
+                pool.join()
+        
+        # Forget deleted files
+        scanned_dirpaths = [
+            decode_filepath(_native_dirpath(dirpath)) for dirpath in dirpaths]
+        deleted_filepaths = [
+            filepath for filepath in indexed_stats
+            if filepath not in scanned_filepaths and any(
+                filepath.startswith(dirpath + os.sep) for dirpath in scanned_dirpaths)]
+        
+        with index:
+            index.executemany(
+                'INSERT OR REPLACE INTO macbinary_files (%s) VALUES (%s)' % (
+                    ', '.join(_COLUMNS), ', '.join(['?'] * len(_COLUMNS))),
+                [entry for entry in entries if entry is not None])
+            index.executemany(
+                'DELETE FROM macbinary_files WHERE filepath = ?',
+                [(filepath,) for filepath in deleted_filepaths])
+        
+        return (len(scanned_filepaths), len(stale_files))
+
+
+def find_macbinary_files(index_filepath, file_type=None, file_creator=None):
+    """
+    Returns the indexed MacBinary files with the specified type and creator,
+    ordered by filepath.
+    
+    Each file is a dictionary whose keys are the columns of the index.
+    See the module documentation.
+    
+    Arguments:
+    * index_filepath : str-native -- Path to the SQLite index file.
+    * file_type : unicode(4) (optional) -- Only return files of this type.
+    * file_creator : unicode(4) (optional) -- Only return files with this creator.
+    """
+    (conditions, parameters) = (['is_macbinary = 1'], [])
+    if file_type is not None:
+        conditions.append('file_type = ?')
+        parameters.append(file_type)
+    if file_creator is not None:
+        conditions.append('file_creator = ?')
+        parameters.append(file_creator)
+    
+    with closing(_open_index(index_filepath)) as index:
+        rows = index.execute(
+            'SELECT %s FROM macbinary_files WHERE %s ORDER BY filepath' % (
+                ', '.join(_COLUMNS), ' AND '.join(conditions)),
+            parameters).fetchall()
+    return [dict(zip(_COLUMNS, row)) for row in rows]
+
+
+def _open_index(index_filepath):
+    index = sqlite3.connect(index_filepath)
+    index.executescript(_SCHEMA)
+    return index
+
+
+def _list_files(dirpath):
+    """
+    Yields a (filepath, mtime, size) tuple for each regular file
+    within the specified directory, recursively.
+    
+    Filepaths are native. Use `decode_filepath()` to obtain the filepath
+    that is stored in the index.
+    """
+    dirpath = _native_dirpath(dirpath)
+    for (parent_dirpath, dirnames, filenames) in os.walk(dirpath):
+        for filename in filenames:
+            filepath = os.path.join(parent_dirpath, filename)
+            try:
+                file_stat = os.lstat(filepath)
+            except OSError:
+                # Deleted while scanning
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+            yield (filepath, file_stat.st_mtime, file_stat.st_size)
+
+
+def _native_dirpath(dirpath):
+    dirpath = os.path.abspath(dirpath)
+    if bytes == str and isinstance(dirpath, unicode):
+        # Walk a bytestring dirpath, so that Python 2 does not try
+        # (and fail) to decode the filenames within
+        dirpath = dirpath.encode(sys.getfilesystemencoding())
+    return dirpath
+
+
+def _read_index_entry(file_stat):
+    """
+    Reads the header of the specified file and returns its row in the index,
+    or None if the file could not be read.
+    
+    This function runs in a worker process.
+    """
+    (native_filepath, mtime, size) = file_stat
+    filepath = decode_filepath(native_filepath)
+    try:
+        with open(native_filepath, 'rb') as input:
+            header_bytes = input.read(MACBINARY_HEADER_LENGTH)
+    except IOError:
+        return None
+    
+    header_fields = [None] * len(_HEADER_COLUMNS)
+    is_macbinary = sniff_macbinary(header_bytes, size) is not None
+    if is_macbinary:
+        header = read_macbinary_header(BytesIO(header_bytes))
+        for (i, column) in enumerate(_HEADER_COLUMNS):
+            try:
+                header_fields[i] = header[column]
+            except NotImplementedError:
+                # Filename in a script other than MacRoman
+                pass
+    return (filepath, mtime, size, int(is_macbinary)) + tuple(header_fields)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""
+Re-encodes all MacBinary files in a directory tree as canonical MacBinary III,
+in place.
+
+A canonical MacBinary III file is exactly what `write_macbinary()` produces
+for the same header fields, forks, and comment: it has the 'mBIN' signature,
+a valid header CRC, zeroed reserved fields, and zero padding after each fork.
+Canonical files of identical content are byte-for-byte identical, which
+makes them deduplicate well.
+
+Forks are streamed, so memory use does not depend on the size of the files.
+Files that are already canonical are left untouched. Files that are not
+MacBinary files are ignored.
+
+Progress is recorded in a manifest file as each file is processed, so that
+an interrupted run resumes where it left off. Files recorded in the manifest
+whose size and modification time are unchanged are skipped.
+
+Syntax:
+    macbinary_normalize.py [--processes <N>] [--manifest <file>] <directory>
+
+Options:
+* --processes <N> -- Number of worker processes. Defaults to the number of CPUs.
+* --manifest <file> -- Location of the manifest file.
+                       Defaults to .macbinary_normalize.jsonl in the directory.
+
+Manifest Format:
+* It's JSON Lines, one object per processed file. Later lines supersede
+  earlier lines for the same file.
+* Grammar:
+    * Line: {filepath, size, mtime, status, sha1}
+        * filepath -- Path of the file, relative to the directory.
+                      Bytes that are not valid in the filesystem encoding
+                      are stored as lone surrogates (U+DC80..U+DCFF).
+        * status -- One of 'canonical', 'normalized', 'not_macbinary', 'error'.
+                    Files that cannot be rewritten without loss (such as
+                    those with a secondary header) are left untouched and
+                    recorded as 'error'.
+        * sha1 -- Hex SHA-1 of the file's (canonical) content, or null.
+"""
+
+from __future__ import absolute_import
+
+from classicbox.io import BytesIO
+from classicbox.io import decode_filepath
+from classicbox.io import read_fixed_bytes
+from classicbox.macbinary import MACBINARY_HEADER_LENGTH
+from classicbox.macbinary import MacBinaryReader
+from classicbox.macbinary import read_macbinary_header
+from classicbox.macbinary import sniff_macbinary
+from classicbox.macbinary import write_macbinary
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import stat
+import sys
+from tempfile import NamedTemporaryFile
+
+
+_DEFAULT_MANIFEST_FILENAME = '.macbinary_normalize.jsonl'
+
+# Suffix of the temporary file that a normalized file is written to,
+# before it replaces the original file
+_TEMP_SUFFIX = '.normalizing'
+
+# Header fields that are preserved by normalization.
+# Other fields are either derived from the forks or reset to their defaults.
+_PRESERVED_HEADER_FIELDS = [
+    'filename',
+    'file_type',
+    'file_creator',
+    'finder_flags',
+    'y_position',
+    'x_position',
+    'parent_directory_id',
+    'protected',
+    'created',
+    'modified',
+    'extra_finder_flags',
+    'filename_script',
+    'extended_finder_flags',
+]
+
+# Size of the chunks in which files are hashed
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# ------------------------------------------------------------------------------
+
+def main(args):
+    processes = None
+    manifest_filepath = None
+    while len(args) > 0 and args[0].startswith('--'):
+        if len(args) < 2:
+            _exit_with_syntax()
+            return
+        (option, value) = (args[0], args[1])
+        args = args[2:]
+        if option == '--processes':
+            processes = int(value)
+        elif option == '--manifest':
+            manifest_filepath = value
+        else:
+            _exit_with_syntax()
+            return
+    if len(args) != 1:
+        _exit_with_syntax()
+        return
+    dirpath = args[0]
+    
+    if not os.path.isdir(dirpath):
+        sys.exit('directory not found: %s' % dirpath)
+        return
+    
+    status_counts = normalize_macbinary_files(dirpath, manifest_filepath, processes)
+    for status in sorted(status_counts):
+        print '%s: %d' % (status, status_counts[status])
+
+
+def _exit_with_syntax():
+    sys.exit('syntax: macbinary_normalize.py [--processes <N>] [--manifest <file>] <directory>')
+
+# ------------------------------------------------------------------------------
+
+def normalize_macbinary_files(dirpath, manifest_filepath=None, processes=None):
+    """
+    Re-encodes all MacBinary files within the specified directory as canonical
+    MacBinary III files, in place. See the module documentation for details.
+    
+    Arguments:
+    * dirpath : str-native -- Directory to process recursively.
+    * manifest_filepath : str-native (optional) -- Location of the manifest file.
+            Defaults to .macbinary_normalize.jsonl in the directory.
+    * processes : int (optional) -- Number of worker processes.
+                                    Defaults to the number of CPUs.
+                                    If 1, files are processed in this process.
+    
+    Returns a dictionary mapping each status to the number of files that were
+    processed in this run with that status. Files skipped because of the
+    manifest are counted with the status 'unchanged'.
+    """
+    dirpath = os.path.abspath(dirpath)
+    if manifest_filepath is None:
+        manifest_filepath = os.path.join(dirpath, _DEFAULT_MANIFEST_FILENAME)
+    manifest_filepath = os.path.abspath(manifest_filepath)
+    
+    manifest = _read_manifest(manifest_filepath)
+    canonical_hashes = set([
+        entry['sha1'] for entry in manifest.values()
+        if entry['status'] in ('canonical', 'normalized')])
+    
+    # Locate files that are new or changed since they were last processed
+    status_counts = {}
+    tasks = []
+    for (filepath, size, mtime) in _list_files(dirpath):
+        if filepath == manifest_filepath:
+            continue
+        relative_filepath = os.path.relpath(filepath, dirpath)
+        entry = manifest.get(decode_filepath(relative_filepath))
+        if entry is not None and (entry['size'], entry['mtime']) == (size, mtime):
+            status_counts['unchanged'] = status_counts.get('unchanged', 0) + 1
+            continue
+        tasks.append((dirpath, relative_filepath))
+    
+    # Process files, recording each result in the manifest as soon as it is known
+    with open(manifest_filepath, 'ab') as manifest_file:
+        if processes == 1:
+            _init_worker(canonical_hashes)
+            entries = (_normalize_file(task) for task in tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, _init_worker, (canonical_hashes,))
+            entries = pool.imap_unordered(_normalize_file, tasks)
+        try:
+            for entry in entries:
+                manifest_file.write((json.dumps(entry, sort_keys=True) + '\n').encode('ascii'))
+                manifest_file.flush()
+                status_counts[entry['status']] = status_counts.get(entry['status'], 0) + 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    
+    return status_counts
+
+
+def _read_manifest(manifest_filepath):
+    """
+    Reads the specified manifest file, if it exists, returning a dictionary
+    that maps each relative filepath (as decoded by `decode_filepath()`)
+    to its latest manifest entry.
+    """
+    manifest = {}
+    if not os.path.exists(manifest_filepath):
+        return manifest
+    with open(manifest_filepath, 'r+b') as manifest_file:
+        line_offset = 0
+        for line in iter(manifest_file.readline, b''):
+            if not line.endswith(b'\n'):
+                # Remove partially written line from an interrupted run
+                manifest_file.truncate(line_offset)
+                break
+            entry = json.loads(line)
+            manifest[entry['filepath']] = entry
+            line_offset += len(line)
+    return manifest
+
+
+def _list_files(dirpath):
+    """
+    Yields a (filepath, size, mtime) tuple for each regular file
+    within the specified directory, recursively.
+    """
+    for (parent_dirpath, dirnames, filenames) in os.walk(dirpath):
+        for filename in filenames:
+            if filename.endswith(_TEMP_SUFFIX):
+                continue
+            filepath = os.path.join(parent_dirpath, filename)
+            try:
+                file_stat = os.lstat(filepath)
+            except OSError:
+                # Deleted while scanning
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+            yield (filepath, file_stat.st_size, file_stat.st_mtime)
+
+# ------------------------------------------------------------------------------
+# Worker Process
+
+_canonical_hashes = None
+
+def _init_worker(canonical_hashes):
+    global _canonical_hashes
+    _canonical_hashes = canonical_hashes
+
+
+def _normalize_file(task):
+    """
+    Normalizes the specified file, returning its manifest entry.
+    """
+    (dirpath, relative_filepath) = task
+    filepath = os.path.join(dirpath, relative_filepath)
+    try:
+        (status, sha1) = _normalize_file_in_place(filepath)
+    except Exception as e:
+        (status, sha1) = ('error', None)
+        print >> sys.stderr, 'Unable to normalize %s: %s' % (filepath, e)
+    
+    try:
+        file_stat = os.stat(filepath)
+        (size, mtime) = (file_stat.st_size, file_stat.st_mtime)
+    except OSError as e:
+        # Deleted or made unreadable while processing.
+        # (An entry without a size is retried by the next run.)
+        if status != 'error':
+            print >> sys.stderr, 'Unable to normalize %s: %s' % (filepath, e)
+        (status, sha1) = ('error', None)
+        (size, mtime) = (None, None)
+    
+    return {
+        'filepath': decode_filepath(relative_filepath),
+        'size': size,
+        'mtime': mtime,
+        'status': status,
+        'sha1': sha1,
+    }
+
+
+def _normalize_file_in_place(filepath):
+    """
+    Returns a tuple (status, sha1) describing the outcome.
+    """
+    with open(filepath, 'rb') as input:
+        file_length = os.fstat(input.fileno()).st_size
+        header_bytes = input.read(MACBINARY_HEADER_LENGTH)
+        if sniff_macbinary(header_bytes, file_length) is None:
+            return ('not_macbinary', None)
+        _check_rewritable(read_macbinary_header(BytesIO(header_bytes)), file_length)
+        
+        # Hash the original file
+        input.seek(0)
+        original_hash = hashlib.sha1()
+        while True:
+            chunk = input.read(_HASH_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            original_hash.update(chunk)
+        original_sha1 = original_hash.hexdigest()
+        if original_sha1 in _canonical_hashes:
+            # Identical to a file already known to be canonical
+            return ('canonical', original_sha1)
+        
+        # Write canonical encoding to a temporary file alongside the original
+        input.seek(0)
+        reader = MacBinaryReader(input)
+        macbinary = dict([
+            (field, reader.header[field]) for field in _PRESERVED_HEADER_FIELDS])
+        macbinary.update({
+            'data_fork': reader.data_fork,
+            'resource_fork': reader.resource_fork,
+            'comment': read_fixed_bytes(reader.comment, len(reader.comment)),
+        })
+        
+        temp_file = NamedTemporaryFile(
+            dir=os.path.dirname(filepath), suffix=_TEMP_SUFFIX, delete=False)
+        try:
+            try:
+                output = _HashingWriter(temp_file)
+                write_macbinary(output, macbinary)
+            finally:
+                temp_file.close()
+            
+            canonical_sha1 = output.hash.hexdigest()
+            if canonical_sha1 == original_sha1:
+                os.remove(temp_file.name)
+                return ('canonical', canonical_sha1)
+            
+            # Replace original with canonical encoding
+            shutil.copystat(filepath, temp_file.name)
+            os.rename(temp_file.name, filepath)
+            return ('normalized', canonical_sha1)
+        except:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+
+
+def _check_rewritable(header, file_length):
+    """
+    Raises ValueError if the MacBinary file with the specified header and
+    length cannot be rewritten without losing or corrupting its contents.
+    """
+    if header['reserved_for_second_header_length'] != 0:
+        # MacBinaryReader does not skip a secondary header,
+        # and write_macbinary() cannot preserve one
+        raise ValueError('Secondary headers are not supported.')
+    
+    # Header, then each fork padded to a multiple of 128 bytes, then comment
+    padded_length = lambda length: (length + 127) // 128 * 128
+    comment_end_offset = (
+        MACBINARY_HEADER_LENGTH +
+        padded_length(header['data_fork_length']) +
+        padded_length(header['resource_fork_length']) +
+        header['comment_length'])
+    if comment_end_offset > file_length:
+        raise ValueError('Comment extends past the end of the file.')
+
+
+class _HashingWriter(object):
+    """
+    Output stream that computes the SHA-1 of everything written to it,
+    while passing the data through to an underlying output stream.
+    """
+    
+    def __init__(self, output):
+        self._output = output
+        self.hash = hashlib.sha1()
+    
+    def write(self, data):
+        self.hash.update(data)
+        self._output.write(data)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
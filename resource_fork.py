@@ -1,24 +1,114 @@
 #!/usr/bin/env python
 
 """
-Reads resource forks.
+Reads, compacts, compares, and extracts resource forks.
+
+Syntax:
+    resource_fork.py info <resource fork file>
+    resource_fork.py compact <resource fork file> <output file>
+    resource_fork.py diff <resource fork file 1> <resource fork file 2>
+    resource_fork.py extract [--processes <N>] [--type <code> ...] <output directory> <file or directory> [...]
+
+Diff Format:
+* One line per added (+), removed (-), or changed (%) resource.
+  Changed resources list what changed: some of name, attributes, and data.
+* Example:
+    + 'STR ' 128
+    - 'ICN#' 129
+    % 'MENU' 1 (name, data)
+
+Extract:
+* Extracts the resources of every MacBinary file, AppleSingle or AppleDouble
+  file, and raw resource fork within the specified files and directories.
+  Other files are ignored.
+* Only resources of the types given with --type are extracted.
+  If no --type is given, all resources are extracted.
+* Files are processed in parallel by --processes worker processes, which
+  default to the number of CPUs. Resource data is streamed, so memory use per
+  worker depends on the size of the largest resource map, not the largest
+  resource.
+* Each resource's data is stored in the output directory at
+  <first 2 digits of SHA-1>/<SHA-1>, so identical resources are stored once.
+
+Extract Manifest Format:
+* A line is appended to manifest.jsonl in the output directory
+  for each extracted resource.
+* It's JSON Lines.
+* Grammar:
+    * Line: {filepath, format, type, id, name, attributes, length, sha1}
+        * filepath -- Path of the file that contained the resource.
+                      Bytes that are not valid in the filesystem encoding
+                      are stored as lone surrogates (U+DC80..U+DCFF).
+        * format -- One of 'macbinary', 'apple_double', 'resource_fork'.
+        * sha1 -- Hex SHA-1 of the resource's data, which locates its copy.
 """
 
+from classicbox.apple_double import ENTRY_RESOURCE_FORK
+from classicbox.apple_double import open_apple_double_entry
+from classicbox.apple_double import sniff_apple_double
 from classicbox.io import BytesIO
+from classicbox.io import decode_filepath
+from classicbox.io import StreamWindow
+from classicbox.macbinary import MACBINARY_HEADER_LENGTH
+from classicbox.macbinary import MacBinaryReader
+from classicbox.macbinary import sniff_macbinary
+from classicbox.resource_fork import compact_resource_fork
+from classicbox.resource_fork import diff_resource_forks
+from classicbox.resource_fork import read_columnar_resource_map
 from classicbox.resource_fork import read_resource_fork
+from classicbox.resource_fork import sniff_resource_fork
 from classicbox.resource_fork import write_resource_fork
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path
+import stat
 import sys
+from tempfile import NamedTemporaryFile
+
+
+_MANIFEST_FILENAME = 'manifest.jsonl'
+
+# Suffix of the temporary file that resource data is written to,
+# before it is moved to its content-addressed location
+_TEMP_SUFFIX = '.extracting'
+
+# Size of the chunks in which resource data is copied
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Number of files sent to each worker process at a time
+_CHUNK_SIZE = 16
 
 # ------------------------------------------------------------------------------
 
 def main(args):
-    (command, resource_file_filepath, ) = args
+    if len(args) >= 1 and args[0] == 'extract':
+        _main_extract(args[1:])
+        return
+    
+    (command, resource_file_filepath, ) = args[:2]
     
     if command == 'info':
         with open(resource_file_filepath, 'rb') as input:
             # Read and print the contents of the resource map
             print_resource_fork(input)
     
+    elif command == 'compact':
+        (output_filepath, ) = args[2:]
+        with open(resource_file_filepath, 'rb') as input:
+            with open(output_filepath, 'wb') as output:
+                bytes_saved = compact_resource_fork(input, output)
+        print 'Saved %d bytes.' % bytes_saved
+    
+    elif command == 'diff':
+        (other_resource_file_filepath, ) = args[2:]
+        with open(resource_file_filepath, 'rb') as input1:
+            with open(other_resource_file_filepath, 'rb') as input2:
+                resource_fork_diff = diff_resource_forks(input1, input2)
+        print_resource_fork_diff(resource_fork_diff)
+    
     elif command == 'test_read_write_approx':
         test_read_write_approx(resource_file_filepath)
     
@@ -34,6 +124,37 @@ def main(args):
         return
 
 
+def _main_extract(args):
+    processes = None
+    type_codes = []
+    while len(args) >= 2 and args[0] in ('--processes', '--type'):
+        (option, value) = (args[0], args[1])
+        args = args[2:]
+        if option == '--processes':
+            processes = int(value)
+        else:
+            # Resource type codes are 4 characters, like u'STR '
+            if len(value) > 4:
+                sys.exit('resource type code is longer than 4 characters: %s' % value)
+                return
+            type_codes.append(value.decode('macroman').ljust(4))
+    if len(args) < 2:
+        sys.exit('syntax: resource_fork.py extract [--processes <N>] [--type <code> ...] <output directory> <file or directory> [...]')
+        return
+    (output_dirpath, input_paths) = (args[0], args[1:])
+    
+    for input_path in input_paths:
+        if not os.path.exists(input_path):
+            sys.exit('file not found: %s' % input_path)
+            return
+    
+    (format_counts, resource_count) = extract_resources(
+        output_dirpath, input_paths, type_codes or None, processes)
+    for format in sorted(format_counts):
+        print '%s: %d' % (format, format_counts[format])
+    print 'Extracted %d resources.' % resource_count
+
+
 def test_read_write_approx(resource_file_filepath):
     """
     Tests that the specified fork written by write_resource_fork() is read
@@ -144,6 +265,197 @@ def print_resource_fork(input_resource_fork_stream):
         read_all_resource_names=True,
         _verbose=True)
 
+
+def print_resource_fork_diff(resource_fork_diff):
+    for (code, id) in resource_fork_diff.added:
+        print "+ '%s' %d" % (code.encode('macroman'), id)
+    for (code, id) in resource_fork_diff.removed:
+        print "- '%s' %d" % (code.encode('macroman'), id)
+    for change in resource_fork_diff.changed:
+        print "%% '%s' %d (%s)" % (
+            change.code.encode('macroman'), change.id, ', '.join(change.changes))
+
+# ------------------------------------------------------------------------------
+# Extract
+
+def extract_resources(output_dirpath, input_paths, type_codes=None, processes=None):
+    """
+    Extracts resources from the specified files and directories into the
+    specified output directory, recording each in the output directory's
+    manifest. See the module documentation for details.
+    
+    Arguments:
+    * output_dirpath : str-native -- Directory to extract to.
+                                     Created if it does not exist.
+    * input_paths : [str-native] -- Files and directories (searched
+                                    recursively) to extract from.
+    * type_codes : [unicode(4)] (optional) -- Types of resources to extract.
+                                              Defaults to all types.
+    * processes : int (optional) -- Number of worker processes.
+                                    Defaults to the number of CPUs.
+                                    If 1, files are processed in this process.
+    
+    Returns a tuple (format_counts, resource_count), where `format_counts`
+    maps each format (or 'unrecognized' or 'error') to the number of files
+    found in that format, and `resource_count` is the number of resources
+    extracted.
+    """
+    output_dirpath = os.path.abspath(output_dirpath)
+    if not os.path.isdir(output_dirpath):
+        os.makedirs(output_dirpath)
+    manifest_filepath = os.path.join(output_dirpath, _MANIFEST_FILENAME)
+    
+    tasks = [
+        (filepath, output_dirpath, type_codes)
+        for filepath in _list_input_files(input_paths)
+        if not _is_within_directory(filepath, output_dirpath)]
+    
+    format_counts = {}
+    resource_count = 0
+    with open(manifest_filepath, 'ab') as manifest_file:
+        if processes == 1:
+            results = (_extract_resources_from_file(task) for task in tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(_extract_resources_from_file, tasks, _CHUNK_SIZE)
+        try:
+            for (format, entries) in results:
+                format_counts[format] = format_counts.get(format, 0) + 1
+                for entry in entries:
+                    manifest_file.write((json.dumps(entry, sort_keys=True) + '\n').encode('ascii'))
+                resource_count += len(entries)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    
+    return (format_counts, resource_count)
+
+
+def _list_input_files(input_paths):
+    """
+    Yields the path of each regular file that is one of, or is within one of,
+    the specified paths.
+    """
+    for input_path in input_paths:
+        if not os.path.isdir(input_path):
+            yield os.path.abspath(input_path)
+            continue
+        for (parent_dirpath, dirnames, filenames) in os.walk(os.path.abspath(input_path)):
+            for filename in filenames:
+                filepath = os.path.join(parent_dirpath, filename)
+                try:
+                    file_stat = os.lstat(filepath)
+                except OSError:
+                    # Deleted while scanning
+                    continue
+                if stat.S_ISREG(file_stat.st_mode):
+                    yield filepath
+
+
+def _is_within_directory(filepath, dirpath):
+    return filepath.startswith(dirpath + os.sep)
+
+# ------------------------------------------------------------------------------
+# Extract: Worker Process
+
+def _extract_resources_from_file(task):
+    """
+    Extracts the selected resources of the specified file, returning a tuple
+    (format, manifest_entries).
+    """
+    (filepath, output_dirpath, type_codes) = task
+    try:
+        with open(filepath, 'rb') as input:
+            (format, resource_fork) = _open_resource_fork(input)
+            if resource_fork is None or len(resource_fork) == 0:
+                return (format, [])
+            
+            resource_map = read_columnar_resource_map(resource_fork)
+            entries = []
+            for code in resource_map.type_codes():
+                if type_codes is not None and code not in type_codes:
+                    continue
+                for resource in resource_map.resources_of_type(code):
+                    (length, sha1) = _extract_resource_data(
+                        resource['data'], output_dirpath)
+                    entries.append({
+                        'filepath': decode_filepath(filepath),
+                        'format': format,
+                        'type': code,
+                        'id': resource['id'],
+                        'name': resource['name'],
+                        'attributes': resource['attributes'],
+                        'length': length,
+                        'sha1': sha1,
+                    })
+            return (format, entries)
+    except Exception as e:
+        print >> sys.stderr, 'Unable to extract resources from %s: %s' % (filepath, e)
+        return ('error', [])
+
+
+def _open_resource_fork(input):
+    """
+    Determines the format of the file in the specified input stream, returning
+    a tuple (format, resource_fork) where `resource_fork` is a stream over the
+    file's resource fork, or None if the format is 'unrecognized'.
+    """
+    file_length = os.fstat(input.fileno()).st_size
+    header_bytes = input.read(MACBINARY_HEADER_LENGTH)
+    
+    if sniff_apple_double(header_bytes) is not None:
+        resource_fork = open_apple_double_entry(input, ENTRY_RESOURCE_FORK)
+        return ('apple_double', resource_fork)
+    
+    if sniff_macbinary(header_bytes, file_length) is not None:
+        input.seek(0)
+        return ('macbinary', MacBinaryReader(input).resource_fork)
+    
+    if sniff_resource_fork(header_bytes, file_length):
+        return ('resource_fork', StreamWindow(input, 0, file_length))
+    
+    return ('unrecognized', None)
+
+
+def _extract_resource_data(resource_data, output_dirpath):
+    """
+    Copies the specified ResourceData to its content-addressed location
+    within the output directory, returning a tuple (length, sha1).
+    """
+    hash = hashlib.sha1()
+    temp_file = NamedTemporaryFile(
+        dir=output_dirpath, suffix=_TEMP_SUFFIX, delete=False)
+    try:
+        with temp_file:
+            with resource_data.open() as data:
+                while True:
+                    chunk = data.read(_COPY_CHUNK_SIZE)
+                    if len(chunk) == 0:
+                        break
+                    hash.update(chunk)
+                    temp_file.write(chunk)
+        
+        sha1 = hash.hexdigest()
+        bucket_dirpath = os.path.join(output_dirpath, sha1[:2])
+        try:
+            os.mkdir(bucket_dirpath)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        
+        data_filepath = os.path.join(bucket_dirpath, sha1)
+        if os.path.exists(data_filepath):
+            os.remove(temp_file.name)
+        else:
+            os.rename(temp_file.name, data_filepath)
+        return (len(resource_data), sha1)
+    except:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+
 # ------------------------------------------------------------------------------
 
 if __name__ == '__main__':
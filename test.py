@@ -10,6 +10,8 @@ import alias_record
 import catalog_create
 import catalog_diff
 import macbinary_file
+import macbinary_index
+import macbinary_normalize
 import resource_fork
 
 # For _test_create_alias_file()
@@ -22,6 +24,75 @@ from classicbox.macbinary import write_macbinary_to_buffer
 import os
 import os.path
 
+# For test_classicbox_io()
+from classicbox.io import at_eof
+from classicbox.io import BufferReader
+from classicbox.io import BytesIO
+from classicbox.io import read_signed
+from classicbox.io import read_structure
+from classicbox.io import read_uint32_array
+from classicbox.io import read_unsigned
+from classicbox.io import read_until_eof
+from classicbox.io import StructCodec
+from classicbox.io import StructMember
+from classicbox.io import write_signed
+from classicbox.io import write_structure
+from classicbox.io import write_uint32_array
+from classicbox.io import write_unsigned
+from classicbox.macbinary import _MACBINARY_HEADER_CODEC
+from classicbox.macbinary import _MACBINARY_HEADER_MEMBERS
+from classicbox.macbinary import read_macbinary
+from classicbox.macbinary import MacBinaryReader
+from classicbox.macbinary import open_macbinary_mmap
+from classicbox.macbinary import MACBINARY_I
+from classicbox.macbinary import MACBINARY_II
+from classicbox.macbinary import MACBINARY_III
+from classicbox.macbinary import read_macbinary_header
+from classicbox.macbinary import sniff_macbinary
+from classicbox.macbinary import sniff_macbinary_batch
+from classicbox.macbinary import write_macbinary
+from classicbox.macbinary import write_macbinary_from_files
+from classicbox.resource_fork import compact_resource_fork
+from classicbox.resource_fork import diff_resource_forks
+from classicbox.resource_fork import read_columnar_resource_map
+from classicbox.resource_fork import read_resource_fork
+from classicbox.resource_fork import ResourceChange
+from classicbox.resource_fork import ResourceDataCache
+from classicbox.resource_fork import ResourceFork
+from classicbox.resource_fork import ResourceReference
+from classicbox.resource_fork import update_resource_in_place
+from classicbox.resource_fork import write_resource_fork
+import gc
+import mmap
+import pickle
+
+# For _test_resource_fork_extract()
+from classicbox.apple_double import APPLE_DOUBLE_MAGIC_NUMBER
+from classicbox.apple_double import ENTRY_FINDER_INFO
+from classicbox.apple_double import ENTRY_RESOURCE_FORK
+import hashlib
+import struct
+
+# For test_classicbox_crc()
+from classicbox.crc import _crc16_update_sliced
+from classicbox.crc import crc16
+from classicbox.crc import CRC16
+
+# For test_classicbox_disk_hfs()
+from classicbox.disk.hfs import _hfs_set_volume_dates
+from classicbox.disk.hfs import HFSTemplateCache
+
+# For test_classicbox_util()
+from classicbox.util import allocate_file
+from classicbox.util import clone_file
+import classicbox.util
+import errno
+
+# For test_macbinary_index(), test_macbinary_normalize()
+from classicbox.io import decode_filepath
+import shutil
+from tempfile import mkdtemp
+
 # For _test_catalog_create_output()
 from classicbox.time import convert_local_to_mac_timestamp
 import json
@@ -46,11 +117,18 @@ def main(args):
     
     # classicbox.alias.file (and dependencies)
     test_classicbox_io()
+    test_classicbox_crc()
+    test_classicbox_util()
+    test_classicbox_disk_hfs()
     test_classicbox_alias_record()
     test_classicbox_resource_fork()
     test_classicbox_macbinary()
     test_classicbox_alias_file()
     
+    # macbinary_index, macbinary_normalize
+    test_macbinary_index()
+    test_macbinary_normalize()
+    
     # catalog_create, catalog_diff
     test_catalog_create()
     test_catalog_diff()
@@ -61,9 +139,333 @@ def main(args):
 
 
 def test_classicbox_io():
-    # No specific tests for this module.
-    # Currently io is tested indirectly by all of its (numerous) dependants.
-    pass
+    # Currently io is mostly tested indirectly by all of its (numerous) dependants.
+    test_throws_no_exceptions(
+        'test_io_struct_codec_matches_read_write_structure', lambda: \
+        _test_struct_codec_matches_read_write_structure())
+    test_throws_no_exceptions(
+        'test_io_struct_codec_writes_each_record_once', lambda: \
+        _test_struct_codec_writes_each_record_once())
+    test_throws_no_exceptions(
+        'test_io_integers_round_trip', lambda: \
+        _test_integers_round_trip())
+    test_throws_no_exceptions(
+        'test_io_buffer_reader_matches_stream', lambda: \
+        _test_buffer_reader_matches_stream())
+
+
+def _test_struct_codec_matches_read_write_structure():
+    with open('test_data/AppAlias.bin', 'rb') as file:
+        header_bytes = file.read(128)
+    
+    # A codec must read the same structure as read_structure()...
+    expected_header = read_structure(BytesIO(header_bytes), _MACBINARY_HEADER_MEMBERS)
+    assert_equal(expected_header,
+        _MACBINARY_HEADER_CODEC.read(BytesIO(header_bytes)),
+        'StructCodec.read() did not match read_structure().')
+    assert_equal(expected_header,
+        _MACBINARY_HEADER_CODEC.unpack_from(header_bytes),
+        'StructCodec.unpack_from() did not match read_structure().')
+    
+    # ...and write the same bytes as write_structure()
+    expected_output = BytesIO()
+    write_structure(expected_output, _MACBINARY_HEADER_MEMBERS, expected_header)
+    assert_equal(expected_output.getvalue(),
+        _MACBINARY_HEADER_CODEC.pack(expected_header),
+        'StructCodec.pack() did not match write_structure().')
+
+
+def _test_struct_codec_writes_each_record_once():
+    class WriteCountingStream(object):
+        def __init__(self):
+            self.buffer = BytesIO()
+            self.write_count = 0
+        
+        def write(self, data):
+            self.write_count += 1
+            self.buffer.write(data)
+    
+    with open('test_data/AppAlias.bin', 'rb') as file:
+        header_bytes = file.read(128)
+    header = _MACBINARY_HEADER_CODEC.unpack_from(header_bytes)
+    
+    # Fixed-size record
+    output = WriteCountingStream()
+    _MACBINARY_HEADER_CODEC.write(output, header)
+    assert_equal(1, output.write_count)
+    assert_equal(header_bytes, output.buffer.getvalue())
+    
+    # Record with a dynamic member
+    dynamic_codec = StructCodec([
+        StructMember('id', 'unsigned', 2, None),
+        StructMember('name', 'pascal_string', None, None),
+    ])
+    output = WriteCountingStream()
+    dynamic_codec.write(output, {'id': 1, 'name': u'ABC'})
+    assert_equal(1, output.write_count)
+    assert_equal(b'\x00\x01\x03ABC', output.buffer.getvalue())
+    
+    # pack_into() writes only the record's own bytes of the buffer
+    buffer = bytearray(b'\xFF' * (2 + 128 + 2))
+    _MACBINARY_HEADER_CODEC.pack_into(buffer, 2, header)
+    assert_equal(b'\xFF' * 2 + header_bytes + b'\xFF' * 2, bytes(buffer))
+    try:
+        dynamic_codec.pack_into(bytearray(8), 0, {'id': 1, 'name': u'ABC'})
+        raise AssertionError('Expected ValueError.')
+    except ValueError:
+        pass
+
+
+def _test_integers_round_trip():
+    output = BytesIO()
+    for num_bytes in [1, 2, 3, 4]:
+        write_unsigned(output, num_bytes, 0x818283848586 & ((1 << (8*num_bytes)) - 1))
+        write_signed(output, num_bytes, -2)
+    write_uint32_array(output, [542, 541, 484])
+    
+    input = BytesIO(output.getvalue())
+    actual_output = []
+    for num_bytes in [1, 2, 3, 4]:
+        actual_output.append(read_unsigned(input, num_bytes))
+        actual_output.append(read_signed(input, num_bytes))
+    actual_output.append(read_uint32_array(input, 3))
+    
+    assert_equal(
+        [0x86, -2, 0x8586, -2, 0x848586, -2, 0x83848586, -2, [542, 541, 484]],
+        actual_output,
+        'Integers did not round trip.')
+    
+    # Truncated integers are not silently read
+    for num_bytes in [2, 3]:
+        try:
+            read_unsigned(BytesIO(b'\x01\x02\x03'[:num_bytes - 1]), num_bytes)
+            raise AssertionError('Expected struct.error.')
+        except struct.error:
+            pass
+
+
+def _test_buffer_reader_matches_stream():
+    with open('test_data/AppAlias.bin', 'rb') as file:
+        macbinary_bytes = file.read()
+    
+    expected_macbinary = read_macbinary(BytesIO(macbinary_bytes))
+    actual_macbinary = read_macbinary(BufferReader(macbinary_bytes))
+    
+    # Forks read from a BufferReader are slices of the original buffer
+    resource_fork = actual_macbinary['resource_fork']
+    if not isinstance(resource_fork, memoryview):
+        raise AssertionError('Expected resource fork to be a memoryview.')
+    for section_type in ['data_fork', 'resource_fork', 'comment']:
+        section = actual_macbinary[section_type]
+        if isinstance(section, memoryview):
+            actual_macbinary[section_type] = section.tobytes()
+    assert_equal(expected_macbinary, actual_macbinary,
+        'MacBinary read from BufferReader did not match.')
+    
+    expected_resource_map = read_resource_fork(
+        BytesIO(expected_macbinary['resource_fork']), read_all_resource_names=True)
+    actual_resource_map = read_resource_fork(
+        BufferReader(resource_fork), read_all_resource_names=True)
+    assert_equal(expected_resource_map, actual_resource_map,
+        'Resource map read from BufferReader did not match.')
+    
+    input = BufferReader(b'ab')
+    if at_eof(input) or input.read(2).tobytes() != b'ab' or not at_eof(input):
+        raise AssertionError('BufferReader did not reach EOF as expected.')
+
+
+def test_classicbox_crc():
+    test_throws_no_exceptions(
+        'test_crc_crc16', lambda: \
+        _test_crc16())
+
+
+def _test_crc16():
+    # Check value for CRC-16/XMODEM
+    assert_equal(0x31C3, crc16(b'123456789'))
+    assert_equal(0x31C3, _crc16_update_sliced(b'123456789'))
+    
+    data = bytes(bytearray([(i * 7 + 3) & 0xFF for i in xrange(1027)]))
+    for length in [0, 1, 3, 4, 5, 128, 1027]:
+        assert_equal(
+            crc16(data[:length], 0x1234),
+            _crc16_update_sliced(data[:length], 0x1234),
+            'Table-driven CRC differs from crc16() for %d bytes.' % length)
+    
+    crc = CRC16()
+    for start in xrange(0, len(data), 100):
+        crc.update(memoryview(data)[start:start + 100])
+    assert_equal(crc16(data), crc.value)
+
+
+def test_classicbox_util():
+    test_throws_no_exceptions(
+        'test_util_allocate_and_clone_file', lambda: \
+        _test_allocate_and_clone_file())
+    test_throws_no_exceptions(
+        'test_util_clone_file_after_copy_file_range_fails', lambda: \
+        _test_clone_file_after_copy_file_range_fails())
+
+
+def _test_allocate_and_clone_file():
+    source_filepath = touch_temp(prefix='Source', suffix='.dsk')
+    target_filepath = touch_temp(prefix='Target', suffix='.dsk')
+    try:
+        for preallocate in [False, True]:
+            allocate_file(source_filepath, 800 * 1024, preallocate)
+            with open(source_filepath, 'rb') as file:
+                if file.read() != b'\x00' * (800 * 1024):
+                    raise AssertionError('Allocated file is not zero-filled.')
+        
+        with open(source_filepath, 'r+b') as file:
+            file.seek(400 * 1024)
+            file.write(b'BD')
+        clone_file(source_filepath, target_filepath)
+        with open(source_filepath, 'rb') as source:
+            with open(target_filepath, 'rb') as target:
+                if source.read() != target.read():
+                    raise AssertionError('Cloned file does not match source.')
+    finally:
+        os.remove(source_filepath)
+        os.remove(target_filepath)
+
+
+def _test_clone_file_after_copy_file_range_fails():
+    source_filepath = touch_temp(prefix='Source', suffix='.dsk')
+    target_filepath = touch_temp(prefix='Target', suffix='.dsk')
+    
+    def failing_copy_file_range(source_fd, target_fd, count, offset_src, offset_dst):
+        # Leave the source offset where enumerating data extents would
+        os.lseek(source_fd, 0, os.SEEK_END)
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    
+    original_try_reflink = classicbox.util._try_reflink
+    original_copy_file_range = getattr(os, 'copy_file_range', None)
+    classicbox.util._try_reflink = lambda source, target: False
+    os.copy_file_range = failing_copy_file_range
+    try:
+        allocate_file(source_filepath, 800 * 1024)
+        with open(source_filepath, 'r+b') as file:
+            file.write(b'LK')
+            file.seek(400 * 1024)
+            file.write(b'BD')
+        clone_file(source_filepath, target_filepath)
+        with open(source_filepath, 'rb') as source:
+            with open(target_filepath, 'rb') as target:
+                if source.read() != target.read():
+                    raise AssertionError('Cloned file does not match source.')
+    finally:
+        classicbox.util._try_reflink = original_try_reflink
+        if original_copy_file_range is None:
+            del os.copy_file_range
+        else:
+            os.copy_file_range = original_copy_file_range
+        os.remove(source_filepath)
+        os.remove(target_filepath)
+
+
+def test_classicbox_disk_hfs():
+    # NOTE: Most of classicbox.disk.hfs requires hfsutils and is tested
+    #       indirectly by test_classicbox_alias_file() and test_catalog_create()
+    test_throws_no_exceptions(
+        'test_disk_hfs_template_cache_reuses_template', lambda: \
+        _test_hfs_template_cache_reuses_template())
+    test_throws_no_exceptions(
+        'test_disk_hfs_template_cache_evicts', lambda: \
+        _test_hfs_template_cache_evicts())
+    test_throws_no_exceptions(
+        'test_disk_hfs_set_volume_dates', lambda: \
+        _test_hfs_set_volume_dates())
+
+
+def _write_fake_hfs_disk_image(filepath, size):
+    # Blank disk image with MDB signatures where hformat would write them
+    with open(filepath, 'wb') as file:
+        file.write(b'\x00' * size)
+        for mdb_offset in (1024, size - 1024):
+            file.seek(mdb_offset)
+            file.write(b'BD')
+
+
+def _test_hfs_template_cache_reuses_template():
+    cache_dirpath = mkdtemp()
+    try:
+        cache = HFSTemplateCache(cache_dirpath)
+        
+        # Filename depends on the size and the formatting options
+        filename = HFSTemplateCache._template_filename(u'Boot', 800 * 1024)
+        assert_equal(filename, HFSTemplateCache._template_filename(u'Boot', 800 * 1024))
+        assert_equal(True, filename.startswith('819200-') and filename.endswith('.dsk'))
+        assert_equal(False, filename == HFSTemplateCache._template_filename(u'Apps', 800 * 1024))
+        assert_equal(False, filename == HFSTemplateCache._template_filename(u'Boot', 1440 * 1024))
+        
+        # A cached template is returned without formatting a new one
+        template_filepath = os.path.join(cache_dirpath, filename)
+        _write_fake_hfs_disk_image(template_filepath, 800 * 1024)
+        os.utime(template_filepath, (1000000000, 1000000000))
+        assert_equal(template_filepath, cache.template_for(u'Boot', 800 * 1024))
+        assert_equal(True, os.path.getmtime(template_filepath) > 1000000000,
+            'Expected template to be marked as recently used.')
+    finally:
+        shutil.rmtree(cache_dirpath)
+
+
+def _test_hfs_template_cache_evicts():
+    cache_dirpath = mkdtemp()
+    try:
+        now = int(time.time())
+        def seed(filename, mtime):
+            filepath = os.path.join(cache_dirpath, filename)
+            _write_fake_hfs_disk_image(filepath, 64 * 1024)
+            os.utime(filepath, (mtime, mtime))
+            return filepath
+        def remaining():
+            return sorted(os.listdir(cache_dirpath))
+        
+        oldest = seed('1-oldest.dsk', now - 300)
+        seed('2-older.dsk', now - 200)
+        seed('3-newest.dsk', now - 100)
+        template_bytes = os.stat(oldest).st_blocks * 512
+        
+        # Evicts least recently used templates first...
+        cache = HFSTemplateCache(cache_dirpath, max_bytes=2 * template_bytes)
+        cache.evict()
+        assert_equal(['2-older.dsk', '3-newest.dsk'], remaining())
+        
+        # ...except for the template being kept
+        oldest = seed('1-oldest.dsk', now - 300)
+        cache.evict(_keep_filepath=oldest)
+        assert_equal(['1-oldest.dsk', '3-newest.dsk'], remaining())
+        
+        # Orphaned temporary files are deleted.
+        # Recent temporary files are kept but count toward the limit.
+        seed('TemplateOrphan.tmp', now - 2 * 60 * 60)
+        seed('TemplateInProgress.tmp', now)
+        cache.evict()
+        assert_equal(['3-newest.dsk', 'TemplateInProgress.tmp'], remaining())
+    finally:
+        shutil.rmtree(cache_dirpath)
+
+
+def _test_hfs_set_volume_dates():
+    disk_image_filepath = touch_temp(prefix='Dates', suffix='.dsk')
+    try:
+        size = 800 * 1024
+        _write_fake_hfs_disk_image(disk_image_filepath, size)
+        _hfs_set_volume_dates(disk_image_filepath, 0xC0FFEE00)
+        
+        with open(disk_image_filepath, 'rb') as file:
+            for mdb_offset in (1024, size - 1024):
+                # drSigWord, then drCrDate and drLsMod
+                file.seek(mdb_offset)
+                assert_equal(b'BD', file.read(2))
+                assert_equal([0xC0FFEE00, 0xC0FFEE00], read_uint32_array(file, 2))
+            
+            # Nothing else is altered
+            file.seek(0)
+            assert_equal(b'\x00' * 1024, file.read(1024))
+    finally:
+        os.remove(disk_image_filepath)
 
 
 def test_classicbox_alias_record():
@@ -129,6 +531,479 @@ def test_classicbox_resource_fork():
         'test_resource_fork_write_custom', lambda: \
         resource_fork.main(
             ['test_write_custom', '-']))
+    test_throws_no_exceptions(
+        'test_resource_fork_read_write_compact', lambda: \
+        _test_resource_fork_read_write_compact(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_indexed_lookup_and_edit', lambda: \
+        _test_resource_fork_indexed_lookup_and_edit(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_read_map_in_single_read', lambda: \
+        _test_resource_fork_read_map_in_single_read(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_write_map_in_single_write', lambda: \
+        _test_resource_fork_write_map_in_single_write(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_read_data_lazily', lambda: \
+        _test_resource_fork_read_data_lazily(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_write_streamed_data', lambda: \
+        _test_resource_fork_write_streamed_data())
+    test_throws_no_exceptions(
+        'test_resource_fork_update_in_place', lambda: \
+        _test_resource_fork_update_in_place())
+    test_throws_no_exceptions(
+        'test_resource_fork_write_deduplicated', lambda: \
+        _test_resource_fork_write_deduplicated())
+    test_throws_no_exceptions(
+        'test_resource_fork_diff', lambda: \
+        _test_resource_fork_diff())
+    test_throws_no_exceptions(
+        'test_resource_fork_read_columnar_map', lambda: \
+        _test_resource_fork_read_columnar_map(SAMPLES[1][1]))
+    test_throws_no_exceptions(
+        'test_resource_fork_extract', lambda: \
+        _test_resource_fork_extract(SAMPLES[0][1], SAMPLES[1][1]))
+
+
+def _test_resource_fork_read_write_compact(resource_fork_filepath):
+    with open(resource_fork_filepath, 'rb') as input:
+        resource_map = read_resource_fork(input, read_everything=True, compact=True)
+    
+    resource = resource_map['resource_types'][0]['resources'][0]
+    if not isinstance(resource, ResourceReference) or hasattr(resource, '__dict__'):
+        raise AssertionError('Expected compact resource reference.')
+    
+    # Compact records must survive pickling
+    resource_map = pickle.loads(pickle.dumps(resource_map, pickle.HIGHEST_PROTOCOL))
+    
+    output = BytesIO()
+    write_resource_fork(output, resource_map)
+    with open(resource_fork_filepath, 'rb') as file:
+        assert_equal(file.read(), output.getvalue(),
+            'Compact resource map was not written exactly.')
+
+
+def _test_resource_fork_indexed_lookup_and_edit(resource_fork_filepath):
+    with open(resource_fork_filepath, 'rb') as input:
+        fork = ResourceFork(read_resource_fork(input, read_everything=True))
+    
+    # Lookup
+    assert_equal(4, len(fork))
+    assert_equal(u'ABC', fork.get(u'alis', 13)['name'])
+    assert_equal(128, fork.get_named(u'alis', u'ABCD')['id'])
+    assert_equal(None, fork.get(u'alis', 14))
+    assert_equal(True, (u'alis', -10) in fork)
+    assert_equal([-10, 7, 13, 128], [r['id'] for r in fork.resources_of_type(u'alis')])
+    
+    # Edit
+    fork.add(u'vers', {'id': 1, 'name': u'', 'attributes': 0, 'data': b'1.0'})
+    try:
+        fork.add(u'vers', {'id': 1, 'name': u'', 'attributes': 0, 'data': b'2.0'})
+        raise AssertionError('Expected duplicate resource to be rejected.')
+    except ValueError:
+        pass
+    fork.remove(u'alis', 7)
+    fork.replace(u'alis', {'id': 13, 'name': u'XYZ', 'attributes': 0, 'data': b'new'})
+    assert_equal(None, fork.get_named(u'alis', u'ABC'))
+    assert_equal(13, fork.get_named(u'alis', u'XYZ')['id'])
+    
+    # Write and read back
+    output = BytesIO()
+    write_resource_fork(output, fork)
+    output.seek(0)
+    fork = ResourceFork(read_resource_fork(output, read_everything=True))
+    assert_equal([u'alis', u'vers'], fork.type_codes())
+    assert_equal(
+        [(u'alis', -10), (u'alis', 13), (u'alis', 128), (u'vers', 1)],
+        [(code, resource['id']) for (code, resource) in fork])
+    assert_equal(b'new', fork.get(u'alis', 13)['data'])
+    assert_equal(b'1.0', fork.get(u'vers', 1)['data'])
+    
+    fork.remove(u'vers', 1)
+    assert_equal([u'alis'], fork.type_codes())
+
+
+def _test_resource_fork_read_map_in_single_read(resource_fork_filepath):
+    class ReadCountingStream(object):
+        def __init__(self, input):
+            self.input = input
+            self.read_count = 0
+        
+        def read(self, num_bytes=-1):
+            self.read_count += 1
+            return self.input.read(num_bytes)
+        
+        def seek(self, offset):
+            self.input.seek(offset)
+    
+    with open(resource_fork_filepath, 'rb') as input:
+        stream = ReadCountingStream(input)
+        resource_map = read_resource_fork(stream, read_all_resource_names=True)
+        
+        # Fork header, then resource map
+        assert_equal(2, stream.read_count)
+        assert_equal(
+            [u'A', u'AB', u'ABC', u'ABCD'],
+            [resource['name'] for resource in resource_map['resource_types'][0]['resources']])
+
+
+def _test_resource_fork_write_map_in_single_write(resource_fork_filepath):
+    class WriteCountingStream(object):
+        def __init__(self):
+            self.buffer = BytesIO()
+            self.write_lengths = []
+        
+        def write(self, data):
+            self.write_lengths.append(len(data))
+            self.buffer.write(data)
+        
+        def tell(self):
+            return self.buffer.tell()
+    
+    with open(resource_fork_filepath, 'rb') as input:
+        resource_map = read_resource_fork(input, read_everything=True)
+    output = WriteCountingStream()
+    write_resource_fork(output, resource_map)
+    
+    # Fork header (including its reserved area) first,
+    # then resource map last, each in a single write
+    output.buffer.seek(0)
+    resource_fork_header = read_resource_fork(output.buffer)['resource_fork_header']
+    assert_equal(
+        resource_fork_header['offset_to_resource_data_area'],
+        output.write_lengths[0])
+    assert_equal(
+        resource_fork_header['resource_map_length'],
+        output.write_lengths[-1])
+
+
+def _test_resource_fork_read_data_lazily(resource_fork_filepath):
+    with open(resource_fork_filepath, 'rb') as input:
+        resource_fork_bytes = input.read()
+    expected_resources = read_resource_fork(
+        BytesIO(resource_fork_bytes), read_everything=True)['resource_types'][0]['resources']
+    
+    for open_input in [lambda: resource_fork_bytes, lambda: BytesIO(resource_fork_bytes)]:
+        cache = ResourceDataCache(max_bytes=1)
+        resources = read_resource_fork(
+            open_input(), lazy_resource_data=True,
+            resource_data_cache=cache)['resource_types'][0]['resources']
+        assert_equal(0, len(cache))
+        
+        for (expected_resource, resource) in zip(expected_resources, resources):
+            assert_equal(len(expected_resource['data']), len(resource['data']))
+            assert_equal(expected_resource['data'], resource['data'].tobytes())
+            
+            # Only the most recently read data fits within the budget
+            assert_equal(1, len(cache))
+        
+        # Lazily read resource data can be written
+        output = BytesIO()
+        write_resource_fork(output, read_resource_fork(open_input(), lazy_resource_data=True))
+        assert_equal(resource_fork_bytes, output.getvalue())
+    
+    # Data read from an mmap is a zero-copy slice of it
+    with open(resource_fork_filepath, 'rb') as input:
+        resource_fork_mmap = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        resources = read_resource_fork(
+            resource_fork_mmap, lazy_resource_data=True)['resource_types'][0]['resources']
+        data = resources[0]['data'].get()
+        assert_equal(True, isinstance(data, memoryview))
+        assert_equal(expected_resources[0]['data'], data.tobytes())
+        del data, resources
+    finally:
+        # (Cached resource data refers to its cache, so collect the cycle
+        #  to release the last slice of the mmap before closing it)
+        gc.collect()
+        resource_fork_mmap.close()
+
+
+def _test_resource_fork_write_streamed_data():
+    source = BytesIO(b'0123456789' * 1000)
+    calls = []
+    def make_data():
+        calls.append(len(calls))
+        return b'called'
+    
+    fork = ResourceFork()
+    fork.add(u'TEXT', {'id': 1, 'name': u'', 'attributes': 0, 'data': b'in memory'})
+    fork.add(u'TEXT', {'id': 2, 'name': u'', 'attributes': 0, 'data': BytesIO(b'stream')})
+    fork.add(u'TEXT', {'id': 3, 'name': u'', 'attributes': 0, 'data': (source, 9990, 10)})
+    fork.add(u'TEXT', {'id': 4, 'name': u'', 'attributes': 0, 'data': memoryview(b'view')})
+    fork.add(u'TEXT', {'id': 5, 'name': u'', 'attributes': 0, 'data': make_data})
+    fork.add(u'TEXT', {'id': 6, 'name': u'', 'attributes': 0, 'data': make_data, 'data_length': 6})
+    
+    output = BytesIO()
+    write_resource_fork(output, fork)
+    assert_equal([0, 1], calls)
+    
+    output.seek(0)
+    fork = ResourceFork(read_resource_fork(output, read_everything=True))
+    assert_equal(
+        [b'in memory', b'stream', b'0123456789', b'view', b'called', b'called'],
+        [resource['data'] for resource in fork.resources_of_type(u'TEXT')])
+
+
+def _test_resource_fork_update_in_place():
+    fork = ResourceFork()
+    fork.add(u'TEXT', {'id': 1, 'name': u'One', 'attributes': 0, 'data': b'first'})
+    fork.add(u'TEXT', {'id': 2, 'name': u'', 'attributes': 0, 'data': b'second'})
+    fork.add(u'STR ', {'id': 3, 'name': u'', 'attributes': 0, 'data': b'third'})
+    stream = BytesIO()
+    write_resource_fork(stream, fork)
+    original_length = len(stream.getvalue())
+    
+    def read_data():
+        stream.seek(0)
+        fork = ResourceFork(read_resource_fork(stream, read_everything=True))
+        return [(code, resource['id'], resource['name'], resource['data'])
+            for (code, resource) in fork]
+    
+    # Shorter data is written over the old data
+    assert_equal(True, update_resource_in_place(stream, u'TEXT', 1, b'1st'))
+    assert_equal(original_length, len(stream.getvalue()))
+    assert_equal(
+        [(u'TEXT', 1, u'One', b'1st'), (u'TEXT', 2, u'', b'second'), (u'STR ', 3, u'', b'third')],
+        read_data())
+    
+    # Longer data is appended, moving the resource map
+    assert_equal(False, update_resource_in_place(stream, u'TEXT', 1, b'the first resource'))
+    assert_equal(
+        [(u'TEXT', 1, u'One', b'the first resource'), (u'TEXT', 2, u'', b'second'), (u'STR ', 3, u'', b'third')],
+        read_data())
+    
+    # The old slot's unused space stays available to the resource
+    assert_equal(True, update_resource_in_place(stream, u'TEXT', 1, b'the 1st resource'))
+    assert_equal(u'the 1st resource', read_data()[0][3].decode('ascii'))
+    
+    # An append interrupted before the fork header is written
+    # leaves the original fork intact
+    class InterruptedBeforeHeader(BytesIO):
+        def write(self, data):
+            if self.tell() == 0:
+                raise IOError('Interrupted.')
+            return BytesIO.write(self, data)
+    interrupted = InterruptedBeforeHeader(stream.getvalue())
+    try:
+        update_resource_in_place(interrupted, u'STR ', 3, b'third' * 100)
+        raise AssertionError('Expected IOError.')
+    except IOError:
+        pass
+    stream = interrupted
+    assert_equal(
+        [(u'TEXT', 1, u'One', b'the 1st resource'), (u'TEXT', 2, u'', b'second'), (u'STR ', 3, u'', b'third')],
+        read_data())
+    
+    try:
+        update_resource_in_place(stream, u'TEXT', 4, b'missing')
+        raise AssertionError('Expected KeyError.')
+    except KeyError:
+        pass
+
+
+def _test_resource_fork_write_deduplicated():
+    icon = b'\x00\xFF' * 64
+    fork = ResourceFork()
+    fork.add(u'ICN#', {'id': 128, 'name': u'', 'attributes': 0, 'data': icon})
+    fork.add(u'ICN#', {'id': 129, 'name': u'', 'attributes': 0, 'data': BytesIO(icon)})
+    fork.add(u'ICN#', {'id': 130, 'name': u'', 'attributes': 0, 'data': lambda: icon})
+    fork.add(u'STR ', {'id': 128, 'name': u'', 'attributes': 0, 'data': b'same length'})
+    fork.add(u'STR ', {'id': 129, 'name': u'', 'attributes': 0, 'data': b'SAME LENGTH'})
+    
+    output = BytesIO()
+    assert_equal(2 * (4 + len(icon)), write_resource_fork(output, fork, deduplicate=True))
+    output.seek(0)
+    resource_map = read_resource_fork(output, read_everything=True)
+    data_offsets = [
+        resource['offset_from_resource_data_area_to_data']
+        for type in resource_map['resource_types'] for resource in type['resources']]
+    assert_equal(3, len(set(data_offsets)))
+    assert_equal(
+        [icon, icon, icon, b'same length', b'SAME LENGTH'],
+        [resource['data']
+            for type in resource_map['resource_types'] for resource in type['resources']])
+    
+    # Compaction drops the space left behind by updates:
+    # the old data and the old resource map
+    output.seek(0)
+    resource_map_length = read_resource_fork(output)['resource_fork_header']['resource_map_length']
+    update_resource_in_place(output, u'STR ', 128, b'a longer string')
+    bytes_unused = 4 + len(b'same length') + resource_map_length
+    compacted = BytesIO()
+    output.seek(0)
+    assert_equal(bytes_unused, int(compact_resource_fork(output, compacted)))
+    assert_equal(len(output.getvalue()) - bytes_unused, len(compacted.getvalue()))
+    compacted.seek(0)
+    assert_equal(
+        [icon, icon, icon, b'a longer string', b'SAME LENGTH'],
+        [resource['data'] for type in read_resource_fork(compacted, read_everything=True)['resource_types']
+            for resource in type['resources']])
+
+
+def _test_resource_fork_diff():
+    def write_fork(resources):
+        fork = ResourceFork()
+        for (code, id, name, attributes, data) in resources:
+            fork.add(code, {'id': id, 'name': name, 'attributes': attributes, 'data': data})
+        output = BytesIO()
+        write_resource_fork(output, fork)
+        return output.getvalue()
+    
+    fork1 = write_fork([
+        (u'STR ', 128, u'Same', 0, b'unchanged'),
+        (u'STR ', 129, u'', 0, b'same length'),
+        (u'STR ', 130, u'Old', 0, b'renamed'),
+        (u'ICN#', 128, u'', 0, b'removed'),
+        (u'MENU', 1, u'', 0, b'short'),
+    ])
+    fork2 = write_fork([
+        (u'STR ', 128, u'Same', 0, b'unchanged'),
+        (u'STR ', 129, u'', 0, b'SAME LENGTH'),
+        (u'STR ', 130, u'New', 32, b'renamed'),
+        (u'MENU', 1, u'', 0, b'longer data'),
+        (u'MENU', 2, u'', 0, b'added'),
+    ])
+    
+    resource_fork_diff = diff_resource_forks(BytesIO(fork1), fork2)
+    assert_equal([(u'MENU', 2)], resource_fork_diff.added)
+    assert_equal([(u'ICN#', 128)], resource_fork_diff.removed)
+    assert_equal([
+        ResourceChange(u'MENU', 1, ['data']),
+        ResourceChange(u'STR ', 129, ['data']),
+        ResourceChange(u'STR ', 130, ['name', 'attributes']),
+    ], resource_fork_diff.changed)
+    
+    resource_fork_diff = diff_resource_forks(fork1, fork1)
+    assert_equal(([], [], []), tuple(resource_fork_diff))
+
+
+def _test_resource_fork_read_columnar_map(resource_fork_filepath):
+    with open(resource_fork_filepath, 'rb') as input:
+        resource_fork_bytes = input.read()
+    expected_fork = ResourceFork(read_resource_fork(BytesIO(resource_fork_bytes), read_everything=True))
+    columnar_map = read_columnar_resource_map(resource_fork_bytes)
+    
+    assert_equal(len(expected_fork), len(columnar_map))
+    assert_equal(expected_fork.type_codes(), columnar_map.type_codes())
+    for ((expected_code, expected), (code, actual)) in zip(expected_fork, columnar_map):
+        assert_equal(expected_code, code)
+        for key in ('id', 'name', 'attributes', 'offset_from_resource_data_area_to_data'):
+            assert_equal(expected[key], actual[key])
+        assert_equal(expected['data'], actual['data'].tobytes())
+        assert_equal(expected['name'], columnar_map.get_name(code, expected['id']))
+    
+    assert_equal(True, (u'alis', 13) in columnar_map)
+    assert_equal(False, (u'alis', 14) in columnar_map)
+    assert_equal(False, (u'vers', 13) in columnar_map)
+    try:
+        columnar_map.get_name(u'alis', 14)
+        raise AssertionError('Expected KeyError.')
+    except KeyError:
+        pass
+    assert_equal(u'ABC', columnar_map.get(u'alis', 13)['name'])
+    assert_equal(None, columnar_map.get(u'alis', 14))
+    assert_equal(None, columnar_map.get(u'vers', 13))
+    assert_equal([-10, 7, 13, 128], list(columnar_map.resource_types[0].ids))
+    
+    # Resources from a columnar map can be written out
+    output = BytesIO()
+    write_resource_fork(output, {'resource_types': [
+        {'code': code, 'resources': columnar_map.resources_of_type(code)}
+        for code in columnar_map.type_codes()]})
+    output.seek(0)
+    assert_equal(
+        [resource['data'] for (_, resource) in expected_fork],
+        [resource['data'] for (_, resource) in
+            ResourceFork(read_resource_fork(output, read_everything=True))])
+
+
+def _test_resource_fork_extract(simple_resource_fork_filepath, complex_resource_fork_filepath):
+    with open(simple_resource_fork_filepath, 'rb') as input:
+        simple_resource_fork = input.read()
+    with open(complex_resource_fork_filepath, 'rb') as input:
+        complex_resource_fork = input.read()
+    with open('test_data/AppAlias.bin', 'rb') as input:
+        macbinary = input.read()
+    
+    # AppleDouble file with a Finder info entry, then a resource fork entry
+    apple_double = (
+        struct.pack('>II16sH', APPLE_DOUBLE_MAGIC_NUMBER, 0x00020000, b'', 2) +
+        struct.pack('>III', ENTRY_FINDER_INFO, 50, 32) +
+        struct.pack('>III', ENTRY_RESOURCE_FORK, 82, len(complex_resource_fork)) +
+        (b'\x00' * 32) +
+        complex_resource_fork)
+    
+    input_dirpath = mkdtemp()
+    output_dirpath = mkdtemp()
+    try:
+        os.mkdir(os.path.join(input_dirpath, 'Folder'))
+        for (filename, content) in [
+                ('AppAlias.bin', macbinary),
+                ('AppAlias.rsrc', simple_resource_fork),
+                ('AppAlias copy.rsrc', simple_resource_fork),
+                (os.path.join('Folder', '._MultipleResource'), apple_double),
+                ('ReadMe.txt', b'Not a resource fork.')]:
+            with open(os.path.join(input_dirpath, filename), 'wb') as file:
+                file.write(content)
+        
+        (format_counts, resource_count) = resource_fork.extract_resources(
+            output_dirpath, [input_dirpath], [u'alis'], processes=2)
+        assert_equal(
+            {'apple_double': 1, 'macbinary': 1, 'resource_fork': 2, 'unrecognized': 1},
+            format_counts)
+        assert_equal(7, resource_count)
+        
+        with open(os.path.join(output_dirpath, 'manifest.jsonl'), 'rb') as manifest_file:
+            entries = [json.loads(line) for line in manifest_file]
+        assert_equal(7, len(entries))
+        
+        expected_fork = ResourceFork(read_resource_fork(
+            BytesIO(complex_resource_fork), read_everything=True))
+        for entry in entries:
+            with open(os.path.join(output_dirpath, entry['sha1'][:2], entry['sha1']), 'rb') as file:
+                data = file.read()
+            assert_equal(hashlib.sha1(data).hexdigest(), str(entry['sha1']))
+            assert_equal(entry['length'], len(data))
+            if entry['format'] == 'apple_double':
+                assert_equal(expected_fork.get(u'alis', entry['id'])['data'], data)
+        
+        # Identical resources are stored once
+        # (Both copies of the simple fork contain the same resource,
+        #  as do three of the resources of the complex fork)
+        assert_equal(
+            4, len(set([entry['sha1'] for entry in entries])))
+        
+        # Only the requested types are extracted
+        (format_counts, resource_count) = resource_fork.extract_resources(
+            output_dirpath, [input_dirpath], [u'vers'], processes=1)
+        assert_equal(0, resource_count)
+        
+        # Type codes given on the command line are padded to 4 characters
+        # (Filename is not valid in the filesystem encoding)
+        strings_filepath = os.path.join(input_dirpath, 'Caf\x8e Strings.rsrc')
+        with open(strings_filepath, 'wb') as file:
+            write_resource_fork(file, {'resource_types': [{'code': u'STR ', 'resources': [
+                {'id': 128, 'name': u'', 'attributes': 0, 'data': b'Hello'}]}]})
+        resource_fork.main(
+            ['extract', '--processes', '1', '--type', 'STR', output_dirpath, strings_filepath])
+        with open(os.path.join(output_dirpath, 'manifest.jsonl'), 'rb') as manifest_file:
+            entries = [json.loads(line) for line in manifest_file]
+        assert_equal(
+            (decode_filepath(strings_filepath), u'STR ', 128),
+            (entries[-1]['filepath'], entries[-1]['type'], entries[-1]['id']))
+        
+        # Type codes longer than 4 characters are rejected
+        try:
+            resource_fork.main(
+                ['extract', '--type', 'STRING', output_dirpath, strings_filepath])
+            raise AssertionError('Expected SystemExit.')
+        except SystemExit:
+            pass
+    finally:
+        shutil.rmtree(input_dirpath)
+        shutil.rmtree(output_dirpath)
 
 
 def test_classicbox_macbinary():
@@ -146,6 +1021,203 @@ def test_classicbox_macbinary():
         'test_macbinary_write_custom', lambda: \
         macbinary_file.main(
             ['test_write_custom', '-']))
+    test_throws_no_exceptions(
+        'test_macbinary_read_header_lazily', lambda: \
+        _test_macbinary_read_header_lazily(macbinary_filepath))
+    test_throws_no_exceptions(
+        'test_macbinary_read_forks_as_streams', lambda: \
+        _test_macbinary_read_forks_as_streams(macbinary_filepath))
+    test_throws_no_exceptions(
+        'test_macbinary_write_forks_from_streams', lambda: \
+        _test_macbinary_write_forks_from_streams(macbinary_filepath))
+    test_throws_no_exceptions(
+        'test_macbinary_sniff', lambda: \
+        _test_macbinary_sniff(macbinary_filepath))
+    test_throws_no_exceptions(
+        'test_macbinary_open_mmap', lambda: \
+        _test_macbinary_open_mmap(macbinary_filepath))
+
+
+def _test_macbinary_read_header_lazily(macbinary_filepath):
+    with open(macbinary_filepath, 'rb') as input:
+        expected_header = read_macbinary(input)
+        for section_type in ['data_fork', 'resource_fork', 'comment']:
+            del expected_header[section_type]
+    
+    with open(macbinary_filepath, 'rb') as input:
+        header = read_macbinary_header(input)
+        
+        # Only accessed fields should be decoded
+        (file_type, file_creator) = (header['file_type'], header['file_creator'])
+        if sorted(header._values.keys()) != ['file_creator', 'file_type']:
+            raise AssertionError('Expected only accessed fields to be decoded.')
+        
+        assert_equal(expected_header, dict(header),
+            'Lazily read header did not match header read by read_macbinary().')
+
+
+def _test_macbinary_read_forks_as_streams(macbinary_filepath):
+    with open(macbinary_filepath, 'rb') as input:
+        expected_macbinary = read_macbinary(input)
+    
+    with open(macbinary_filepath, 'rb') as input:
+        with MacBinaryReader(input) as reader:
+            # Read forks out of order and in pieces
+            for section_type in ['comment', 'resource_fork', 'data_fork']:
+                section = getattr(reader, section_type)
+                actual_section = b''
+                while not at_eof(section):
+                    actual_section += section.read(100)
+                assert_equal(expected_macbinary[section_type], actual_section,
+                    'Section %s did not match section read by read_macbinary().' % section_type)
+                assert_equal(b'', section.read())
+            
+            # Parse a fork directly from its stream
+            reader.resource_fork.seek(0)
+            assert_equal(
+                read_resource_fork(BytesIO(expected_macbinary['resource_fork'])),
+                read_resource_fork(reader.resource_fork))
+
+
+def _test_macbinary_write_forks_from_streams(macbinary_filepath):
+    with open(macbinary_filepath, 'rb') as input:
+        expected_output = input.read()
+    
+    class WriteOnlyStream(object):
+        def __init__(self):
+            self.buffer = BytesIO()
+        
+        def write(self, data):
+            self.buffer.write(data)
+    
+    # Forks as streams, output not seekable
+    with open(macbinary_filepath, 'rb') as input:
+        reader = MacBinaryReader(input)
+        macbinary = dict(reader.header)
+        macbinary.update({
+            'data_fork': reader.data_fork,
+            'resource_fork': reader.resource_fork,
+            'comment': reader.comment.read(),
+        })
+        output = WriteOnlyStream()
+        write_macbinary(output, macbinary)
+    assert_equal(expected_output, output.buffer.getvalue(),
+        'MacBinary written from fork streams did not match original.')
+    
+    # Forks as files
+    with open(macbinary_filepath, 'rb') as input:
+        macbinary = read_macbinary(input)
+    fork_filepaths = {}
+    try:
+        for section_type in ['data_fork', 'resource_fork']:
+            fork_filepaths[section_type] = touch_temp(suffix='.' + section_type)
+            with open(fork_filepaths[section_type], 'wb') as fork_file:
+                fork_file.write(macbinary.pop(section_type))
+            del macbinary[section_type + '_length']
+        
+        output = WriteOnlyStream()
+        write_macbinary_from_files(output, macbinary,
+            fork_filepaths['data_fork'], fork_filepaths['resource_fork'])
+        assert_equal(expected_output, output.buffer.getvalue(),
+            'MacBinary written from fork files did not match original.')
+    finally:
+        for fork_filepath in fork_filepaths.values():
+            os.remove(fork_filepath)
+    
+    # Stale fork lengths are ignored for seekable fork streams
+    with open(macbinary_filepath, 'rb') as input:
+        macbinary = read_macbinary(input)
+    macbinary.update({
+        'data_fork': BytesIO(macbinary['data_fork']),
+        'resource_fork': BytesIO(macbinary['resource_fork']),
+        'data_fork_length': macbinary['data_fork_length'] + 1,
+        'resource_fork_length': 0,
+    })
+    output = WriteOnlyStream()
+    write_macbinary(output, macbinary)
+    assert_equal(expected_output, output.buffer.getvalue(),
+        'MacBinary written with stale fork lengths did not match original.')
+    
+    # Fork lengths are required for unsized, non-seekable fork streams
+    class ReadOnlyStream(object):
+        def __init__(self, data):
+            self._buffer = BytesIO(data)
+        
+        def read(self, size=-1):
+            return self._buffer.read(size)
+    
+    with open(macbinary_filepath, 'rb') as input:
+        macbinary = read_macbinary(input)
+    macbinary.update({
+        'data_fork': ReadOnlyStream(macbinary['data_fork']),
+        'resource_fork': ReadOnlyStream(macbinary['resource_fork']),
+    })
+    output = WriteOnlyStream()
+    write_macbinary(output, macbinary)
+    assert_equal(expected_output, output.buffer.getvalue(),
+        'MacBinary written from non-seekable fork streams did not match original.')
+
+
+def _test_macbinary_sniff(macbinary_filepath):
+    with open(macbinary_filepath, 'rb') as input:
+        macbinary_ii = input.read()
+    macbinary = read_macbinary(BytesIO(macbinary_ii))
+    macbinary['signature'] = b'mBIN'
+    macbinary_iii = write_macbinary_to_buffer(macbinary).getvalue()
+    macbinary_i = macbinary_ii[:99] + b'\x00' * 27 + macbinary_ii[126:]
+    
+    assert_equal(MACBINARY_II, sniff_macbinary(macbinary_ii))
+    assert_equal(MACBINARY_II, sniff_macbinary(memoryview(macbinary_ii), len(macbinary_ii)))
+    assert_equal(MACBINARY_III, sniff_macbinary(macbinary_iii))
+    assert_equal(MACBINARY_I, sniff_macbinary(macbinary_i))
+    
+    # Not MacBinary
+    assert_equal(None, sniff_macbinary(b'\x00' * 128))
+    assert_equal(None, sniff_macbinary(b'Plain text. ' * 20))
+    assert_equal(None, sniff_macbinary(macbinary_ii[:100]))
+    assert_equal(None, sniff_macbinary(macbinary_ii, len(macbinary_ii) - 128),
+        'Expected truncated file to be rejected.')
+    
+    # MacBinary II/III version fields must be readable
+    def with_version_fields(macbinary, version_fields):
+        header = macbinary[:120] + struct.pack('>HBB', *version_fields)
+        return header + struct.pack('>H', crc16(header)) + macbinary[126:]
+    assert_equal(MACBINARY_II, sniff_macbinary(with_version_fields(macbinary_ii, (0, 129, 129))))
+    assert_equal(None, sniff_macbinary(with_version_fields(macbinary_ii, (0, 128, 129))),
+        'Expected version older than MacBinary II to be rejected.')
+    assert_equal(None, sniff_macbinary(with_version_fields(macbinary_ii, (0, 131, 131))),
+        'Expected minimum version newer than MacBinary III to be rejected.')
+    
+    # A secondary header must fit in the file along with the forks
+    with_second_header = with_version_fields(macbinary_ii, (200, 129, 129))
+    assert_equal(MACBINARY_II, sniff_macbinary(with_second_header))
+    assert_equal(None, sniff_macbinary(with_second_header, len(macbinary_ii)))
+    
+    assert_equal(
+        [MACBINARY_III, None, MACBINARY_I],
+        sniff_macbinary_batch([macbinary_iii, b'\x00' * 128, macbinary_i]))
+    assert_equal(
+        [MACBINARY_II, None],
+        sniff_macbinary_batch([macbinary_ii, macbinary_ii], [len(macbinary_ii), 128]))
+
+
+def _test_macbinary_open_mmap(macbinary_filepath):
+    with open(macbinary_filepath, 'rb') as input:
+        expected_macbinary = read_macbinary(input)
+    
+    with open_macbinary_mmap(macbinary_filepath) as macbinary:
+        assert_equal(expected_macbinary['filename'], macbinary.header['filename'])
+        for section_type in ['data_fork', 'resource_fork', 'comment']:
+            assert_equal(expected_macbinary[section_type],
+                read_until_eof(BufferReader(getattr(macbinary, section_type)), None),
+                'Section %s did not match section read by read_macbinary().' % section_type)
+        
+        # Parse resource fork directly from the mapping
+        resource_map = read_resource_fork(macbinary.resource_fork)
+        assert_equal(
+            read_resource_fork(BytesIO(expected_macbinary['resource_fork'])),
+            resource_map)
+        del resource_map
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -192,6 +1264,141 @@ def _test_create_alias_file():
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+def test_macbinary_index():
+    test_throws_no_exceptions(
+        'test_macbinary_index_update_and_find', lambda: \
+        _test_macbinary_index_update_and_find())
+
+
+def _test_macbinary_index_update_and_find():
+    library_dirpath = mkdtemp()
+    index_filepath = touch_temp(suffix='.sqlite')
+    try:
+        apps_dirpath = os.path.join(library_dirpath, 'Apps')
+        os.mkdir(apps_dirpath)
+        for i in xrange(70):
+            shutil.copyfile('test_data/AppAlias.bin',
+                os.path.join(apps_dirpath, 'AppAlias %d.bin' % i))
+        with open(os.path.join(library_dirpath, 'Zeros.bin'), 'wb') as file:
+            file.write(b'\x00' * 128)
+        # (Filename that is not valid in the filesystem encoding)
+        shutil.copyfile('test_data/AppAlias.bin',
+            os.path.join(library_dirpath, 'Caf\x8e.bin'))
+        with open(os.path.join(library_dirpath, 'ReadMe.txt'), 'wb') as file:
+            file.write(b'Not a MacBinary file.')
+        
+        # Index using several processes
+        assert_equal((73, 73), macbinary_index.update_macbinary_index(
+            index_filepath, [library_dirpath], processes=2))
+        aliases = macbinary_index.find_macbinary_files(
+            index_filepath, file_type=u'adrp', file_creator=u'AQt7')
+        assert_equal(71, len(aliases))
+        assert_equal(
+            (u'AppAlias', 0, 522),
+            (aliases[0]['filename'], aliases[0]['data_fork_length'], aliases[0]['resource_fork_length']))
+        assert_equal(71, len(macbinary_index.find_macbinary_files(index_filepath)))
+        assert_equal(
+            [decode_filepath(os.path.join(library_dirpath, 'Caf\x8e.bin'))],
+            [alias['filepath'] for alias in aliases if 'Caf' in alias['filepath']])
+        
+        # Only changed files should be reread
+        with open(os.path.join(library_dirpath, 'ReadMe.txt'), 'ab') as file:
+            file.write(b'!')
+        os.remove(os.path.join(apps_dirpath, 'AppAlias 0.bin'))
+        assert_equal((72, 1), macbinary_index.update_macbinary_index(
+            index_filepath, [library_dirpath], processes=1))
+        assert_equal(70, len(macbinary_index.find_macbinary_files(index_filepath)))
+    finally:
+        shutil.rmtree(library_dirpath)
+        os.remove(index_filepath)
+
+
+def test_macbinary_normalize():
+    test_throws_no_exceptions(
+        'test_macbinary_normalize_in_place', lambda: \
+        _test_macbinary_normalize_in_place())
+    test_throws_no_exceptions(
+        'test_macbinary_normalize_leaves_unsupported_files', lambda: \
+        _test_macbinary_normalize_leaves_unsupported_files())
+
+
+def _test_macbinary_normalize_in_place():
+    library_dirpath = mkdtemp()
+    try:
+        with open('test_data/AppAlias.bin', 'rb') as input:
+            macbinary_ii = input.read()
+        macbinary = read_macbinary(BytesIO(macbinary_ii))
+        macbinary['signature'] = b'mBIN'
+        macbinary['version'] = 130
+        macbinary_iii = write_macbinary_to_buffer(macbinary).getvalue()
+        
+        # (Including a filename that is not valid in the filesystem encoding)
+        for (filename, content) in [
+                ('AppAlias II.bin', macbinary_ii),
+                ('AppAlias III.bin', macbinary_iii),
+                ('Caf\x8e.bin', macbinary_ii),
+                ('ReadMe.txt', b'Not a MacBinary file.')]:
+            with open(os.path.join(library_dirpath, filename), 'wb') as file:
+                file.write(content)
+        
+        assert_equal(
+            {'canonical': 1, 'normalized': 2, 'not_macbinary': 1},
+            macbinary_normalize.normalize_macbinary_files(library_dirpath, processes=2))
+        for filename in ['AppAlias II.bin', 'AppAlias III.bin', 'Caf\x8e.bin']:
+            with open(os.path.join(library_dirpath, filename), 'rb') as file:
+                assert_equal(macbinary_iii, file.read(),
+                    'Expected %s to be normalized to canonical MacBinary III.' % filename)
+        
+        # Processed files should be skipped by subsequent runs
+        assert_equal(
+            {'unchanged': 4},
+            macbinary_normalize.normalize_macbinary_files(library_dirpath, processes=1))
+    finally:
+        shutil.rmtree(library_dirpath)
+
+
+def _test_macbinary_normalize_leaves_unsupported_files():
+    with open('test_data/AppAlias.bin', 'rb') as input:
+        macbinary_ii = input.read()
+    def with_header_field(offset, format, value):
+        header = macbinary_ii[:offset] + struct.pack(format, value)
+        header += macbinary_ii[len(header):124]
+        return header + struct.pack('>H', crc16(header)) + macbinary_ii[126:]
+    
+    library_dirpath = mkdtemp()
+    try:
+        # Secondary header, and comment that runs past the end of the file
+        unsupported_files = [
+            ('Second Header.bin', with_header_field(120, '>H', 128) + b'\x00' * 128),
+            ('Long Comment.bin', with_header_field(99, '>H', 0xFFFF)),
+        ]
+        for (filename, content) in unsupported_files:
+            with open(os.path.join(library_dirpath, filename), 'wb') as file:
+                file.write(content)
+        
+        assert_equal(
+            {'error': 2},
+            macbinary_normalize.normalize_macbinary_files(library_dirpath, processes=1))
+        for (filename, content) in unsupported_files:
+            with open(os.path.join(library_dirpath, filename), 'rb') as file:
+                assert_equal(content, file.read(),
+                    'Expected %s to be left untouched.' % filename)
+        
+        # A file that vanishes while being processed is reported once, not raised
+        macbinary_normalize._init_worker(set())
+        old_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            entry = macbinary_normalize._normalize_file((library_dirpath, 'Missing.bin'))
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = old_stderr
+        assert_equal(('error', None), (entry['status'], entry['size']))
+        assert_equal(1, errors.count('Unable to normalize'))
+    finally:
+        shutil.rmtree(library_dirpath)
+
+
 def test_catalog_create():
     test_throws_no_exceptions(
         'test_catalog_create_output', lambda: \